@@ -0,0 +1,113 @@
+from datetime import datetime, date, time, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from models import db, Cita, Paciente, DURACION_CITA_DEFECTO
+
+# Appointment calendar helpers: range queries on cita.fecha_hora, overlap
+# detection and free-slot search. All of them bound the scan with the
+# (recurso_id|paciente_id, fecha_hora) indexes. Appointments of soft-deleted
+# patients are left out everywhere: they neither show nor block their slot.
+
+# Upper bound for an appointment's length. Because no appointment lasts longer,
+# anything overlapping [inicio, fin) must start after inicio - MAX_DURACION_MINUTOS,
+# which turns the interval test into an index range scan on fecha_hora.
+MAX_DURACION_MINUTOS = 8 * 60
+HORARIO_INICIO = time(8, 0)
+HORARIO_FIN = time(18, 0)
+VISTAS = ('dia', 'semana', 'mes')
+
+
+def validar_duracion(duracion_str):
+    """Parses a duration in minutes; returns (minutes, None) or (None, message)."""
+    if not duracion_str:
+        return DURACION_CITA_DEFECTO, None
+    try:
+        duracion = int(duracion_str)
+    except ValueError:
+        return None, 'La duración debe ser un número entero de minutos.'
+    if not 5 <= duracion <= MAX_DURACION_MINUTOS:
+        return None, f'La duración debe estar entre 5 y {MAX_DURACION_MINUTOS} minutos.'
+    return duracion, None
+
+
+def _overlapping(query, inicio, fin):
+    return query.filter(
+        Cita.fecha_hora > inicio - timedelta(minutes=MAX_DURACION_MINUTOS),
+        Cita.fecha_hora < fin,
+        Cita.fecha_fin > inicio,
+        Paciente.visible_owner(Cita.paciente_id),
+    )
+
+
+def find_conflict(inicio, duracion_minutos, paciente_id, recurso_id=None, exclude_id=None):
+    """
+    Returns the first appointment that overlaps [inicio, inicio + duracion) for the
+    same patient or the same resource, or None. A single indexed query; the day's
+    appointments are never loaded.
+    """
+    fin = inicio + timedelta(minutes=duracion_minutos)
+    scope = Cita.paciente_id == paciente_id
+    if recurso_id is not None:
+        scope = or_(scope, Cita.recurso_id == recurso_id)
+    query = _overlapping(Cita.query.filter(scope), inicio, fin)
+    if exclude_id is not None:
+        query = query.filter(Cita.id != exclude_id)
+    return query.order_by(Cita.fecha_hora).first()
+
+
+def calendar_range(vista, fecha):
+    """[inicio, fin) datetimes for a day, the ISO week (Monday first) or the month containing fecha."""
+    if vista == 'dia':
+        inicio = fecha
+        fin = fecha + timedelta(days=1)
+    elif vista == 'semana':
+        inicio = fecha - timedelta(days=fecha.weekday())
+        fin = inicio + timedelta(days=7)
+    elif vista == 'mes':
+        inicio = fecha.replace(day=1)
+        fin = (inicio + timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f"vista debe ser una de: {', '.join(VISTAS)}")
+    return datetime.combine(inicio, time.min), datetime.combine(fin, time.min)
+
+
+def citas_en_rango(inicio, fin, recurso_id=None):
+    """Appointments starting in [inicio, fin) ordered by start, with their patient and resource."""
+    query = Cita.query.options(joinedload(Cita.paciente_cita), joinedload(Cita.recurso)) \
+        .filter(Cita.fecha_hora >= inicio, Cita.fecha_hora < fin, Paciente.visible_owner(Cita.paciente_id))
+    if recurso_id is not None:
+        query = query.filter(Cita.recurso_id == recurso_id)
+    return query.order_by(Cita.fecha_hora).all()
+
+
+def free_slots(fecha, duracion_minutos=DURACION_CITA_DEFECTO, recurso_id=None,
+               horario_inicio=HORARIO_INICIO, horario_fin=HORARIO_FIN):
+    """
+    Start times within working hours where an appointment of duracion_minutos fits.
+    Busy intervals come from one projected range query (start/end columns only) for
+    the resource, or for every appointment when no resource is given.
+    """
+    dia_inicio = datetime.combine(fecha, horario_inicio)
+    dia_fin = datetime.combine(fecha, horario_fin)
+    query = db.session.query(Cita.fecha_hora, Cita.fecha_fin)
+    if recurso_id is not None:
+        query = query.filter(Cita.recurso_id == recurso_id)
+    busy = _overlapping(query, dia_inicio, dia_fin).order_by(Cita.fecha_hora).all()
+
+    paso = timedelta(minutes=duracion_minutos)
+    slots = []
+    cursor = dia_inicio
+    for ocupado_inicio, ocupado_fin in busy + [(dia_fin, dia_fin)]:
+        while cursor + paso <= ocupado_inicio:
+            slots.append(cursor)
+            cursor += paso
+        cursor = max(cursor, ocupado_fin)
+    return slots
+
+
+def parse_fecha(value, default=None):
+    if not value:
+        return default or date.today()
+    return datetime.strptime(value, '%Y-%m-%d').date()
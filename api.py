@@ -0,0 +1,230 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, url_for
+from flask_login import current_user
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only, undefer_group
+
+from models import db, Paciente, HistoriaClinica, Cita, Factura
+from tombstones import deleted_since
+
+# Versioned JSON API (v1) for tablet clients.
+# Lists use keyset pagination over (updated_at, id), so `updated_since` + `cursor`
+# gives a stable incremental sync; single resources and pages carry ETag and
+# Last-Modified and answer conditional GETs with 304. Soft-deleted patients and
+# their rows are hidden, except that sync walks (updated_since) still return the
+# patients themselves, with eliminado_en set, so clients can drop them. Rows
+# deleted since updated_since are listed in `eliminados` (tombstones.py) on the
+# first page of the walk.
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# resource name -> (model, exposed fields, allowed equality filters)
+RESOURCES = {
+    'pacientes': (Paciente, ('id', 'nombre', 'edad', 'documento', 'telefono', 'direccion', 'correo',
+                             'eliminado_en', 'version', 'updated_at'), ('documento',)),
+    'historias': (HistoriaClinica, ('id', 'paciente_id', 'fecha', 'motivo', 'observaciones',
+                                    'version', 'updated_at'), ('paciente_id',)),
+    'citas': (Cita, ('id', 'paciente_id', 'fecha_hora', 'duracion_minutos', 'fecha_fin', 'recurso_id', 'motivo', 'notas',
+                     'version', 'updated_at'), ('paciente_id',)),
+    'facturas': (Factura, ('id', 'paciente_id', 'numero_factura', 'fecha_emision', 'fecha_vencimiento',
+                           'total', 'estado', 'version', 'updated_at'), ('paciente_id', 'estado')),
+}
+
+# Tombstones reported with each resource's sync walk (invoice items travel with their invoice)
+TOMBSTONES = {'pacientes': ('pacientes',), 'historias': ('historias',), 'citas': ('citas',),
+              'facturas': ('facturas', 'items')}
+
+# Always loaded: needed for cursors and validators even if not requested
+_REQUIRED_FIELDS = ('id', 'version', 'updated_at')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api_v1.errorhandler(ApiError)
+def _handle_api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+
+@api_v1.errorhandler(404)
+def _handle_not_found(error):
+    return jsonify({'error': 'Recurso no encontrado.'}), 404
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Autenticación requerida.'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _to_json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _selected_fields(exposed):
+    fields_param = request.args.get('fields')
+    if not fields_param:
+        return exposed
+    requested = tuple(f.strip() for f in fields_param.split(',') if f.strip())
+    unknown = [f for f in requested if f not in exposed]
+    if unknown:
+        raise ApiError(f"Campos desconocidos: {', '.join(unknown)}")
+    return requested
+
+
+def _serialize(obj, fields):
+    return {field: _to_json_value(getattr(obj, field)) for field in fields}
+
+
+def _encode_cursor(obj):
+    raw = json.dumps([obj.updated_at.isoformat(), obj.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        updated_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(updated_at), int(row_id)
+    except (ValueError, TypeError):
+        raise ApiError('Cursor inválido.')
+
+
+def _parse_datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} debe ser una fecha ISO 8601.')
+
+
+def _visible(model):
+    if model is Paciente:
+        return Paciente.visible()
+    return Paciente.visible_owner(model.paciente_id)
+
+
+def _conditional_json(payload, etag, last_modified):
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def _list_view(resource):
+    model, exposed, filters = RESOURCES[resource]
+
+    @api_login_required
+    def view():
+        fields = _selected_fields(exposed)
+        columns = [getattr(model, f) for f in dict.fromkeys(_REQUIRED_FIELDS + fields)]
+        query = model.query.options(load_only(*columns))
+
+        for name in filters:
+            value = request.args.get(name)
+            if value is not None:
+                query = query.filter(getattr(model, name) == value)
+
+        updated_since = _parse_datetime_arg('updated_since')
+        if updated_since is not None:
+            query = query.filter(model.updated_at > updated_since)
+        if updated_since is None or model is not Paciente:
+            query = query.filter(_visible(model))
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            after_updated_at, after_id = _decode_cursor(cursor)
+            query = query.filter(or_(model.updated_at > after_updated_at,
+                                     and_(model.updated_at == after_updated_at, model.id > after_id)))
+
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError('limit debe ser un entero.')
+
+        rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        next_cursor = _encode_cursor(rows[-1]) if has_more else None
+        payload = {
+            'data': [_serialize(row, fields) for row in rows],
+            'next_cursor': next_cursor,
+            'next': url_for(request.endpoint, **dict(request.args.items(), cursor=next_cursor)) if next_cursor else None,
+        }
+        eliminados = []
+        if updated_since is not None and not cursor:
+            eliminados = deleted_since(TOMBSTONES[resource], updated_since)
+            payload['eliminados'] = [{'recurso': recurso, 'id': row_id, 'eliminado_en': _to_json_value(eliminado_en)}
+                                     for recurso, row_id, eliminado_en in eliminados]
+        # Page validator: identity and version of every row (and tombstone) plus the shape of the request.
+        # No Last-Modified here: a deleted row would not move max(updated_at).
+        digest = hashlib.sha1(repr((request.full_path, [(r.id, r.version) for r in rows],
+                                    [tuple(e) for e in eliminados])).encode('utf-8')).hexdigest()
+        return _conditional_json(payload, f'{resource}-{digest}', None)
+
+    view.__name__ = f'list_{resource}'
+    return view
+
+
+def _detail_view(resource):
+    model, exposed, _filters = RESOURCES[resource]
+
+    @api_login_required
+    def view(id):
+        fields = _selected_fields(exposed)
+        obj = model.query.options(undefer_group('texto')).filter(model.id == id, _visible(model)).first()
+        if obj is None:
+            raise ApiError('Recurso no encontrado.', 404)
+
+        etag = f'{resource}-{obj.id}-v{obj.version}'
+        if request.query_string:
+            # Different field selections/includes are different representations
+            etag += '-' + hashlib.sha1(request.query_string).hexdigest()[:12]
+        if request.if_none_match.contains_weak(etag):
+            # Unchanged: skip serialization entirely
+            return _conditional_json({}, etag, obj.updated_at)
+
+        payload = _serialize(obj, fields)
+        if model is Factura and 'items' in request.args.get('include', '').split(','):
+            payload['items'] = [{
+                'id': item.id,
+                'descripcion': item.descripcion,
+                'tratamiento_id': item.tratamiento_id,
+                'cantidad': item.cantidad,
+                'precio_unitario': _to_json_value(item.precio_unitario),
+                'subtotal': _to_json_value(item.subtotal),
+            } for item in obj.items]
+        return _conditional_json(payload, etag, obj.updated_at)
+
+    view.__name__ = f'get_{resource}'
+    return view
+
+
+for _resource in RESOURCES:
+    api_v1.add_url_rule(f'/{_resource}', view_func=_list_view(_resource), methods=['GET'])
+    api_v1.add_url_rule(f'/{_resource}/<int:id>', view_func=_detail_view(_resource), methods=['GET'])
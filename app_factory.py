@@ -0,0 +1,60 @@
+import os
+
+from flask import Flask
+from flask_login import LoginManager
+
+from config import PROFILES, DEFAULT_PROFILE
+from models import db
+from database_config import configure_database
+from user_cache import get_user_identity
+from response_cache import init_response_cache
+from api import api_v1
+from metrics import init_metrics
+from slow_query_log import init_slow_query_log
+from static_assets import init_static_assets
+from compression import init_compression
+from invoice_pdf import DEFAULT_CACHE_SUBDIR as INVOICE_PDF_SUBDIR
+from warmup import init_warmup
+
+# Application factory: builds a configured app for a profile (config.py) with
+# the database, caches, API blueprint, instrumentation and warm-up set up.
+# The page routes are registered on the app that index.py creates with it.
+
+login_manager = LoginManager()
+login_manager.login_view = 'login'
+
+
+# Served from a process-local TTL cache so hot endpoints skip the user table
+@login_manager.user_loader
+def load_user(user_id):
+    return get_user_identity(int(user_id))
+
+
+def create_app(profile=None, import_name=__name__):
+    """
+    Creates the app for `profile` (default: APP_CONFIG, else development).
+    The warm-up (WARMUP setting) starts last, once everything is configured.
+    """
+    profile = profile or os.environ.get('APP_CONFIG') or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"APP_CONFIG must be one of {', '.join(PROFILES)}, got {profile!r}")
+
+    app = Flask(import_name)
+    app.config.from_object(PROFILES[profile])
+    app.config['APP_CONFIG'] = profile
+    if not app.config.get('SECRET_KEY'):
+        raise RuntimeError(f"SECRET_KEY must be set for the {profile} profile")
+    if not app.config.get('INVOICE_PDF_CACHE_DIR'):
+        app.config['INVOICE_PDF_CACHE_DIR'] = os.path.join(app.instance_path, INVOICE_PDF_SUBDIR)
+
+    configure_database(app) # DATABASE_URL and engine profile (SQLite WAL / PostgreSQL pool)
+    db.init_app(app)
+    init_response_cache(app) # RESPONSE_CACHE_BACKEND: memory (default), sqlite or none
+    app.register_blueprint(api_v1) # JSON API under /api/v1
+    init_metrics(app) # Prometheus text format on /metrics (METRICS_TOKEN protects it if set)
+    init_slow_query_log(app) # SLOW_QUERY_LOG_MS (default 200, negative disables) -> instance/slow_queries.log
+    init_static_assets(app) # fingerprinted, precompressed files from scriptss/build_assets.py (static/dist/)
+    init_compression(app) # gzip/brotli by Accept-Encoding for bodies of COMPRESS_MIN_SIZE (default 1024) bytes or more
+    login_manager.init_app(app)
+    init_warmup(app) # /ready; WARMUP: sync, background or off
+    return app
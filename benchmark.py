@@ -0,0 +1,203 @@
+import json
+import math
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+from models import db, User, Paciente, Factura
+from sql_timing import add_statement_listener, remove_statement_listener
+
+# Route benchmark: drives the WSGI app in-process with Flask test clients (one per
+# worker thread for concurrent runs) and records latency percentiles, throughput
+# and SQL statements per request for the main pages. Results are checked against
+# budgets stored in benchmark_budgets.json; every exceeded limit is a violation.
+# Timings depend on the dataset (see seed_data.py) and the machine, so budgets
+# record the dataset size they were measured with.
+
+BENCHMARK_USERNAME = 'benchmark'
+DEFAULT_REQUESTS = 50
+DEFAULT_WARMUP = 3
+
+# name -> URL template, filled from sample_parameters()
+ROUTES = {
+    'pacientes': '/pacientes',
+    'pacientes_buscar': '/pacientes?buscar={buscar}',
+    'citas': '/citas',
+    'facturas_list': '/facturas',
+    'ver_factura': '/facturas/{factura_id}',
+    'nueva_historia': '/pacientes/{paciente_id}/historias/nuevo',
+    'buscar_icd_api': '/diagnosticos/buscar_icd?q={icd}',
+}
+
+BUDGET_KEYS = ('p50_ms', 'p95_ms', 'p99_ms', 'sql_max')
+
+_sql = threading.local()  # per-thread statement counter (the test client runs the app in the caller's thread)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _count_statement(conn, cursor, statement, parameters, executemany, seconds):
+    _sql.count = getattr(_sql, 'count', 0) + 1
+
+
+def benchmark_user_id():
+    """Id of the benchmark user, created (with a random password) if missing. Requires an app context."""
+    user = User.query.filter_by(username=BENCHMARK_USERNAME).first()
+    if user is None:
+        user = User(username=BENCHMARK_USERNAME)
+        user.set_password(secrets.token_urlsafe(16))
+        db.session.add(user)
+        db.session.commit()
+    return user.id
+
+
+def sample_parameters():
+    """
+    Ids used in the URL templates: the middle patient and invoice by id (so
+    results do not depend on the first or last rows) and a surname to search for.
+    Requires an app context. Missing data leaves the key unset.
+    """
+    params = {'icd': 'diabetes'}
+    pacientes = db.session.execute(select(func.count(Paciente.id))).scalar()
+    if pacientes:
+        paciente = db.session.execute(
+            select(Paciente.id, Paciente.nombre).order_by(Paciente.id).offset(pacientes // 2).limit(1)).one()
+        params['paciente_id'] = paciente.id
+        params['buscar'] = paciente.nombre.split()[-1]
+    facturas = db.session.execute(select(func.count(Factura.id))).scalar()
+    if facturas:
+        params['factura_id'] = db.session.execute(
+            select(Factura.id).order_by(Factura.id).offset(facturas // 2).limit(1)).scalar()
+    return params
+
+
+def dataset_size():
+    return db.session.execute(select(func.count(Paciente.id))).scalar()
+
+
+def _logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def _run_requests(app, user_id, path, count):
+    """Issues `count` GETs on one client; returns [(seconds, sql statements, status)]."""
+    client = _logged_in_client(app, user_id)
+    samples = []
+    for _ in range(count):
+        _sql.count = 0
+        started = time.perf_counter()
+        response = client.get(path)
+        response.get_data()
+        samples.append((time.perf_counter() - started, _sql.count, response.status_code))
+    return samples
+
+
+def benchmark_route(app, user_id, path, requests=DEFAULT_REQUESTS, concurrency=1, warmup=DEFAULT_WARMUP):
+    """Measures one URL. `requests` are split across `concurrency` threads."""
+    if warmup:
+        _run_requests(app, user_id, path, warmup)
+
+    shares = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    if concurrency == 1:
+        samples = _run_requests(app, user_id, path, requests)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(_run_requests, app, user_id, path, share) for share in shares if share]
+            samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds * 1000 for seconds, _, _ in samples]
+    statements = [count for _, count, _ in samples]
+    return {
+        'path': path,
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status in samples if status >= 400),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'sql_avg': round(sum(statements) / len(statements), 1),
+        'sql_max': max(statements),
+    }
+
+
+def run_benchmark(app, routes=None, requests=DEFAULT_REQUESTS, concurrency=1, warmup=DEFAULT_WARMUP):
+    """
+    Benchmarks the given route names (default: all of ROUTES) against the app's
+    database. Returns {route name: result}; routes whose sample data is missing
+    (e.g. no invoices yet) are reported with 'skipped'.
+    """
+    with app.app_context():
+        user_id = benchmark_user_id()
+        params = sample_parameters()
+
+    results = {}
+    add_statement_listener(_count_statement)
+    try:
+        for name in routes or ROUTES:
+            try:
+                path = ROUTES[name].format(**params)
+            except KeyError as e:
+                results[name] = {'skipped': f'sin datos para {e.args[0]}'}
+                continue
+            results[name] = benchmark_route(app, user_id, path, requests=requests,
+                                            concurrency=concurrency, warmup=warmup)
+    finally:
+        remove_statement_listener(_count_statement)
+    return results
+
+
+def check_budgets(results, budgets):
+    """
+    Compares results with budgets ({'routes': {name: {p95_ms: ..., sql_max: ...}}}).
+    Returns a list of violation messages; failed requests are violations too.
+    """
+    violations = []
+    for name, result in results.items():
+        if 'skipped' in result:
+            continue
+        if result['errors']:
+            violations.append(f"{name}: {result['errors']} de {result['requests']} solicitudes fallaron")
+        for key, limit in budgets.get('routes', {}).get(name, {}).items():
+            if key in BUDGET_KEYS and result[key] > limit:
+                violations.append(f"{name}: {key} = {result[key]} supera el presupuesto de {limit}")
+    return violations
+
+
+def budgets_from_results(results, dataset_pacientes, headroom=1.5):
+    """
+    Budgets derived from a run: latencies with `headroom`, SQL counts exact (the
+    statements a page runs do not depend on timing, so any increase is a regression).
+    """
+    routes = {}
+    for name, result in results.items():
+        if 'skipped' in result:
+            continue
+        routes[name] = {key: math.ceil(result[key] * headroom) for key in ('p50_ms', 'p95_ms', 'p99_ms')}
+        routes[name]['sql_max'] = result['sql_max']
+    return {'dataset_pacientes': dataset_pacientes, 'routes': routes}
+
+
+def load_budgets(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_budgets(path, budgets):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(budgets, f, ensure_ascii=False, indent=2)
+        f.write('\n')
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from models import db, Factura, ItemFactura, Paciente, Tratamiento
+
+# Streaming export of invoice lines for accounting.
+# Rows are fetched with a server-side cursor (yield_per) and formatted one by one
+# by generators, so memory stays constant regardless of how many invoices match.
+
+EXPORT_BATCH_SIZE = 1000
+ESTADOS_FACTURA = ('Pendiente', 'Pagada', 'Anulada')
+
+EXPORT_COLUMNS = (
+    'numero_factura', 'fecha_emision', 'fecha_vencimiento', 'estado', 'total_factura',
+    'paciente_documento', 'paciente_nombre',
+    'item_id', 'item_descripcion', 'tratamiento_codigo', 'cantidad', 'precio_unitario', 'subtotal',
+)
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} debe tener el formato YYYY-MM-DD.')
+
+
+def build_export_query(desde=None, hasta=None, estado=None):
+    """
+    One row per invoice line (invoices without items produce a single row with
+    empty item columns), filtered by fecha_emision (both ends inclusive) and estado.
+    Invoices of soft-deleted patients are left out.
+    """
+    stmt = (
+        select(
+            Factura.numero_factura,
+            Factura.fecha_emision,
+            Factura.fecha_vencimiento,
+            Factura.estado,
+            Factura.total.label('total_factura'),
+            Paciente.documento.label('paciente_documento'),
+            Paciente.nombre.label('paciente_nombre'),
+            ItemFactura.id.label('item_id'),
+            ItemFactura.descripcion.label('item_descripcion'),
+            Tratamiento.codigo.label('tratamiento_codigo'),
+            ItemFactura.cantidad,
+            ItemFactura.precio_unitario,
+            ItemFactura.subtotal,
+        )
+        .select_from(Factura)
+        .join(Paciente, Paciente.id == Factura.paciente_id)
+        .where(Paciente.visible())
+        .outerjoin(ItemFactura, ItemFactura.factura_id == Factura.id)
+        .outerjoin(Tratamiento, Tratamiento.id == ItemFactura.tratamiento_id)
+        .order_by(Factura.fecha_emision, Factura.id, ItemFactura.id)
+    )
+    if desde:
+        stmt = stmt.where(Factura.fecha_emision >= datetime.combine(desde, datetime.min.time()))
+    if hasta:
+        stmt = stmt.where(Factura.fecha_emision < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    if estado:
+        stmt = stmt.where(Factura.estado == estado)
+    return stmt
+
+
+def iter_export_rows(desde=None, hasta=None, estado=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yields row mappings, fetching `batch_size` rows at a time from the cursor."""
+    stmt = build_export_query(desde, hasta, estado).execution_options(yield_per=batch_size)
+    for row in db.session.execute(stmt).mappings():
+        yield row
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_csv(rows):
+    """Yields CSV text: the header line, then one line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_format_value(row[column]) for column in EXPORT_COLUMNS])
+        yield buffer.getvalue()
+
+
+def iter_ndjson(rows):
+    """Yields one JSON object per line; amounts are strings to keep exact decimals."""
+    for row in rows:
+        yield json.dumps({column: (str(row[column]) if isinstance(row[column], Decimal)
+                                   else _format_value(row[column]) if row[column] is not None else None)
+                          for column in EXPORT_COLUMNS}, ensure_ascii=False) + '\n'
+
+
+FORMATTERS = {
+    'csv': (iter_csv, 'text/csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import func, select, literal
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (db, Factura, ItemFactura, ResumenFacturacionMensual,
+                    ResumenFacturacionTratamiento, ResumenFacturacionPaciente)
+
+# Incremental maintenance of the billing summary tables.
+# Callers apply deltas inside the same transaction as the item / estado change
+# (nothing here commits), so summaries and invoices are always consistent.
+# rebuild_billing_summaries() recomputes everything from item_factura.
+
+SIN_TRATAMIENTO = 0
+
+
+def _insert(table):
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+def periodo_de(fecha):
+    return fecha.strftime('%Y-%m')
+
+
+def _periodo_expr(column):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+def _upsert_increments(model, key_columns, value_columns, params):
+    """INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col, for a batch of rows."""
+    if not params:
+        return
+    table = model.__table__
+    stmt = _insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in key_columns],
+        set_={name: table.c[name] + stmt.excluded[name] for name in value_columns}
+    )
+    db.session.execute(stmt, params)
+
+
+def apply_items_delta(factura, items, sign=1, estado=None):
+    """
+    Adds (sign=1) or subtracts (sign=-1) invoice items from the summaries.
+    items: iterable of (tratamiento_id, cantidad, subtotal), see item_tuples().
+    estado defaults to factura.estado.
+    """
+    grouped = [(tratamiento_id, cantidad, subtotal, 1) for tratamiento_id, cantidad, subtotal in items]
+    _apply_grouped(factura, grouped, sign, estado or factura.estado)
+
+
+def item_tuples(rows):
+    """(tratamiento_id, cantidad, subtotal) from ItemFactura objects or bulk-insert dicts."""
+    for row in rows:
+        if isinstance(row, dict):
+            yield row.get('tratamiento_id'), row['cantidad'], row['subtotal']
+        else:
+            yield row.tratamiento_id, row.cantidad, row.subtotal
+
+
+def _factura_items_grouped(factura_ids):
+    """
+    Items of the given invoices aggregated in SQL, as
+    {factura_id: [(tratamiento_id, cantidad, subtotal, num_items), ...]}.
+    """
+    grouped = defaultdict(list)
+    rows = db.session.execute(
+        select(ItemFactura.factura_id, ItemFactura.tratamiento_id,
+               func.sum(ItemFactura.cantidad), func.sum(ItemFactura.subtotal), func.count())
+        .where(ItemFactura.factura_id.in_(factura_ids))
+        .group_by(ItemFactura.factura_id, ItemFactura.tratamiento_id)
+    )
+    for factura_id, tratamiento_id, cantidad, subtotal, num_items in rows:
+        grouped[factura_id].append((tratamiento_id, cantidad, subtotal, num_items))
+    return grouped
+
+
+def move_factura_estado(factura, estado_anterior, estado_nuevo):
+    """Moves all of an invoice's items from one estado bucket to another."""
+    grouped = _factura_items_grouped([factura.id])[factura.id]
+    _apply_grouped(factura, grouped, -1, estado_anterior)
+    _apply_grouped(factura, grouped, 1, estado_nuevo)
+
+
+def _apply_grouped(factura, grouped, sign, estado):
+    # One upsert row per key: a multi-row ON CONFLICT statement may not touch the same row twice
+    num_items = 0
+    importe = Decimal('0')
+    por_tratamiento = defaultdict(lambda: [0, Decimal('0')])
+    for tratamiento_id, cantidad, subtotal, count in grouped:
+        subtotal = Decimal(str(subtotal))
+        num_items += count
+        importe += subtotal
+        bucket = por_tratamiento[tratamiento_id or SIN_TRATAMIENTO]
+        bucket[0] += int(cantidad)
+        bucket[1] += subtotal
+    if not num_items:
+        return
+
+    periodo = periodo_de(factura.fecha_emision)
+    totals = {'num_items': sign * num_items, 'importe': sign * importe}
+    _upsert_increments(ResumenFacturacionMensual, ('periodo', 'estado'), ('num_items', 'importe'),
+                       [dict(periodo=periodo, estado=estado, **totals)])
+    _upsert_increments(ResumenFacturacionPaciente, ('paciente_id', 'estado'), ('num_items', 'importe'),
+                       [dict(paciente_id=factura.paciente_id, estado=estado, **totals)])
+    _upsert_increments(ResumenFacturacionTratamiento, ('periodo', 'estado', 'tratamiento_id'),
+                       ('cantidad', 'importe'),
+                       [dict(periodo=periodo, estado=estado, tratamiento_id=tratamiento_id,
+                             cantidad=sign * cantidad, importe=sign * subtotal)
+                        for tratamiento_id, (cantidad, subtotal) in por_tratamiento.items()])
+
+
+def remove_pacientes_billing(paciente_ids):
+    """
+    Subtracts every invoice of the given patients from the summaries, aggregated
+    in SQL by (periodo, estado, tratamiento), and drops their per-patient rows.
+    """
+    periodo = _periodo_expr(Factura.fecha_emision)
+    rows = db.session.execute(
+        select(periodo, Factura.estado, ItemFactura.tratamiento_id,
+               func.sum(ItemFactura.cantidad), func.sum(ItemFactura.subtotal), func.count())
+        .join(Factura, Factura.id == ItemFactura.factura_id)
+        .where(Factura.paciente_id.in_(paciente_ids))
+        .group_by(periodo, Factura.estado, ItemFactura.tratamiento_id)
+    )
+    mensual = defaultdict(lambda: [0, Decimal('0')])
+    por_tratamiento = defaultdict(lambda: [0, Decimal('0')])
+    for periodo_valor, estado, tratamiento_id, cantidad, subtotal, num_items in rows:
+        subtotal = Decimal(str(subtotal))
+        mensual[(periodo_valor, estado)][0] += num_items
+        mensual[(periodo_valor, estado)][1] += subtotal
+        bucket = por_tratamiento[(periodo_valor, estado, tratamiento_id or SIN_TRATAMIENTO)]
+        bucket[0] += int(cantidad)
+        bucket[1] += subtotal
+
+    _upsert_increments(ResumenFacturacionMensual, ('periodo', 'estado'), ('num_items', 'importe'),
+                       [dict(periodo=p, estado=e, num_items=-n, importe=-importe)
+                        for (p, e), (n, importe) in mensual.items()])
+    _upsert_increments(ResumenFacturacionTratamiento, ('periodo', 'estado', 'tratamiento_id'),
+                       ('cantidad', 'importe'),
+                       [dict(periodo=p, estado=e, tratamiento_id=t, cantidad=-cantidad, importe=-importe)
+                        for (p, e, t), (cantidad, importe) in por_tratamiento.items()])
+    db.session.execute(ResumenFacturacionPaciente.__table__.delete()
+                       .where(ResumenFacturacionPaciente.paciente_id.in_(paciente_ids)))
+
+
+def rebuild_billing_summaries():
+    """
+    Recomputes all summary tables from item_factura with INSERT ... SELECT ... GROUP BY.
+    Runs in the caller's transaction; the caller commits.
+    """
+    for model in (ResumenFacturacionMensual, ResumenFacturacionTratamiento, ResumenFacturacionPaciente):
+        db.session.execute(model.__table__.delete())
+
+    periodo = _periodo_expr(Factura.fecha_emision)
+    base = select().select_from(ItemFactura).join(Factura, Factura.id == ItemFactura.factura_id)
+
+    db.session.execute(ResumenFacturacionMensual.__table__.insert().from_select(
+        ['periodo', 'estado', 'num_items', 'importe'],
+        base.add_columns(periodo, Factura.estado, func.count(), func.sum(ItemFactura.subtotal))
+            .group_by(periodo, Factura.estado)
+    ))
+    tratamiento = func.coalesce(ItemFactura.tratamiento_id, literal(SIN_TRATAMIENTO))
+    db.session.execute(ResumenFacturacionTratamiento.__table__.insert().from_select(
+        ['periodo', 'estado', 'tratamiento_id', 'cantidad', 'importe'],
+        base.add_columns(periodo, Factura.estado, tratamiento, func.sum(ItemFactura.cantidad),
+                         func.sum(ItemFactura.subtotal))
+            .group_by(periodo, Factura.estado, tratamiento)
+    ))
+    db.session.execute(ResumenFacturacionPaciente.__table__.insert().from_select(
+        ['paciente_id', 'estado', 'num_items', 'importe'],
+        base.add_columns(Factura.paciente_id, Factura.estado, func.count(), func.sum(ItemFactura.subtotal))
+            .group_by(Factura.paciente_id, Factura.estado)
+    ))
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Diagnostico, Tratamiento
+
+# Diagnosis and treatment option lists for the history and invoice forms, which
+# otherwise load the whole catalog on every request. Entries are result rows
+# (read-only, shareable across threads and usable after the request's session
+# is closed, e.g. by streamed pages). A list is reused while the table's
+# response-cache generation is unchanged (any committed write to the table
+# bumps it, see response_cache.py) and for at most CATALOG_TTL_SECONDS, which
+# bounds staleness for writes made by other processes. Without a response
+# cache backend the lists are loaded on every call.
+
+CATALOG_TTL_SECONDS = 300
+
+CATALOGS = {
+    'diagnostico': (Diagnostico.id, Diagnostico.codigo, Diagnostico.descripcion),
+    'tratamiento': (Tratamiento.id, Tratamiento.codigo, Tratamiento.descripcion, Tratamiento.costo),
+}
+
+_cache = {}  # table -> (generation, expires_at, rows)
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _backend():
+    state = current_app.extensions.get('response_cache')
+    return state['backend'] if state else None
+
+
+def get_catalog(table):
+    """Rows of the catalog ordered by descripcion ('diagnostico' or 'tratamiento'). Requires an app context."""
+    columns = CATALOGS[table]
+    backend = _backend()
+    generation = backend.get_generations((table,)) if backend is not None else None
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(table)
+        if backend is not None and entry is not None and entry[0] == generation and entry[1] > now:
+            _stats['hits'] += 1
+            return entry[2]
+        _stats['misses'] += 1
+
+    model = columns[0].class_
+    rows = tuple(db.session.execute(select(*columns).order_by(model.descripcion)).all())
+    if backend is not None:
+        with _lock:
+            _cache[table] = (generation, now + CATALOG_TTL_SECONDS, rows)
+    return rows
+
+
+def clear_catalog_cache():
+    with _lock:
+        _cache.clear()
+
+
+def get_catalog_cache_stats():
+    with _lock:
+        return dict(_stats, size=len(_cache))
@@ -0,0 +1,125 @@
+import gzip
+import os
+import zlib
+
+from flask import current_app, get_flashed_messages, request, session, stream_template
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+# Response compression negotiated with Accept-Encoding (brotli when the optional
+# package is installed, otherwise gzip). Buffered responses are compressed when
+# they reach COMPRESS_MIN_SIZE; streamed responses (stream_page) are compressed
+# chunk by chunk with a flush after each one, so the browser can start parsing
+# the page while the rest is still being rendered. Responses that already have
+# a Content-Encoding (precompressed static files), files sent with send_file and
+# non-text types are left alone.
+
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+                          'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+DEFAULT_MIN_SIZE = 1024  # bytes; smaller bodies gain less than the headers cost
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # dynamic content: the highest levels cost far more CPU for a few percent
+STREAM_CHUNK_SIZE = 16 * 1024  # characters of rendered template per streamed chunk
+
+
+def _config(app, name, default):
+    value = app.config.get(name, os.environ.get(name))
+    return default if value in (None, '') else int(value)
+
+
+def _encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_stream(chunks, encoding):
+    """Compresses an iterable of chunks, flushing after each so every chunk reaches the client."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        compress, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()  # ends stream_with_context (and its request context) on early disconnects too
+
+
+def _compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == 'HEAD'
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    if not response.is_streamed and len(response.get_data()) < current_app.extensions['compression']['min_size']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(_compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)  # a different representation needs a different ETag
+    return response
+
+
+def _chunked(pieces, size=STREAM_CHUNK_SIZE):
+    # Jinja yields one piece per template node; group them so each chunk is worth a flush
+    buffer, length = [], 0
+    try:
+        for piece in pieces:
+            buffer.append(piece)
+            length += len(piece)
+            if length >= size:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        pieces.close()
+
+
+def stream_page(template_name, **context):
+    """
+    Renders a template incrementally (Flask's stream_template) in chunks of
+    STREAM_CHUNK_SIZE, for long list pages. The body is rendered after the view
+    returns, when the request's database session has been closed: everything
+    the template reads must already be loaded (eager-load relationships).
+    Flash messages are read before the first chunk: the session cookie is sent
+    with the headers, so messages consumed later would show again on the next page.
+    """
+    if '_flashes' in session:  # (checked first: popping a missing key would still mark the session modified)
+        get_flashed_messages()  # pops them from the session now; templates get the same list
+    return current_app.response_class(_chunked(stream_template(template_name, **context)), mimetype='text/html')
+
+
+def init_compression(app):
+    """Compresses responses (COMPRESS_MIN_SIZE bytes or more, default 1024; 0 compresses everything)."""
+    app.extensions['compression'] = {'min_size': _config(app, 'COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)}
+    app.after_request(_compress_response)
@@ -0,0 +1,41 @@
+import os
+
+# Configuration profiles, selected with APP_CONFIG (development, testing or
+# production; default development). Values that depend on the deployment are
+# read from the environment; the database settings stay in database_config.py.
+
+DEFAULT_PROFILE = 'development'
+DEVELOPMENT_SECRET_KEY = 'tu_clave_secreta'
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEVELOPMENT_SECRET_KEY
+    # immediate: set-based delete in the request; deferred: hide the patient and purge it in a background job
+    PATIENT_DELETE_MODE = os.environ.get('PATIENT_DELETE_MODE', 'immediate')
+    # Rendered invoice PDFs (invoice_pdf.py); None: <instance folder>/facturas_pdf
+    INVOICE_PDF_CACHE_DIR = os.environ.get('INVOICE_PDF_CACHE_DIR')
+    # Warm-up before /ready answers 200 (warmup.py): sync (during create_app),
+    # background (in a thread, so the worker can answer probes meanwhile) or off.
+    # Off outside production: the scripts in scriptss/ import the app too.
+    WARMUP = os.environ.get('WARMUP', 'off')
+    WARMUP_RETRY_SECONDS = 5
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+
+
+class ProductionConfig(Config):
+    SECRET_KEY = os.environ.get('SECRET_KEY')  # required, checked by create_app
+    WARMUP = os.environ.get('WARMUP', 'background')
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
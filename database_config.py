@@ -0,0 +1,102 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DATABASE_URL = "sqlite:///site.db"
+
+# SQLite profile: applied to every new DBAPI connection
+SQLITE_PRAGMAS_DEFAULTS = {
+    "busy_timeout_ms": 5000,           # wait for the writer instead of failing with "database is locked"
+    "cache_size_kib": 64 * 1024,       # per-connection page cache (64 MiB)
+    "mmap_size_bytes": 256 * 1024 * 1024,
+}
+
+# PostgreSQL profile: pool sizing per worker process
+POSTGRES_POOL_DEFAULTS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Environment variable {name} must be an integer, got {value!r}")
+
+
+def get_database_url():
+    """
+    Returns the database URL from DATABASE_URL (default: sqlite:///site.db).
+    Heroku-style 'postgres://' URLs are normalized to 'postgresql://'.
+    """
+    url = os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def get_engine_options(database_url):
+    """
+    Returns SQLALCHEMY_ENGINE_OPTIONS for the profile matching the URL scheme.
+    SQLite pragmas are not set here; they are applied on connect by
+    _apply_sqlite_pragmas.
+    """
+    if database_url.startswith("sqlite"):
+        busy_timeout_ms = _env_int("SQLITE_BUSY_TIMEOUT_MS", SQLITE_PRAGMAS_DEFAULTS["busy_timeout_ms"])
+        return {
+            # pysqlite's own lock wait, kept in line with PRAGMA busy_timeout
+            "connect_args": {"timeout": busy_timeout_ms / 1000.0},
+        }
+
+    if database_url.startswith("postgresql"):
+        return {
+            "pool_size": _env_int("DB_POOL_SIZE", POSTGRES_POOL_DEFAULTS["pool_size"]),
+            "max_overflow": _env_int("DB_MAX_OVERFLOW", POSTGRES_POOL_DEFAULTS["max_overflow"]),
+            "pool_timeout": _env_int("DB_POOL_TIMEOUT", POSTGRES_POOL_DEFAULTS["pool_timeout"]),
+            "pool_recycle": _env_int("DB_POOL_RECYCLE", POSTGRES_POOL_DEFAULTS["pool_recycle"]),
+            "pool_pre_ping": True,
+        }
+
+    return {"pool_pre_ping": True}
+
+
+@event.listens_for(Engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tunes every new SQLite connection: WAL journal so readers do not block the
+    writer, synchronous=NORMAL (durable with WAL, far fewer fsyncs), a busy
+    timeout, page cache and memory-mapped I/O. Other drivers are left untouched.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', SQLITE_PRAGMAS_DEFAULTS['busy_timeout_ms'])}")
+        # Negative cache_size is expressed in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{_env_int('SQLITE_CACHE_SIZE_KIB', SQLITE_PRAGMAS_DEFAULTS['cache_size_kib'])}")
+        cursor.execute(f"PRAGMA mmap_size={_env_int('SQLITE_MMAP_SIZE_BYTES', SQLITE_PRAGMAS_DEFAULTS['mmap_size_bytes'])}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def configure_database(app):
+    """
+    Sets SQLALCHEMY_DATABASE_URI and SQLALCHEMY_ENGINE_OPTIONS on the Flask app
+    from the environment. Must run before db.init_app(app).
+    """
+    database_url = get_database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(database_url)
+    return database_url
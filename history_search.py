@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, column, event, exists, func, literal_column, select, table, text
+
+from models import db, HistoriaClinica, Paciente, historia_diagnostico_association
+
+# Full-text search over HistoriaClinica.motivo / observaciones.
+# SQLite: an external-content FTS5 table kept in sync by triggers, so every write
+# path (ORM, bulk inserts, manual SQL) updates the index; ranked with bm25().
+# PostgreSQL: a GIN index on a tsvector expression; ranked with ts_rank().
+# Both return a highlighted fragment built from the same markers.
+
+FTS_TABLE = 'historia_clinica_fts'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Fragment highlight markers (control characters never typed by users)
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# name -> DDL; created by ensure_search_index, dropped with the metadata (below)
+_SQLITE_DDL = {
+    FTS_TABLE: f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        motivo, observaciones,
+        content='historia_clinica', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    'historia_clinica_fts_ai': f"""CREATE TRIGGER historia_clinica_fts_ai AFTER INSERT ON historia_clinica BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, motivo, observaciones) VALUES (new.id, new.motivo, new.observaciones);
+    END""",
+    'historia_clinica_fts_ad': f"""CREATE TRIGGER historia_clinica_fts_ad AFTER DELETE ON historia_clinica BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, motivo, observaciones)
+        VALUES ('delete', old.id, old.motivo, old.observaciones);
+    END""",
+    'historia_clinica_fts_au': f"""CREATE TRIGGER historia_clinica_fts_au AFTER UPDATE OF motivo, observaciones ON historia_clinica BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, motivo, observaciones)
+        VALUES ('delete', old.id, old.motivo, old.observaciones);
+        INSERT INTO {FTS_TABLE}(rowid, motivo, observaciones) VALUES (new.id, new.motivo, new.observaciones);
+    END""",
+}
+
+# Must match the indexed expression exactly for PostgreSQL to use the GIN index
+_PG_VECTOR_SQL = ("to_tsvector('spanish', coalesce(historia_clinica.motivo, '') || ' ' || "
+                  "coalesce(historia_clinica.observaciones, ''))")
+_PG_INDEX_NAME = 'ix_historia_clinica_fts'
+
+# drop_all() does not know about the FTS objects: drop them first (the GIN index
+# goes with historia_clinica)
+for _name in reversed(list(_SQLITE_DDL)):
+    _kind = 'TABLE' if _name == FTS_TABLE else 'TRIGGER'
+    event.listen(db.metadata, 'before_drop',
+                 DDL(f'DROP {_kind} IF EXISTS {_name}').execute_if(dialect='sqlite'))
+
+
+def ensure_search_index(conn):
+    """
+    Creates the search index (and, on SQLite, its sync triggers) if missing and
+    refills it from the existing rows. Returns True when it was created. Called by upgrade_schema.
+    """
+    if conn.dialect.name == 'sqlite':
+        existing = {name for (name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE name LIKE 'historia_clinica_fts%'"))}
+        missing = [name for name in _SQLITE_DDL if name not in existing]
+        if not missing:
+            return False
+        for name in missing:
+            conn.execute(text(_SQLITE_DDL[name]))
+        # Writes made while a trigger was missing never reached the index
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        return True
+    if conn.dialect.name == 'postgresql':
+        if conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {'name': _PG_INDEX_NAME}).first():
+            return False
+        conn.execute(text(f"CREATE INDEX {_PG_INDEX_NAME} ON historia_clinica USING gin (({_PG_VECTOR_SQL}))"))
+        return True
+    return False
+
+
+def rebuild_search_index():
+    """Re-reads every history into the index (SQLite) and merges its segments. Requires an app context."""
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    elif db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(f'REINDEX INDEX {_PG_INDEX_NAME}'))
+
+
+def build_fts_query(terms):
+    """
+    Turns free text into a safe FTS5 query: every word is quoted (so punctuation
+    and operators typed by the user are literal), words are ANDed, and a trailing
+    '*' keeps prefix search ("salbu*").
+    """
+    parts = []
+    for word in terms.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            parts.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(parts)
+
+
+def _filtered(stmt, paciente_id, desde, hasta, diagnostico_id):
+    stmt = stmt.where(Paciente.visible())  # both statements join the patient
+    if paciente_id is not None:
+        stmt = stmt.where(HistoriaClinica.paciente_id == paciente_id)
+    if desde is not None:
+        stmt = stmt.where(HistoriaClinica.fecha >= datetime.combine(desde, datetime.min.time()))
+    if hasta is not None:
+        stmt = stmt.where(HistoriaClinica.fecha < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    if diagnostico_id is not None:
+        stmt = stmt.where(exists().where(
+            historia_diagnostico_association.c.historia_clinica_id == HistoriaClinica.id,
+            historia_diagnostico_association.c.diagnostico_id == diagnostico_id,
+        ))
+    return stmt
+
+
+_fts_table = table(FTS_TABLE, column('rowid'))
+
+
+def _sqlite_statement(terms):
+    fts = literal_column(FTS_TABLE)  # FTS5 functions and MATCH take the table itself
+    match = build_fts_query(terms)
+    if not match:
+        return None
+    # motivo weighs twice as much as observaciones
+    rank = func.bm25(fts, 2.0, 1.0)
+    return (
+        select(
+            HistoriaClinica.id, HistoriaClinica.paciente_id, Paciente.nombre.label('paciente_nombre'),
+            HistoriaClinica.fecha, HistoriaClinica.motivo,
+            func.snippet(fts, -1, _MARK_START, _MARK_END, '…', 16).label('fragmento'),
+            rank.label('rank'),
+        )
+        .select_from(_fts_table)
+        .join(HistoriaClinica, HistoriaClinica.id == _fts_table.c.rowid)
+        .join(Paciente, Paciente.id == HistoriaClinica.paciente_id)
+        .where(fts.op('MATCH')(match))
+        .order_by(rank)
+    )
+
+
+def _postgresql_statement(terms):
+    vector = literal_column(_PG_VECTOR_SQL)
+    query = func.websearch_to_tsquery(literal_column("'spanish'"), terms)
+    rank = func.ts_rank(vector, query)
+    fragment = func.ts_headline(
+        literal_column("'spanish'"),
+        func.coalesce(HistoriaClinica.observaciones, HistoriaClinica.motivo),
+        query,
+        f'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=10',
+    )
+    return (
+        select(
+            HistoriaClinica.id, HistoriaClinica.paciente_id, Paciente.nombre.label('paciente_nombre'),
+            HistoriaClinica.fecha, HistoriaClinica.motivo,
+            fragment.label('fragmento'), rank.label('rank'),
+        )
+        .join(Paciente, Paciente.id == HistoriaClinica.paciente_id)
+        .where(vector.op('@@')(query))
+        .order_by(rank.desc())
+    )
+
+
+def search_historias(terms, paciente_id=None, desde=None, hasta=None, diagnostico_id=None,
+                     page=1, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Ranked search over motivo and observaciones. Returns (results, has_more); results
+    are row mappings with id, paciente_id, paciente_nombre, fecha, motivo, fragmento
+    (see highlight()) and rank. Requires an application context.
+    """
+    terms = (terms or '').strip()
+    if not terms:
+        return [], False
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    if db.engine.dialect.name == 'postgresql':
+        stmt = _postgresql_statement(terms)
+    else:
+        stmt = _sqlite_statement(terms)
+        if stmt is None:
+            return [], False
+
+    stmt = _filtered(stmt, paciente_id, desde, hasta, diagnostico_id)
+    stmt = stmt.limit(page_size + 1).offset((max(page, 1) - 1) * page_size)
+    results = db.session.execute(stmt).mappings().all()
+    return results[:page_size], len(results) > page_size
+
+
+def highlight(fragment):
+    """HTML-safe fragment with the matched words wrapped in <mark>."""
+    if not fragment:
+        return Markup('')
+    return Markup(str(escape(fragment)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def plain_fragment(fragment):
+    """Fragment without highlight markers (for JSON clients)."""
+    return (fragment or '').replace(_MARK_START, '').replace(_MARK_END, '')
@@ -1,4 +1,7 @@
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Import local services
 try:
@@ -8,7 +11,7 @@ try:
         search_diseases as local_search_diseases
     )
 except ImportError:
-    print("Error: Could not import from local_icd_service. Make sure it's in the Python path.")
+    logger.error("Could not import from local_icd_service. Make sure it's in the Python path.")
     # Define dummy functions to allow script to load for inspection if local_icd_service is missing
     def local_get_chapters(): return []
     def local_get_disease_details(_code): return None
@@ -28,7 +31,7 @@ def search_icd_codes(search_term):
     local_results = local_search_diseases(search_term)
 
     if local_results is None: # Should be an empty list if no results, None if error in local_search_diseases
-        print(f"Error or no data from local_search_diseases for '{search_term}'.")
+        logger.warning("No data from local_search_diseases", extra={"search_term": search_term})
         return ([], "LOCAL_SEARCH_ERROR_OR_NO_DATA")
 
     formatted_results = []
@@ -69,7 +72,7 @@ def get_icd_chapters():
     local_chapters = local_get_chapters() # Returns [{'chapter_id': '01', 'chapter_title': 'Title'}]
 
     if local_chapters is None: # Should be an empty list if no chapters, None if error
-        print("Error or no data from local_get_chapters.")
+        logger.warning("No data from local_get_chapters")
         return ([], "LOCAL_CHAPTERS_ERROR_OR_NO_DATA")
         
     transformed_chapters = []
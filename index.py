@@ -1,65 +1,185 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
-from flask_login import LoginManager, login_user, login_required, logout_user
-from models import db, User, Paciente, HistoriaClinica, Cita, Diagnostico, Tratamiento, Factura, ItemFactura # Asegúrate de importar User desde models.py
+import logging
+from flask import render_template, redirect, url_for, flash, request, jsonify, Response, stream_with_context, send_file, abort
+from flask_login import login_user, login_required, logout_user
+from models import db, User, Paciente, HistoriaClinica, Cita, Diagnostico, Tratamiento, Factura, ItemFactura, SecuenciaFactura, ResumenFacturacionMensual, ResumenFacturacionTratamiento, ResumenFacturacionPaciente, Recurso, Trabajo, historia_diagnostico_association, historia_tratamiento_association # Asegúrate de importar User desde models.py
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime
+from sqlalchemy.orm import joinedload, undefer_group
+from datetime import datetime, timedelta
+from itertools import zip_longest
+from decimal import Decimal, InvalidOperation
 from icd_api_service import search_icd_codes, get_icd_chapters
-
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'tu_clave_secreta'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-db.init_app(app)
-
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-
-# Define la función user_loader
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+from response_cache import cached_response
+from schema_upgrade import upgrade_schema
+from patient_import import import_patients, detect_format, open_text_stream
+from billing_export import iter_export_rows, parse_date, FORMATTERS, ESTADOS_FACTURA
+from agenda import find_conflict, calendar_range, citas_en_rango, free_slots, parse_fecha, validar_duracion
+from timeline import timeline_page, DEFAULT_PAGE_SIZE as TIMELINE_PAGE_SIZE
+from history_search import search_historias, highlight, plain_fragment, DEFAULT_PAGE_SIZE as SEARCH_PAGE_SIZE
+from logging_config import configure_logging
+from billing_summary import apply_items_delta, item_tuples, move_factura_estado
+from patient_delete import delete_pacientes, mark_pacientes_deleted
+from jobs import HANDLERS as JOB_HANDLERS, enqueue, job_status
+from invoice_pdf import get_invoice_pdf
+from catalog_cache import get_catalog
+from app_factory import create_app, load_user
+from compression import stream_page
+from tombstones import record_deleted
+
+
+configure_logging() # LOG_LEVEL (default INFO), LOG_FORMAT: text or json
+logger = logging.getLogger(__name__)
+
+app = create_app(import_name=__name__) # profile from APP_CONFIG: development (default), testing or production
 
 # --- Helper Functions for Invoicing ---
+CENTS = Decimal('0.01')
+
+def _seed_invoice_sequence(prefix):
+    """
+    Highest numeric suffix among existing invoices with the given prefix.
+    Only used the first time a year is allocated, so databases created before
+    the sequence table continue their numbering instead of restarting at 1.
+    """
+    highest = 0
+    for (numero,) in db.session.query(Factura.numero_factura).filter(Factura.numero_factura.like(f"{prefix}%")):
+        try:
+            highest = max(highest, int(numero.split('-')[-1]))
+        except (ValueError, IndexError):
+            continue
+    return highest
+
 def get_next_invoice_number():
+    """
+    Allocates the next invoice number for the current year from secuencia_factura.
+    The increment is a single UPDATE ... RETURNING (or an INSERT ... ON CONFLICT
+    upsert the first time a year is seen), so concurrent workers are serialized by
+    the row lock and never compute the same number. The allocation belongs to the
+    caller's transaction and is rolled back together with the invoice on failure.
+    """
     current_year = datetime.utcnow().year
     prefix = f"INV-{current_year}-"
-    
-    # Find the last invoice for the current year
-    last_invoice_for_year = Factura.query.filter(Factura.numero_factura.like(f"{prefix}%")) \
-                                       .order_by(Factura.numero_factura.desc()).first()
-    
-    next_number = 1
-    if last_invoice_for_year:
-        try:
-            # Extract the numeric part and increment
-            last_numeric_part = int(last_invoice_for_year.numero_factura.split('-')[-1])
-            next_number = last_numeric_part + 1
-        except (ValueError, IndexError):
-            # Fallback: if parsing fails, count existing invoices for the year and add 1
-            # This is a simplified fallback. A more robust solution might involve a dedicated sequence.
-            all_year_invoices_count = Factura.query.filter(Factura.numero_factura.like(f"{prefix}%")).count()
-            next_number = all_year_invoices_count + 1
+    secuencia = SecuenciaFactura.__table__
+
+    next_number = db.session.execute(
+        update(secuencia)
+        .where(secuencia.c.anio == current_year)
+        .values(ultimo_numero=secuencia.c.ultimo_numero + 1)
+        .returning(secuencia.c.ultimo_numero)
+    ).scalar()
+
+    if next_number is None:
+        # First invoice of the year: create the row, or increment it if another worker just did
+        dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+        next_number = db.session.execute(
+            dialect.insert(secuencia)
+            .values(anio=current_year, ultimo_numero=_seed_invoice_sequence(prefix) + 1)
+            .on_conflict_do_update(
+                index_elements=[secuencia.c.anio],
+                set_={'ultimo_numero': secuencia.c.ultimo_numero + 1}
+            )
+            .returning(secuencia.c.ultimo_numero)
+        ).scalar_one()
 
     return f"{prefix}{next_number:04d}" # Ensures 4-digit padding
 
-def calculate_and_update_invoice_total(factura_id):
-    factura = Factura.query.get(factura_id) 
-    if not factura:
-        # Log or handle error: Factura not found
-        print(f"Error: Factura with ID {factura_id} not found for total calculation.")
-        return
+def calculate_and_update_invoice_total(factura):
+    """
+    Recomputes factura.total with a SQL SUM over its items.
+    Runs inside the caller's transaction (pending item changes are flushed
+    first) and does not commit; the caller commits once for item + total.
+    """
+    db.session.flush()
+    items_sum = db.session.query(func.coalesce(func.sum(ItemFactura.subtotal), 0)) \
+                          .filter(ItemFactura.factura_id == factura.id).scalar()
+    factura.total = Decimal(str(items_sum)).quantize(CENTS)
+    factura.updated_at = datetime.utcnow() # Item changes are changes to the invoice (version/ETag)
+    return factura.total
+
+def _parse_cantidad(value):
+    """Item quantity: an int or a string of digits; only a missing value defaults to 1."""
+    if value is None:
+        return 1
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise TypeError(f'cantidad inválida: {value!r}')
+    return int(value)  # '2.5' and '' raise ValueError; 0 and negatives are rejected by the caller
+
+def build_invoice_item_rows(factura_id, raw_items):
+    """
+    Validates a batch of raw item dicts (descripcion, cantidad, precio_unitario,
+    tratamiento_id) and returns (rows, errors). Referenced tratamientos are
+    resolved with a single IN query; when descripcion or precio_unitario are
+    omitted they default to the tratamiento's descripcion and costo.
+    Rows are plain dicts ready for a bulk insert into item_factura.
+    """
+    errors = []
+    tratamiento_ids = set()
+    for index, raw in enumerate(raw_items, start=1):
+        tratamiento_id = raw.get('tratamiento_id')
+        if tratamiento_id not in (None, ''):
+            try:
+                tratamiento_ids.add(int(tratamiento_id))
+            except (TypeError, ValueError):
+                errors.append(f'Ítem {index}: tratamiento inválido.')
+
+    tratamientos = {}
+    if tratamiento_ids:
+        tratamientos = {t.id: t for t in Tratamiento.query.filter(Tratamiento.id.in_(tratamiento_ids))}
+
+    rows = []
+    for index, raw in enumerate(raw_items, start=1):
+        tratamiento = None
+        tratamiento_id = raw.get('tratamiento_id')
+        if tratamiento_id not in (None, ''):
+            try:
+                tratamiento = tratamientos.get(int(tratamiento_id))
+            except (TypeError, ValueError):
+                continue # Already reported above
+            if tratamiento is None:
+                errors.append(f'Ítem {index}: el tratamiento {tratamiento_id} no existe.')
+                continue
+
+        descripcion = (raw.get('descripcion') or '').strip()
+        if not descripcion and tratamiento:
+            descripcion = tratamiento.descripcion[:255]
+        if not descripcion:
+            errors.append(f'Ítem {index}: la descripción es obligatoria.')
+            continue
 
-    new_total = sum(float(item.subtotal) for item in factura.items)
-    factura.total = round(new_total, 2)
-    
-    try:
-        db.session.add(factura) # Ensure factura is part of the session for update
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        # Consider logging this error more formally
-        print(f"Error calculating/updating total for factura {factura.id}: {e}")
-        # Depending on context, might re-raise or flash a message if called from a route
+        try:
+            cantidad = _parse_cantidad(raw.get('cantidad'))
+            precio_raw = raw.get('precio_unitario')
+            if precio_raw in (None, '') and tratamiento and tratamiento.costo is not None:
+                precio_raw = tratamiento.costo
+            precio_unitario = Decimal(str(precio_raw))
+        except (TypeError, ValueError, InvalidOperation):
+            errors.append(f'Ítem {index}: cantidad y precio unitario deben ser números válidos.')
+            continue
+
+        if cantidad <= 0 or not precio_unitario.is_finite() or precio_unitario < 0:
+            errors.append(f'Ítem {index}: cantidad debe ser positiva y precio unitario no negativo.')
+            continue
+
+        precio_unitario = precio_unitario.quantize(CENTS)
+        rows.append({
+            'factura_id': factura_id,
+            'descripcion': descripcion,
+            'cantidad': cantidad,
+            'precio_unitario': precio_unitario,
+            'subtotal': cantidad * precio_unitario,
+            'tratamiento_id': tratamiento.id if tratamiento else None,
+        })
+    return rows, errors
+
+def get_paciente_or_404(paciente_id):
+    """The patient, or 404 when it does not exist or is soft-deleted (pending purge)."""
+    return Paciente.query.filter(Paciente.id == paciente_id, Paciente.visible()).first_or_404()
+
+def get_visible_or_404(model, ident, *options):
+    """A history, appointment or invoice by id; 404 also when its patient is soft-deleted."""
+    return model.query.options(*options) \
+        .filter(model.id == ident, Paciente.visible_owner(model.paciente_id)).first_or_404()
 
 # --- End Helper Functions ---
 
@@ -125,14 +245,14 @@ def logout():
 @app.route('/pacientes')
 @login_required
 def pacientes():
-    pacientes = Paciente.query.all()  # Suponiendo que tienes un modelo Paciente
+    visibles = Paciente.query.filter(Paciente.visible())
     q = request.args.get('buscar')
     if q:
-        pacientes = Paciente.query.filter(
+        pacientes = visibles.filter(
             (Paciente.nombre.ilike(f"%{q}%")) | (Paciente.documento.ilike(f"%{q}%"))
         ).all()
     else:
-        pacientes = Paciente.query.all()
+        pacientes = visibles.all()
 
     return render_template('pacientes.html', pacientes=pacientes)
 
@@ -147,7 +267,12 @@ def nuevo_paciente():
         direccion = request.form.get('direccion')
         correo = request.form.get('correo')
 
-        if Paciente.query.filter_by(documento=documento).first():
+        existente = Paciente.query.filter_by(documento=documento).first()
+        if existente and existente.eliminado_en:
+            # A soft-deleted patient keeps its documento until the purge deletes it
+            flash('Ese número de documento pertenece a un paciente eliminado pendiente de purga.')
+            return redirect(url_for('nuevo_paciente'))
+        if existente:
             flash('Ya existe un paciente con ese número de documento.')
             return redirect(url_for('nuevo_paciente'))
 
@@ -165,16 +290,49 @@ def nuevo_paciente():
     return render_template('nuevo_paciente.html')
 
 
+@app.route('/pacientes/importar', methods=['GET', 'POST'])
+@login_required
+def importar_pacientes():
+    """
+    Bulk import from an uploaded CSV/NDJSON file (see patient_import.py).
+    Answers JSON when the client asks for it (Accept: application/json).
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            if wants_json:
+                return jsonify({'error': 'Debe adjuntar un archivo.'}), 400
+            flash('Debe adjuntar un archivo CSV o NDJSON.', 'danger')
+            return redirect(url_for('importar_pacientes'))
+
+        fmt = request.form.get('formato') or detect_format(archivo.filename)
+        try:
+            report = import_patients(open_text_stream(archivo.stream), fmt=fmt)
+        except (ValueError, UnicodeDecodeError) as e:
+            if wants_json:
+                return jsonify({'error': f'No se pudo leer el archivo: {e}'}), 400
+            flash(f'No se pudo leer el archivo: {e}', 'danger')
+            return redirect(url_for('importar_pacientes'))
+
+        if wants_json:
+            return jsonify(report.as_dict())
+        flash(f'Importación finalizada: {report.inserted} pacientes creados, {report.rejected} filas rechazadas.',
+              'success' if not report.rejected else 'warning')
+        return render_template('importar_pacientes.html', report=report)
+    return render_template('importar_pacientes.html', report=None)
+
 @app.route('/pacientes/<int:id>')
 @login_required
+@cached_response('paciente', 'cita')
 def ver_paciente(id):
-    paciente = Paciente.query.get_or_404(id)
+    paciente = get_paciente_or_404(id)
     return render_template('ver_paciente.html', paciente=paciente)
 
 @app.route('/pacientes/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_paciente(id):
-    paciente = Paciente.query.get_or_404(id)
+    paciente = get_paciente_or_404(id)
     if request.method == 'POST':
         paciente.nombre = request.form['nombre']
         paciente.edad = request.form['edad']
@@ -194,28 +352,68 @@ def editar_paciente(id):
 @app.route('/pacientes/<int:id>/eliminar', methods=['GET', 'POST'])
 @login_required
 def eliminar_paciente(id):
-    paciente = Paciente.query.get_or_404(id)
+    paciente = get_paciente_or_404(id)
+    deferred = app.config['PATIENT_DELETE_MODE'] == 'deferred'
     try:
-        db.session.delete(paciente)
+        # Set-based DELETEs per table instead of loading the patient's rows through the ORM cascade
+        if deferred:
+            mark_pacientes_deleted([paciente.id])
+            enqueue('purgar_pacientes', unique=True)
+        else:
+            delete_pacientes([paciente.id])
         db.session.commit()
         flash('Paciente eliminado correctamente.')
     except Exception as e:
         db.session.rollback()
+        logger.exception('patient delete failed', extra={'paciente_id': id})
         flash('Error al eliminar el paciente.')
     return redirect(url_for('pacientes'))
 
+@app.route('/pacientes/<int:paciente_id>/timeline')
+@login_required
+def timeline_paciente(paciente_id):
+    """
+    Histories, appointments and invoices of a patient in one list, newest first.
+    Paginated with ?cursor= (keyset); answers JSON when the client asks for it.
+    """
+    paciente = get_paciente_or_404(paciente_id)
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    limit = request.args.get('limit', TIMELINE_PAGE_SIZE, type=int)
+    try:
+        eventos, next_cursor = timeline_page(paciente.id, limit, request.args.get('cursor'))
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('timeline_paciente', paciente_id=paciente.id))
+
+    if wants_json:
+        return jsonify({
+            'data': [{
+                'tipo': evento['tipo'],
+                'id': evento['id'],
+                'fecha': evento['fecha'].isoformat(),
+                'titulo': evento['titulo'],
+                'estado': evento['estado'],
+                'importe': str(evento['importe']) if evento['importe'] is not None else None,
+            } for evento in eventos],
+            'next_cursor': next_cursor,
+        })
+    return render_template('timeline_paciente.html', paciente=paciente, eventos=eventos,
+                           next_cursor=next_cursor, limit=limit)
+
 @app.route('/pacientes/<int:paciente_id>/historias')
 @login_required
 def listar_historias(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = get_paciente_or_404(paciente_id)
     return render_template('listar_historias.html', paciente=paciente)
 
 @app.route('/pacientes/<int:paciente_id>/historias/nuevo', methods=['GET', 'POST'])
 @login_required
 def nueva_historia(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
-    diagnosticos_catalogo = Diagnostico.query.order_by(Diagnostico.descripcion).all()
-    tratamientos_catalogo = Tratamiento.query.order_by(Tratamiento.descripcion).all()
+    paciente = get_paciente_or_404(paciente_id)
+    diagnosticos_catalogo = get_catalog('diagnostico')
+    tratamientos_catalogo = get_catalog('tratamiento')
     
     if request.method == 'POST':
         motivo = request.form['motivo']
@@ -250,40 +448,104 @@ def nueva_historia(paciente_id):
             db.session.rollback()
             flash(f'Error al crear la historia: {e}', 'danger')
             
-    return render_template('nueva_historia.html', paciente=paciente, diagnosticos_catalogo=diagnosticos_catalogo, tratamientos_catalogo=tratamientos_catalogo)
+    # A failed save rolled back and expired the objects; reloading them needs the request's session
+    render = stream_page if request.method == 'GET' else render_template
+    return render('nueva_historia.html', paciente=paciente, diagnosticos_catalogo=diagnosticos_catalogo, tratamientos_catalogo=tratamientos_catalogo)
+
+@app.route('/historias/buscar')
+@login_required
+def buscar_historias():
+    """
+    Full-text search over motivo / observaciones, best matches first.
+    Query args: q, paciente_id, desde, hasta (YYYY-MM-DD), diagnostico_id, pagina.
+    Answers JSON when the client asks for it (Accept: application/json).
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    q = request.args.get('q', '').strip()
+    paciente_id = request.args.get('paciente_id', type=int)
+    diagnostico_id = request.args.get('diagnostico_id', type=int)
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    try:
+        desde = parse_date(request.args.get('desde'), 'desde')
+        hasta = parse_date(request.args.get('hasta'), 'hasta')
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'danger')
+        desde = hasta = None
+        q = ''
+
+    resultados, hay_mas = search_historias(q, paciente_id=paciente_id, desde=desde, hasta=hasta,
+                                           diagnostico_id=diagnostico_id, page=pagina,
+                                           page_size=SEARCH_PAGE_SIZE)
+    if wants_json:
+        return jsonify({
+            'data': [{
+                'id': r['id'],
+                'paciente_id': r['paciente_id'],
+                'paciente_nombre': r['paciente_nombre'],
+                'fecha': r['fecha'].isoformat(),
+                'motivo': r['motivo'],
+                'fragmento': plain_fragment(r['fragmento']),
+            } for r in resultados],
+            'pagina': pagina,
+            'hay_mas': hay_mas,
+        })
+
+    diagnosticos = Diagnostico.query.order_by(Diagnostico.codigo).all()
+    return render_template('buscar_historias.html', q=q, resultados=resultados, hay_mas=hay_mas,
+                           pagina=pagina, highlight=highlight, diagnosticos=diagnosticos,
+                           filtros={'paciente_id': paciente_id, 'diagnostico_id': diagnostico_id,
+                                    'desde': desde, 'hasta': hasta})
 
 @app.route('/historias/<int:id>')
 @login_required
 def ver_historia(id):
-    historia = HistoriaClinica.query.get_or_404(id)
+    historia = get_visible_or_404(HistoriaClinica, id, undefer_group('texto'))
     return render_template('ver_historia.html', historia=historia)
 
 
+def _sync_historia_links(association, column_name, model, historia_id, selected_ids):
+    """
+    Makes a history's association rows match the submitted ids by set difference:
+    one bulk INSERT for the new links and one DELETE for the removed ones, and no
+    statements at all when the selection is unchanged. Unknown ids are ignored.
+    Returns (added, removed) id sets.
+    """
+    column = association.c[column_name]
+    selected = {int(id_str) for id_str in selected_ids if id_str.isdigit()}
+    current = set(db.session.execute(
+        db.select(column).where(association.c.historia_clinica_id == historia_id)).scalars())
+
+    added = selected - current
+    if added:
+        added = set(db.session.execute(db.select(model.id).where(model.id.in_(added))).scalars())
+    removed = current - selected
+    if removed:
+        db.session.execute(association.delete().where(association.c.historia_clinica_id == historia_id,
+                                                      column.in_(removed)))
+    if added:
+        db.session.execute(insert(association), [{'historia_clinica_id': historia_id, column_name: value}
+                                                 for value in sorted(added)])
+    return added, removed
+
 @app.route('/pacientes/<int:paciente_id>/historias/<int:historia_id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_historia(paciente_id, historia_id): 
-    historia = HistoriaClinica.query.get_or_404(historia_id)
-    paciente = Paciente.query.get_or_404(historia.paciente_id) 
-    diagnosticos_catalogo = Diagnostico.query.order_by(Diagnostico.descripcion).all()
-    tratamientos_catalogo = Tratamiento.query.order_by(Tratamiento.descripcion).all()
+    historia = get_visible_or_404(HistoriaClinica, historia_id, undefer_group('texto'))
+    paciente = get_paciente_or_404(historia.paciente_id) 
+    diagnosticos_catalogo = get_catalog('diagnostico')
+    tratamientos_catalogo = get_catalog('tratamiento')
 
     if request.method == 'POST':
         historia.motivo = request.form['motivo']
         historia.observaciones = request.form.get('observaciones')
         
-        selected_diag_ids = request.form.getlist('diagnosticos_seleccionados')
-        selected_diagnosticos = []
-        if selected_diag_ids:
-            selected_diagnosticos = Diagnostico.query.filter(Diagnostico.id.in_([int(id_str) for id_str in selected_diag_ids])).all()
-        historia.diagnosticos = selected_diagnosticos
-        
-        selected_trat_ids = request.form.getlist('tratamientos_seleccionados')
-        selected_tratamientos = []
-        if selected_trat_ids:
-            selected_tratamientos = Tratamiento.query.filter(Tratamiento.id.in_([int(id_str) for id_str in selected_trat_ids])).all()
-        historia.tratamientos = selected_tratamientos
-        
         try:
+            _sync_historia_links(historia_diagnostico_association, 'diagnostico_id', Diagnostico,
+                                 historia.id, request.form.getlist('diagnosticos_seleccionados'))
+            _sync_historia_links(historia_tratamiento_association, 'tratamiento_id', Tratamiento,
+                                 historia.id, request.form.getlist('tratamientos_seleccionados'))
             db.session.commit()
             flash('Historia clínica actualizada correctamente.', 'success')
             return redirect(url_for('listar_historias', paciente_id=historia.paciente_id))
@@ -291,14 +553,18 @@ def editar_historia(paciente_id, historia_id):
             db.session.rollback()
             flash(f'Ocurrió un error al actualizar la historia clínica: {e}', 'danger')
             
-    return render_template('editar_historia.html', historia=historia, paciente=paciente, diagnosticos_catalogo=diagnosticos_catalogo, tratamientos_catalogo=tratamientos_catalogo)
+    render = stream_page if request.method == 'GET' else render_template # see nueva_historia
+    return render('editar_historia.html', historia=historia, paciente=paciente, diagnosticos_catalogo=diagnosticos_catalogo, tratamientos_catalogo=tratamientos_catalogo,
+                  diagnosticos_seleccionados={d.id for d in historia.diagnosticos},
+                  tratamientos_seleccionados={t.id for t in historia.tratamientos})
 
 
 @app.route('/pacientes/<int:paciente_id>/historias/<int:historia_id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_historia(paciente_id, historia_id):
-    historia = HistoriaClinica.query.get_or_404(historia_id)
+    historia = get_visible_or_404(HistoriaClinica, historia_id)
     try:
+        record_deleted('historias', [historia.id])
         db.session.delete(historia)
         db.session.commit()
         flash('Historia clínica eliminada correctamente.', 'success')
@@ -311,81 +577,211 @@ def eliminar_historia(paciente_id, historia_id):
 @app.route('/citas')
 @login_required
 def citas():
-    todas_las_citas = Cita.query.order_by(Cita.fecha_hora.desc()).all()
-    return render_template('citas.html', citas=todas_las_citas)
+    # Patients are joined in: the page is streamed after the request's session is closed
+    todas_las_citas = Cita.query.options(joinedload(Cita.paciente_cita)) \
+        .filter(Paciente.visible_owner(Cita.paciente_id)).order_by(Cita.fecha_hora.desc()).all()
+    return stream_page('citas.html', citas=todas_las_citas)
+
+
+def _leer_formulario_cita(paciente_id, cita_id=None):
+    """
+    Parses and validates the appointment form, including the overlap check
+    against the patient's and the resource's other appointments.
+    Returns (values, None) or (None, error message).
+    """
+    try:
+        fecha_hora = datetime.strptime(request.form['fecha_hora'], '%Y-%m-%dT%H:%M')
+    except ValueError:
+        return None, 'Formato de fecha y hora inválido. Use YYYY-MM-DDTHH:MM.'
+
+    duracion, error = validar_duracion(request.form.get('duracion_minutos'))
+    if error:
+        return None, error
+
+    recurso_id = None
+    recurso_id_str = request.form.get('recurso_id')
+    if recurso_id_str:
+        recurso = db.session.get(Recurso, int(recurso_id_str)) if recurso_id_str.isdigit() else None
+        if recurso is None:
+            return None, 'El recurso seleccionado no existe.'
+        recurso_id = recurso.id
+
+    conflicto = find_conflict(fecha_hora, duracion, paciente_id, recurso_id, exclude_id=cita_id)
+    if conflicto:
+        quien = 'el paciente' if conflicto.paciente_id == paciente_id else 'el recurso'
+        return None, (f"La cita se superpone con otra de {quien} "
+                      f"({conflicto.fecha_hora.strftime('%Y-%m-%d %H:%M')} - {conflicto.fecha_fin.strftime('%H:%M')}).")
+
+    return {
+        'fecha_hora': fecha_hora,
+        'duracion_minutos': duracion,
+        'recurso_id': recurso_id,
+        'motivo': request.form['motivo'],
+        'notas': request.form.get('notas'),
+    }, None
+
+
+def _recursos_activos():
+    return Recurso.query.filter_by(activo=True).order_by(Recurso.nombre).all()
+
+
+@app.route('/citas/calendario')
+@login_required
+def calendario_citas():
+    """Day / week / month view served by a range query on cita.fecha_hora."""
+    vista = request.args.get('vista', 'semana')
+    recurso_id = request.args.get('recurso_id', type=int)
+    try:
+        fecha = parse_fecha(request.args.get('fecha'))
+        inicio, fin = calendar_range(vista, fecha)
+    except ValueError:
+        flash('Parámetros de calendario inválidos.', 'danger')
+        return redirect(url_for('calendario_citas'))
+
+    citas_por_dia = {}
+    for cita in citas_en_rango(inicio, fin, recurso_id):
+        citas_por_dia.setdefault(cita.fecha_hora.date(), []).append(cita)
+
+    dias = [(inicio + timedelta(days=n)).date() for n in range((fin - inicio).days)]
+    navegacion = {
+        'anterior': (inicio - timedelta(days=1)).date(),
+        'siguiente': fin.date(),
+    }
+    return render_template('calendario_citas.html', vista=vista, fecha=fecha, dias=dias,
+                           citas_por_dia=citas_por_dia, navegacion=navegacion,
+                           recursos=_recursos_activos(), recurso_id=recurso_id)
+
+
+@app.route('/citas/disponibilidad')
+@login_required
+def disponibilidad_citas():
+    """Free start times for a day: ?fecha=YYYY-MM-DD&duracion_minutos=30&recurso_id=1"""
+    try:
+        fecha = parse_fecha(request.args.get('fecha'))
+    except ValueError:
+        return jsonify({'error': 'fecha debe tener el formato YYYY-MM-DD.'}), 400
+    duracion, error = validar_duracion(request.args.get('duracion_minutos'))
+    if error:
+        return jsonify({'error': error}), 400
+    recurso_id = request.args.get('recurso_id', type=int)
+
+    slots = free_slots(fecha, duracion, recurso_id)
+    return jsonify({
+        'fecha': fecha.isoformat(),
+        'duracion_minutos': duracion,
+        'recurso_id': recurso_id,
+        'horarios_libres': [slot.strftime('%H:%M') for slot in slots],
+    })
+
+
+@app.route('/recursos', methods=['GET', 'POST'])
+@login_required
+def recursos_list():
+    if request.method == 'POST':
+        nombre = request.form.get('nombre', '').strip()
+        tipo = request.form.get('tipo', 'profesional')
+        if not nombre or tipo not in ('profesional', 'consultorio'):
+            flash('Nombre y tipo de recurso son obligatorios.', 'danger')
+        else:
+            db.session.add(Recurso(nombre=nombre, tipo=tipo))
+            try:
+                db.session.commit()
+                flash('Recurso creado correctamente.', 'success')
+            except IntegrityError:
+                db.session.rollback()
+                flash('Ya existe un recurso con ese nombre.', 'danger')
+        return redirect(url_for('recursos_list'))
+    recursos = Recurso.query.order_by(Recurso.tipo, Recurso.nombre).all()
+    return render_template('recursos.html', recursos=recursos)
+
+
+@app.route('/trabajos', methods=['GET', 'POST'])
+@login_required
+def trabajos_list():
+    """Recent background jobs; POST queues one of the registered job types (run by scriptss/job_worker.py)."""
+    if request.method == 'POST':
+        tipo = request.form.get('tipo', '')
+        if tipo not in JOB_HANDLERS:
+            flash('Tipo de trabajo inválido.', 'danger')
+        else:
+            trabajo = enqueue(tipo, unique=True)
+            db.session.commit()
+            flash(f'Trabajo #{trabajo.id} en cola.', 'success')
+        return redirect(url_for('trabajos_list'))
+    trabajos = Trabajo.query.order_by(Trabajo.id.desc()).limit(50).all()
+    tipos = [(tipo, descripcion) for tipo, (_handler, descripcion) in JOB_HANDLERS.items()]
+    return render_template('trabajos.html', trabajos=trabajos, tipos=tipos)
+
+
+@app.route('/trabajos/<int:trabajo_id>')
+@login_required
+def estado_trabajo(trabajo_id):
+    """Job status as JSON (estado, progreso, mensaje, resultado, error) for polling."""
+    trabajo = Trabajo.query.get_or_404(trabajo_id)
+    return jsonify(job_status(trabajo))
 
 
 @app.route('/pacientes/<int:paciente_id>/citas/nueva', methods=['GET', 'POST'])
 @login_required
 def nueva_cita_paciente(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = get_paciente_or_404(paciente_id)
     if request.method == 'POST':
-        fecha_hora_str = request.form['fecha_hora']
-        motivo = request.form['motivo']
-        notas = request.form.get('notas')
-        
-        try:
-            fecha_hora = datetime.strptime(fecha_hora_str, '%Y-%m-%dT%H:%M')
-        except ValueError:
-            flash('Formato de fecha y hora inválido. Use YYYY-MM-DDTHH:MM.', 'danger')
-            return render_template('nueva_cita.html', paciente=paciente, cita=None)
+        valores, error = _leer_formulario_cita(paciente.id)
+        if error:
+            flash(error, 'danger')
+            return render_template('nueva_cita.html', paciente=paciente, cita=None, recursos=_recursos_activos())
 
-        nueva = Cita(paciente_id=paciente.id, fecha_hora=fecha_hora, motivo=motivo, notas=notas)
+        nueva = Cita(paciente_id=paciente.id, **valores)
         db.session.add(nueva)
         db.session.commit()
         flash('Cita creada correctamente.', 'success')
         return redirect(url_for('listar_citas_paciente', paciente_id=paciente.id))
-    return render_template('nueva_cita.html', paciente=paciente, cita=None)
+    return render_template('nueva_cita.html', paciente=paciente, cita=None, recursos=_recursos_activos())
 
 
 @app.route('/pacientes/<int:paciente_id>/citas')
 @login_required
 def listar_citas_paciente(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = get_paciente_or_404(paciente_id)
     return render_template('paciente_citas.html', paciente=paciente, citas=paciente.citas)
 
 
 @app.route('/citas/<int:cita_id>')
 @login_required
 def ver_cita(cita_id):
-    cita = Cita.query.get_or_404(cita_id)
+    cita = get_visible_or_404(Cita, cita_id, undefer_group('texto'))
     return render_template('ver_cita.html', cita=cita)
 
 
 @app.route('/citas/<int:cita_id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_cita(cita_id):
-    cita = Cita.query.get_or_404(cita_id)
-    paciente = Paciente.query.get_or_404(cita.paciente_id)
+    cita = get_visible_or_404(Cita, cita_id, undefer_group('texto'))
+    paciente = get_paciente_or_404(cita.paciente_id)
     if request.method == 'POST':
-        fecha_hora_str = request.form['fecha_hora']
-        try:
-            cita.fecha_hora = datetime.strptime(fecha_hora_str, '%Y-%m-%dT%H:%M')
-        except ValueError:
-            flash('Formato de fecha y hora inválido. Use YYYY-MM-DDTHH:MM.', 'danger')
-            return render_template('nueva_cita.html', cita=cita, paciente=paciente)
+        valores, error = _leer_formulario_cita(paciente.id, cita_id=cita.id)
+        if error:
+            flash(error, 'danger')
+            return render_template('nueva_cita.html', cita=cita, paciente=paciente, recursos=_recursos_activos())
 
-        cita.motivo = request.form['motivo']
-        cita.notas = request.form.get('notas')
+        for campo, valor in valores.items():
+            setattr(cita, campo, valor)
         db.session.commit()
         flash('Cita actualizada correctamente.', 'success')
         return redirect(url_for('ver_cita', cita_id=cita.id))
-    return render_template('nueva_cita.html', cita=cita, paciente=paciente)
+    return render_template('nueva_cita.html', cita=cita, paciente=paciente, recursos=_recursos_activos())
 
 
 @app.route('/citas/<int:cita_id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_cita(cita_id):
-    cita = Cita.query.get_or_404(cita_id)
+    cita = get_visible_or_404(Cita, cita_id)
     paciente_id = cita.paciente_id
+    record_deleted('citas', [cita.id])
     db.session.delete(cita)
     db.session.commit()
     flash('Cita eliminada correctamente.', 'success')
-    paciente = Paciente.query.get(paciente_id)
-    if paciente:
-        return redirect(url_for('listar_citas_paciente', paciente_id=paciente_id))
-    else:
-        return redirect(url_for('citas'))
+    return redirect(url_for('listar_citas_paciente', paciente_id=paciente_id))
 
 # --- ICD Search Route ---
 @app.route('/diagnosticos/buscar_icd') # Defaults to GET requests
@@ -406,9 +802,10 @@ def buscar_icd_api():
 # --- Diagnosticos Catalog Routes ---
 @app.route('/diagnosticos')
 @login_required
+@cached_response('diagnostico')
 def diagnosticos_list():
     diagnosticos = Diagnostico.query.order_by(Diagnostico.codigo).all()
-    return render_template('diagnosticos.html', diagnosticos=diagnosticos)
+    return stream_page('diagnosticos.html', diagnosticos=diagnosticos)
 
 @app.route('/diagnosticos/nuevo', methods=['GET', 'POST'])
 @login_required
@@ -483,6 +880,7 @@ def eliminar_diagnostico(id):
 # --- Tratamientos Catalog Routes ---
 @app.route('/tratamientos')
 @login_required
+@cached_response('tratamiento')
 def tratamientos_list():
     tratamientos = Tratamiento.query.order_by(Tratamiento.codigo).all()
     return render_template('tratamientos.html', tratamientos=tratamientos)
@@ -578,20 +976,47 @@ def eliminar_tratamiento(id):
 @app.route('/facturas')
 @login_required
 def facturas_list():
-    invoices = Factura.query.order_by(Factura.fecha_emision.desc()).all()
+    invoices = Factura.query.options(joinedload(Factura.paciente)) \
+        .filter(Paciente.visible_owner(Factura.paciente_id)) \
+        .order_by(Factura.fecha_emision.desc()).all()
     return render_template('facturas.html', invoices=invoices)
 
+@app.route('/facturas/exportar')
+@login_required
+def exportar_facturas():
+    """
+    Streams invoice lines joined with patient and tratamiento as CSV or NDJSON.
+    Query args: desde, hasta (YYYY-MM-DD, inclusive), estado, formato (csv|ndjson).
+    """
+    formato = request.args.get('formato', 'csv')
+    estado = request.args.get('estado') or None
+    if formato not in FORMATTERS:
+        return jsonify({'error': "formato debe ser 'csv' o 'ndjson'."}), 400
+    if estado and estado not in ESTADOS_FACTURA:
+        return jsonify({'error': f"estado debe ser uno de: {', '.join(ESTADOS_FACTURA)}."}), 400
+    try:
+        desde = parse_date(request.args.get('desde'), 'desde')
+        hasta = parse_date(request.args.get('hasta'), 'hasta')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    formatter, mimetype = FORMATTERS[formato]
+    filename = f"facturacion_{desde or 'inicio'}_{hasta or 'hoy'}.{formato}"
+    rows = iter_export_rows(desde=desde, hasta=hasta, estado=estado)
+    return Response(stream_with_context(formatter(rows)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/pacientes/<int:paciente_id>/facturas')
 @login_required
 def facturas_paciente_list(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = get_paciente_or_404(paciente_id)
     invoices = paciente.facturas.order_by(Factura.fecha_emision.desc()).all()
     return render_template('paciente_facturas.html', paciente=paciente, invoices=invoices)
 
 @app.route('/pacientes/<int:paciente_id>/facturas/nueva', methods=['GET', 'POST'])
 @login_required
 def nueva_factura_paciente(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = get_paciente_or_404(paciente_id)
     if request.method == 'POST':
         fecha_vencimiento_str = request.form.get('fecha_vencimiento')
         fecha_vencimiento = None
@@ -624,14 +1049,17 @@ def nueva_factura_paciente(paciente_id):
 @app.route('/facturas/<int:factura_id>', methods=['GET']) 
 @login_required
 def ver_factura(factura_id):
-    factura = Factura.query.get_or_404(factura_id)
-    tratamientos_catalogo = Tratamiento.query.order_by(Tratamiento.descripcion).all() 
-    return render_template('ver_factura.html', factura=factura, tratamientos_catalogo=tratamientos_catalogo)
+    factura = get_visible_or_404(Factura, factura_id)
+    tratamientos_catalogo = get_catalog('tratamiento')
+    # Lines only show the tratamiento's code: join it in instead of one lazy load (with its descripcion) per line
+    items = factura.items.options(joinedload(ItemFactura.tratamiento).load_only(Tratamiento.codigo)) \
+        .order_by(ItemFactura.id).all()
+    return render_template('ver_factura.html', factura=factura, items=items, tratamientos_catalogo=tratamientos_catalogo)
 
 @app.route('/facturas/<int:factura_id>/items/agregar', methods=['POST'])
 @login_required
 def agregar_item_factura(factura_id):
-    factura = Factura.query.get_or_404(factura_id)
+    factura = get_visible_or_404(Factura, factura_id)
     
     try:
         descripcion = request.form['descripcion']
@@ -644,9 +1072,9 @@ def agregar_item_factura(factura_id):
             return redirect(url_for('ver_factura', factura_id=factura.id))
 
         cantidad = int(cantidad_str)
-        precio_unitario = float(precio_unitario_str) 
+        precio_unitario = Decimal(precio_unitario_str)
         
-        if cantidad <= 0 or precio_unitario < 0:
+        if cantidad <= 0 or not precio_unitario.is_finite() or precio_unitario < 0:
             flash('Cantidad debe ser positiva y precio unitario no negativo.', 'danger')
             return redirect(url_for('ver_factura', factura_id=factura.id))
 
@@ -658,63 +1086,170 @@ def agregar_item_factura(factura_id):
             factura_id=factura.id,
             descripcion=descripcion,
             cantidad=cantidad,
-            precio_unitario=precio_unitario,
+            precio_unitario=precio_unitario.quantize(CENTS),
             tratamiento_id=tratamiento_id
         )
         nuevo_item.calculate_subtotal() 
         
         db.session.add(nuevo_item)
+        apply_items_delta(factura, item_tuples([nuevo_item]))
+        calculate_and_update_invoice_total(factura)
         db.session.commit() 
-        
-        calculate_and_update_invoice_total(factura.id) 
         flash('Ítem agregado a la factura.', 'success')
 
-    except ValueError:
+    except (ValueError, InvalidOperation):
+        db.session.rollback()
         flash('Cantidad y Precio Unitario deben ser números válidos.', 'danger')
     except Exception as e:
         db.session.rollback()
+        logger.exception('Error adding invoice item', extra={'factura_id': factura.id})
         flash(f'Error al agregar ítem: {e}', 'danger')
         
     return redirect(url_for('ver_factura', factura_id=factura.id))
 
+@app.route('/facturas/<int:factura_id>/items/lote', methods=['POST'])
+@login_required
+def agregar_items_factura_lote(factura_id):
+    """
+    Adds several items in one request and one transaction.
+    Accepts JSON ({"items": [{...}, ...]}) or a form with repeated
+    tratamiento_id / descripcion / cantidad / precio_unitario fields, matched by position.
+    """
+    factura = get_visible_or_404(Factura, factura_id)
+    is_json = request.is_json
+
+    if is_json:
+        payload = request.get_json(silent=True) or {}
+        raw_items = payload.get('items')
+        if not isinstance(raw_items, list) or not all(isinstance(raw, dict) for raw in raw_items):
+            return jsonify({'error': 'Se esperaba una lista "items" de objetos.'}), 400
+    else:
+        fields = ('tratamiento_id', 'descripcion', 'cantidad', 'precio_unitario')
+        raw_items = [dict(zip(fields, values))
+                     for values in zip_longest(*(request.form.getlist(field) for field in fields))]
+
+    if not raw_items:
+        if is_json:
+            return jsonify({'error': 'No se enviaron ítems.'}), 400
+        flash('No se seleccionaron ítems para agregar.', 'warning')
+        return redirect(url_for('ver_factura', factura_id=factura.id))
+
+    rows, errors = build_invoice_item_rows(factura.id, raw_items)
+    if errors:
+        if is_json:
+            return jsonify({'error': 'Ítems inválidos.', 'detalles': errors}), 400
+        for error in errors:
+            flash(error, 'danger')
+        return redirect(url_for('ver_factura', factura_id=factura.id))
+
+    try:
+        db.session.execute(insert(ItemFactura), rows)
+        apply_items_delta(factura, item_tuples(rows))
+        total = calculate_and_update_invoice_total(factura)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Error adding invoice items in batch', extra={'factura_id': factura.id})
+        if is_json:
+            return jsonify({'error': f'Error al agregar ítems: {e}'}), 500
+        flash(f'Error al agregar ítems: {e}', 'danger')
+        return redirect(url_for('ver_factura', factura_id=factura.id))
+
+    if is_json:
+        return jsonify({'factura_id': factura.id, 'items_agregados': len(rows), 'total': str(total)}), 201
+    flash(f'{len(rows)} ítems agregados a la factura.', 'success')
+    return redirect(url_for('ver_factura', factura_id=factura.id))
+
 @app.route('/facturas/items/<int:item_id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_item_factura(item_id):
     item = ItemFactura.query.get_or_404(item_id)
-    factura_id = item.factura_id
+    factura = get_visible_or_404(Factura, item.factura_id)
+    factura_id = factura.id
     
     try:
+        apply_items_delta(factura, item_tuples([item]), sign=-1)
+        record_deleted('items', [item.id])
         db.session.delete(item)
+        calculate_and_update_invoice_total(factura)
         db.session.commit()
-        calculate_and_update_invoice_total(factura_id) 
         flash('Ítem eliminado de la factura.', 'success')
     except Exception as e:
         db.session.rollback()
+        logger.exception('Error removing invoice item', extra={'item_id': item_id})
         flash(f'Error al eliminar ítem: {e}', 'danger')
         
     return redirect(url_for('ver_factura', factura_id=factura_id))
 
+@app.route('/facturas/<int:factura_id>/pdf')
+@login_required
+def factura_pdf(factura_id):
+    """Printable invoice, served from the disk cache unless the invoice changed since it was rendered."""
+    cached = get_invoice_pdf(factura_id, app.config['INVOICE_PDF_CACHE_DIR'])
+    if cached is None:
+        abort(404)
+    path, digest, data = cached
+    return send_file(path, mimetype='application/pdf', download_name=f"{data['numero']}.pdf",
+                     etag=digest, conditional=True, max_age=0)
+
 @app.route('/facturas/<int:factura_id>/marcar_pagada', methods=['POST'])
 @login_required
 def marcar_factura_pagada(factura_id):
-    factura = Factura.query.get_or_404(factura_id)
+    factura = get_visible_or_404(Factura, factura_id)
     if factura.estado == 'Pendiente': # Or any other states from which it can be marked paid
-        factura.estado = 'Pagada'
         try:
+            move_factura_estado(factura, factura.estado, 'Pagada')
+            factura.estado = 'Pagada'
             db.session.add(factura) # Ensure it's in session
             db.session.commit()
             flash('Factura marcada como Pagada.', 'success')
         except Exception as e:
             db.session.rollback()
+            logger.exception('Error marking invoice as paid', extra={'factura_id': factura.id})
             flash(f'Error al actualizar estado de la factura: {e}', 'danger')
     else:
         flash('La factura no está en un estado que permita marcarla como pagada directamente.', 'warning')
     return redirect(url_for('ver_factura', factura_id=factura.id))
 
+@app.route('/reportes/facturacion')
+@login_required
+def reporte_facturacion():
+    """Revenue per month, tratamiento, estado and patient, read from the pre-aggregated summary tables."""
+    periodo = request.args.get('periodo') or None
+
+    mensual = ResumenFacturacionMensual.query.filter(ResumenFacturacionMensual.num_items != 0) \
+        .order_by(ResumenFacturacionMensual.periodo.desc(), ResumenFacturacionMensual.estado).all()
+
+    importe_tratamiento = func.sum(ResumenFacturacionTratamiento.importe).label('importe')
+    por_tratamiento = db.session.query(
+        ResumenFacturacionTratamiento.tratamiento_id,
+        Tratamiento.codigo,
+        Tratamiento.descripcion,
+        func.sum(ResumenFacturacionTratamiento.cantidad).label('cantidad'),
+        importe_tratamiento,
+    ).outerjoin(Tratamiento, Tratamiento.id == ResumenFacturacionTratamiento.tratamiento_id) \
+     .group_by(ResumenFacturacionTratamiento.tratamiento_id, Tratamiento.codigo, Tratamiento.descripcion)
+    if periodo:
+        por_tratamiento = por_tratamiento.filter(ResumenFacturacionTratamiento.periodo == periodo)
+    por_tratamiento = por_tratamiento.order_by(importe_tratamiento.desc()).limit(50).all()
+
+    importe_paciente = func.sum(ResumenFacturacionPaciente.importe).label('importe')
+    por_paciente = db.session.query(
+        Paciente.id, Paciente.nombre, Paciente.documento, importe_paciente,
+        func.sum(ResumenFacturacionPaciente.num_items).label('num_items'),
+    ).join(Paciente, Paciente.id == ResumenFacturacionPaciente.paciente_id) \
+     .filter(Paciente.visible()) \
+     .group_by(Paciente.id, Paciente.nombre, Paciente.documento) \
+     .order_by(importe_paciente.desc()).limit(50).all()
+
+    return render_template('reporte_facturacion.html', periodo=periodo, mensual=mensual,
+                           por_tratamiento=por_tratamiento, por_paciente=por_paciente)
+
 # Aquí puedes añadir más rutas y lógica para tu aplicación
 
 @app.route('/diagnosticos/chapters')
 @login_required # Ensure user is logged in
+@cached_response() # ICD data comes from the local JSON file; entries expire with the TTL
 def list_icd_chapters():
     # Route to list ICD chapters
     # The release_uri is no longer used as data is sourced locally.
@@ -755,5 +1290,5 @@ def list_icd_chapters():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema() # create_all plus columns/indexes added since the database was created
     app.run(debug=True)
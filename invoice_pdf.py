@@ -0,0 +1,265 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select
+
+from models import db, Factura, ItemFactura, Paciente, Tratamiento
+
+# Printable invoice PDFs. invoice_data() snapshots everything printed on an
+# invoice into plain data; its hash (plus RENDER_VERSION) names the cached file,
+# instance/facturas_pdf/<factura_id // 1000>/<factura_id>/<hash>.pdf, so a PDF is
+# regenerated only when the invoice, its items or its patient change (one small
+# directory per invoice keeps dropping the stale version cheap).
+# render_invoice_pdf() is a pure function (no database, no app), so batches render
+# in a process pool. The PDF writer is minimal: A4 pages of text in the standard
+# Helvetica fonts (WinAnsi encoding covers Spanish accents), no dependencies.
+
+RENDER_VERSION = 1  # bump when the layout changes so cached PDFs are regenerated
+DEFAULT_CACHE_SUBDIR = 'facturas_pdf'
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+LINE_HEIGHT = 16
+ROWS_FIRST_PAGE = 30
+ROWS_PER_PAGE = 42
+SHARD_SIZE = 1000
+MIN_POOL_BATCH = 500  # smaller chunks render in-process: a render takes ~0.5 ms, a spawned process ~1 s to start
+
+# Helvetica advance widths (1/1000 em) of the characters used in amounts, for right alignment
+_NUMBER_WIDTHS = dict.fromkeys('0123456789', 556) | {'.': 278, ',': 278, '-': 333, ' ': 278}
+
+
+# --- Data ---
+
+def _money(value):
+    return f"{value:.2f}"
+
+
+def invoice_data(factura_id):
+    """Everything printed on the invoice as plain (picklable, hashable) data, or None if it does not exist
+    (or its patient is soft-deleted)."""
+    return invoices_data([factura_id]).get(factura_id)
+
+
+def invoices_data(factura_ids):
+    """invoice_data() for many invoices with two queries: {factura_id: data}."""
+    facturas = db.session.execute(
+        select(Factura.id, Factura.numero_factura, Factura.fecha_emision, Factura.fecha_vencimiento,
+               Factura.estado, Factura.total, Paciente.nombre, Paciente.documento)
+        .join(Paciente, Paciente.id == Factura.paciente_id)
+        .where(Factura.id.in_(factura_ids), Paciente.visible())
+    ).all()
+    data = {
+        f.id: {
+            'id': f.id,
+            'numero': f.numero_factura,
+            'fecha_emision': f.fecha_emision.strftime('%Y-%m-%d'),
+            'fecha_vencimiento': f.fecha_vencimiento.strftime('%Y-%m-%d') if f.fecha_vencimiento else None,
+            'estado': f.estado,
+            'total': _money(f.total),
+            'paciente': f.nombre,
+            'documento': f.documento,
+            'items': [],
+        }
+        for f in facturas
+    }
+    if data:
+        items = db.session.execute(
+            select(ItemFactura.factura_id, ItemFactura.descripcion, Tratamiento.codigo, ItemFactura.cantidad,
+                   ItemFactura.precio_unitario, ItemFactura.subtotal)
+            .outerjoin(Tratamiento, Tratamiento.id == ItemFactura.tratamiento_id)
+            .where(ItemFactura.factura_id.in_(list(data)))
+            .order_by(ItemFactura.factura_id, ItemFactura.id)
+        )
+        for item in items:
+            data[item.factura_id]['items'].append(
+                [item.descripcion, item.codigo, item.cantidad, _money(item.precio_unitario), _money(item.subtotal)])
+    return data
+
+
+def content_hash(data):
+    canonical = json.dumps([RENDER_VERSION, data], sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+# --- Rendering ---
+
+def _pdf_text(text):
+    raw = str(text).encode('cp1252', errors='replace')
+    return raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _text(x, y, text, bold=False, size=10):
+    return b'BT /F%d %d Tf %d %d Td (%s) Tj ET\n' % (2 if bold else 1, size, x, y, _pdf_text(text))
+
+
+def _text_right(x_right, y, text, bold=False, size=10):
+    width = sum(_NUMBER_WIDTHS.get(char, 556) for char in text) * size / 1000
+    return _text(round(x_right - width), y, text, bold, size)
+
+
+def _truncate(text, length):
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
+def _page_contents(data):
+    """One content stream per page."""
+    rows = data['items'] or [['(sin ítems)', None, '', '', '']]
+    chunks = [rows[:ROWS_FIRST_PAGE]]
+    for start in range(ROWS_FIRST_PAGE, len(rows), ROWS_PER_PAGE):
+        chunks.append(rows[start:start + ROWS_PER_PAGE])
+
+    pages = []
+    for number, chunk in enumerate(chunks, start=1):
+        out = []
+        y = PAGE_HEIGHT - MARGIN
+        if number == 1:
+            out.append(_text(MARGIN, y - 10, f"Factura {data['numero']}", bold=True, size=18))
+            y -= 45
+            for label, value in (('Paciente', f"{data['paciente']} ({data['documento']})"),
+                                 ('Fecha de emisión', data['fecha_emision']),
+                                 ('Fecha de vencimiento', data['fecha_vencimiento'] or 'N/A'),
+                                 ('Estado', data['estado'])):
+                out.append(_text(MARGIN, y, f'{label}:', bold=True))
+                out.append(_text(MARGIN + 130, y, value))
+                y -= LINE_HEIGHT
+            y -= LINE_HEIGHT
+        else:
+            out.append(_text(MARGIN, y - 10, f"Factura {data['numero']} (continuación)", bold=True, size=12))
+            y -= 35
+
+        for x, label, right in ((MARGIN, 'Descripción', False), (380, 'Cant.', True),
+                                (460, 'Precio Unit.', True), (PAGE_WIDTH - MARGIN, 'Subtotal', True)):
+            out.append(_text_right(x, y, label, bold=True) if right else _text(x, y, label, bold=True))
+        y -= 4
+        out.append(b'%d %d m %d %d l S\n' % (MARGIN, y, PAGE_WIDTH - MARGIN, y))
+        y -= LINE_HEIGHT
+        for descripcion, codigo, cantidad, precio, subtotal in chunk:
+            label = f'{descripcion} ({codigo})' if codigo else descripcion
+            out.append(_text(MARGIN, y, _truncate(label, 55)))
+            out.append(_text_right(380, y, str(cantidad)))
+            out.append(_text_right(460, y, precio))
+            out.append(_text_right(PAGE_WIDTH - MARGIN, y, subtotal))
+            y -= LINE_HEIGHT
+
+        if number == len(chunks):
+            out.append(b'%d %d m %d %d l S\n' % (MARGIN, y + 10, PAGE_WIDTH - MARGIN, y + 10))
+            y -= 6
+            out.append(_text(380, y, 'Total', bold=True, size=12))
+            out.append(_text_right(PAGE_WIDTH - MARGIN, y, data['total'], bold=True, size=12))
+        out.append(_text_right(PAGE_WIDTH - MARGIN, MARGIN - 20, f'{number}/{len(chunks)}', size=8))
+        pages.append(b''.join(out))
+    return pages
+
+
+def render_invoice_pdf(data):
+    """PDF bytes for an invoice_data() dict. Deterministic: the same data gives the same bytes."""
+    pages = _page_contents(data)
+    # Object numbers: 1 catalog, 2 page tree, 3-4 fonts, then (page, contents) pairs
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % (5 + 2 * i) for i in range(len(pages))), len(pages)),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    for i, content in enumerate(pages):
+        compressed = zlib.compress(content)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, 6 + 2 * i))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(compressed), compressed))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+# --- Disk cache ---
+
+def cache_path(cache_dir, factura_id, digest):
+    return os.path.join(cache_dir, str(factura_id // SHARD_SIZE), str(factura_id), f'{digest}.pdf')
+
+
+def _store(cache_dir, factura_id, digest, pdf):
+    """Writes atomically (readers never see a partial file) and drops older versions of the invoice."""
+    path = cache_path(cache_dir, factura_id, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf)
+    os.replace(tmp_path, path)
+    directory, name = os.path.split(path)
+    for stale in os.listdir(directory):
+        if stale != name and stale.endswith('.pdf'):
+            try:
+                os.remove(os.path.join(directory, stale))
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def get_invoice_pdf(factura_id, cache_dir):
+    """
+    (path, digest, data) of the invoice's PDF, rendering it only if the cached file
+    for the current content is missing. None if the invoice does not exist.
+    """
+    data = invoice_data(factura_id)
+    if data is None:
+        return None
+    digest = content_hash(data)
+    path = cache_path(cache_dir, factura_id, digest)
+    if not os.path.exists(path):
+        path = _store(cache_dir, factura_id, digest, render_invoice_pdf(data))
+    return path, digest, data
+
+
+def render_invoices_batch(factura_ids, cache_dir, workers=None, chunk_size=500, progress=None):
+    """
+    Brings the cache up to date for many invoices. Invoice data is read here in
+    chunks; missing PDFs are rendered by a pool of `workers` processes (default:
+    CPU count; 1 renders in this process), started on the first chunk with at
+    least MIN_POOL_BATCH renders. `progress(done, total)` is called after each
+    chunk. Returns {'generados': n, 'en_cache': n}. Requires an application context.
+    """
+    factura_ids = list(factura_ids)
+    workers = workers or os.cpu_count() or 1
+    counts = {'generados': 0, 'en_cache': 0}
+    pool = None
+    try:
+        for start in range(0, len(factura_ids), chunk_size):
+            pending = []
+            for factura_id, data in invoices_data(factura_ids[start:start + chunk_size]).items():
+                digest = content_hash(data)
+                if os.path.exists(cache_path(cache_dir, factura_id, digest)):
+                    counts['en_cache'] += 1
+                else:
+                    pending.append((factura_id, digest, data))
+            datas = [data for _, _, data in pending]
+            if pool is None and workers > 1 and len(datas) >= MIN_POOL_BATCH:
+                # spawn: the caller may be a threaded job worker, where forking is unsafe
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            if pool and len(datas) >= MIN_POOL_BATCH:
+                rendered = pool.map(render_invoice_pdf, datas, chunksize=max(len(datas) // (workers * 4), 1))
+            else:
+                rendered = map(render_invoice_pdf, datas)
+            for (factura_id, digest, _), pdf in zip(pending, rendered):
+                _store(cache_dir, factura_id, digest, pdf)
+                counts['generados'] += 1
+            if progress:
+                progress(min(start + chunk_size, len(factura_ids)), len(factura_ids))
+    finally:
+        if pool:
+            pool.shutdown()
+    return counts
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, Trabajo, Diagnostico, Paciente, Factura
+from patient_delete import purge_deleted_pacientes
+from invoice_pdf import render_invoices_batch
+from process_local_icd import parse_icd_json, extract_diagnostico_data, save_structured_data
+
+# Background jobs stored in the trabajo table. The web app only enqueues (in the
+# request's transaction); scriptss/job_worker.py claims due jobs with an atomic
+# UPDATE ... RETURNING and runs them on a bounded thread pool, each in its own app
+# context. Failed jobs are retried with exponential backoff up to max_intentos.
+# Handlers receive (params, progress); progress(percent, mensaje) commits the
+# session and is the job's heartbeat, so handlers call it between units of work
+# (at least every STALE_AFTER_SECONDS).
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_POLL_INTERVAL = 1.0  # seconds
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 30  # doubled after every failed attempt
+STALE_AFTER_SECONDS = 600  # running jobs without a heartbeat for this long are requeued (worker died)
+
+PENDIENTE, EN_CURSO, COMPLETADO, FALLIDO = 'pendiente', 'en_curso', 'completado', 'fallido'
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+ICD_SOURCE_FILE = os.path.join(PROJECT_ROOT, 'icd_data.json')
+ICD_STRUCTURED_FILE = os.path.join(PROJECT_ROOT, 'structured_icd_data.json')
+
+HANDLERS = {}  # tipo -> (function, description)
+
+
+def job_handler(tipo, descripcion):
+    """Registers a function(params, progress) as the handler for a job type."""
+    def decorator(func):
+        HANDLERS[tipo] = (func, descripcion)
+        return func
+    return decorator
+
+
+def enqueue(tipo, params=None, max_intentos=DEFAULT_MAX_ATTEMPTS, unique=False):
+    """
+    Adds a job in the caller's transaction (the caller commits). With unique=True
+    an already pending job of the same type is returned instead of a new one.
+    """
+    if tipo not in HANDLERS:
+        raise ValueError(f'Tipo de trabajo desconocido: {tipo}')
+    if unique:
+        existing = Trabajo.query.filter_by(tipo=tipo, estado=PENDIENTE).order_by(Trabajo.id).first()
+        if existing is not None:
+            return existing
+    trabajo = Trabajo(tipo=tipo, parametros=json.dumps(params or {}), max_intentos=max_intentos)
+    db.session.add(trabajo)
+    db.session.flush()
+    return trabajo
+
+
+def job_status(trabajo):
+    """JSON-ready view of a job for the status endpoint."""
+    def iso(value):
+        return value.isoformat() if value else None
+    return {
+        'id': trabajo.id, 'tipo': trabajo.tipo, 'estado': trabajo.estado,
+        'progreso': trabajo.progreso, 'mensaje': trabajo.mensaje,
+        'intentos': trabajo.intentos, 'max_intentos': trabajo.max_intentos,
+        'resultado': json.loads(trabajo.resultado) if trabajo.resultado else None,
+        'error': trabajo.error,  # last failed attempt, kept after a successful retry
+        'creado_en': iso(trabajo.creado_en), 'iniciado_en': iso(trabajo.iniciado_en),
+        'terminado_en': iso(trabajo.terminado_en),
+    }
+
+
+def claim_next(worker_id):
+    """
+    Marks the oldest due pending job as running for this worker and returns its id
+    (None if there is none). A single UPDATE, so two workers never claim the same job.
+    """
+    table = Trabajo.__table__
+    now = datetime.utcnow()
+    due = (select(table.c.id)
+           .where(table.c.estado == PENDIENTE, table.c.ejecutar_despues <= now)
+           .order_by(table.c.ejecutar_despues, table.c.id).limit(1).scalar_subquery())
+    job_id = db.session.execute(
+        update(table)
+        .where(table.c.id == due, table.c.estado == PENDIENTE)
+        .values(estado=EN_CURSO, worker=worker_id, intentos=table.c.intentos + 1,
+                iniciado_en=now, actualizado_en=now)
+        .returning(table.c.id)
+    ).scalar()
+    db.session.commit()
+    return job_id
+
+
+def requeue_stale(stale_after=STALE_AFTER_SECONDS):
+    """Puts running jobs whose worker stopped sending heartbeats back in the queue. Returns how many."""
+    table = Trabajo.__table__
+    count = db.session.execute(
+        update(table)
+        .where(table.c.estado == EN_CURSO,
+               table.c.actualizado_en < datetime.utcnow() - timedelta(seconds=stale_after))
+        .values(estado=PENDIENTE, worker=None, ejecutar_despues=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def execute_job(job_id):
+    """Runs a claimed job and records its result, or schedules a retry / marks it failed."""
+    trabajo = db.session.get(Trabajo, job_id)
+    handler = HANDLERS.get(trabajo.tipo)
+    if handler is None:
+        trabajo.estado, trabajo.terminado_en = FALLIDO, datetime.utcnow()
+        trabajo.error = f'Tipo de trabajo desconocido: {trabajo.tipo}'
+        db.session.commit()
+        return
+
+    def progress(percent, mensaje=None):
+        trabajo.progreso = max(0, min(100, int(percent)))
+        if mensaje is not None:
+            trabajo.mensaje = mensaje[:255]
+        trabajo.actualizado_en = datetime.utcnow()
+        db.session.commit()
+
+    started = time.perf_counter()
+    try:
+        result = handler[0](json.loads(trabajo.parametros or '{}'), progress)
+        trabajo.estado, trabajo.progreso = COMPLETADO, 100
+        trabajo.resultado = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+        trabajo.terminado_en = datetime.utcnow()
+        db.session.commit()
+        logger.info('job finished', extra={'job_id': job_id, 'tipo': trabajo.tipo,
+                                           'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('job failed', extra={'job_id': job_id, 'tipo': trabajo.tipo, 'intento': trabajo.intentos})
+        trabajo.error = f'{type(e).__name__}: {e}'[:2000]
+        if trabajo.intentos < trabajo.max_intentos:
+            trabajo.estado, trabajo.worker = PENDIENTE, None
+            trabajo.ejecutar_despues = datetime.utcnow() + timedelta(
+                seconds=RETRY_DELAY_SECONDS * 2 ** (trabajo.intentos - 1))
+        else:
+            trabajo.estado, trabajo.terminado_en = FALLIDO, datetime.utcnow()
+        db.session.commit()
+
+
+def _execute_in_context(app, job_id):
+    with app.app_context():
+        execute_job(job_id)
+
+
+def run_worker(app, concurrency=DEFAULT_CONCURRENCY, poll_interval=DEFAULT_POLL_INTERVAL, once=False,
+               stop_event=None):
+    """
+    Claims and runs jobs with at most `concurrency` running at a time. With
+    once=True, returns when no job is due and none is running. Returns the
+    number of jobs run.
+    """
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    running = set()
+    started = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='trabajo') as pool:
+        while not (stop_event and stop_event.is_set()):
+            running = {future for future in running if not future.done()}
+            job_id = None
+            if len(running) < concurrency:
+                with app.app_context():
+                    requeue_stale()
+                    job_id = claim_next(worker_id)
+            if job_id is not None:
+                running.add(pool.submit(_execute_in_context, app, job_id))
+                started += 1
+                continue
+            if once and not running:
+                break
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(poll_interval)
+    return started
+
+
+# --- Handlers ---
+
+@job_handler('purgar_pacientes', 'Purgar pacientes eliminados')
+def _purgar_pacientes(params, progress):
+    pendientes = Paciente.query.filter(Paciente.eliminado_en.is_not(None)).count()
+
+    def batch_done(purged):
+        progress(100 * purged / max(pendientes, 1), f'{purged} pacientes purgados')
+
+    return {'pacientes': purge_deleted_pacientes(progress=batch_done)}
+
+
+@job_handler('procesar_cie', 'Reprocesar el archivo CIE (icd_data.json)')
+def _procesar_cie(params, progress):
+    parsed = parse_icd_json(ICD_SOURCE_FILE)
+    if parsed is None:
+        raise ValueError(f'No se pudo leer {ICD_SOURCE_FILE}')
+    progress(80, f'{len(parsed)} capítulos procesados')
+    save_structured_data(parsed, ICD_STRUCTURED_FILE)
+    return {'capitulos': len(parsed), 'enfermedades': sum(len(ch.get('diseases', [])) for ch in parsed)}
+
+
+@job_handler('sincronizar_diagnosticos', 'Sincronizar el catálogo de diagnósticos con el archivo CIE')
+def _sincronizar_diagnosticos(params, progress, chunk_size=500):
+    parsed = parse_icd_json(ICD_SOURCE_FILE)
+    if parsed is None:
+        raise ValueError(f'No se pudo leer {ICD_SOURCE_FILE}')
+    entries = {}
+    for entry in extract_diagnostico_data(parsed):
+        if entry.get('codigo') and entry.get('descripcion'):
+            entries[entry['codigo']] = entry['descripcion']  # last one wins on duplicate codes
+    existing = dict(db.session.execute(select(Diagnostico.codigo, Diagnostico.descripcion)).all())
+
+    table = Diagnostico.__table__
+    codes = list(entries)
+    added = updated = 0
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start:start + chunk_size]
+        new_rows = [{'codigo': c, 'descripcion': entries[c]} for c in chunk if c not in existing]
+        changed = [{'b_codigo': c, 'b_descripcion': entries[c]} for c in chunk
+                   if c in existing and existing[c] != entries[c]]
+        if new_rows:
+            db.session.execute(insert(table), new_rows)
+        if changed:
+            db.session.execute(update(table).where(table.c.codigo == bindparam('b_codigo'))
+                               .values(descripcion=bindparam('b_descripcion')), changed)
+        added += len(new_rows)
+        updated += len(changed)
+        progress(100 * (start + len(chunk)) / len(codes), f'{added} agregados, {updated} actualizados')
+    return {'agregados': added, 'actualizados': updated, 'total': len(codes)}
+
+
+@job_handler('imprimir_facturas', 'Generar los PDF de las facturas del mes')
+def _imprimir_facturas(params, progress):
+    """params: periodo ('YYYY-MM', default the current month), estado (optional), procesos."""
+    periodo = params.get('periodo') or datetime.utcnow().strftime('%Y-%m')
+    inicio = datetime.strptime(periodo, '%Y-%m')
+    fin = (inicio + timedelta(days=32)).replace(day=1)
+    query = select(Factura.id).where(Factura.fecha_emision >= inicio, Factura.fecha_emision < fin)
+    if params.get('estado'):
+        query = query.where(Factura.estado == params['estado'])
+    factura_ids = db.session.execute(query.order_by(Factura.id)).scalars().all()
+
+    def chunk_done(done, total):
+        progress(100 * done / total, f'{done} de {total} facturas')
+
+    counts = render_invoices_batch(factura_ids, current_app.config['INVOICE_PDF_CACHE_DIR'],
+                                   workers=params.get('procesos'), progress=chunk_done)
+    return dict(counts, periodo=periodo)
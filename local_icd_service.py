@@ -1,46 +1,83 @@
 import json
+import logging
+import threading
 import time
 import os # Needed for checking file existence in main block
 
+logger = logging.getLogger(__name__)
+
 # Global variables for caching
 _icd_data_cache = None
+_icd_index = None  # lookups built together with the cached data (see _build_index)
 _cache_load_time = None
 CACHE_DURATION_SECONDS = 3600  # 1 hour
 
+_stats_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _count(result):
+    with _stats_lock:
+        _cache_stats[result] += 1
+
+
+def get_icd_cache_stats():
+    with _stats_lock:
+        return dict(_cache_stats)
+
+
+def _build_index(data):
+    """
+    Code lookup and lowercased search texts for the loaded data, so lookups and
+    searches do not walk the chapters (and lowercase every text) on each call.
+    """
+    by_code = {}
+    search = []
+    for chapter in data:
+        for disease in chapter.get("diseases", []):
+            by_code.setdefault(disease.get("code"), disease)  # first match wins, as in a linear scan
+            search.append(((disease.get("name") or "").lower(), (disease.get("description") or "").lower(), disease))
+    return {"by_code": by_code, "search": search}
+
+
 def load_icd_data(file_path="structured_icd_data.json"):
     """
     Loads ICD data from the specified JSON file, utilizing a time-based cache.
     If the cache is valid, returns cached data. Otherwise, loads from file,
     updates cache, and returns the data.
     """
-    global _icd_data_cache, _cache_load_time
+    global _icd_data_cache, _icd_index, _cache_load_time
 
     # Check cache validity
     if _icd_data_cache is not None and _cache_load_time is not None:
         if (time.time() - _cache_load_time) < CACHE_DURATION_SECONDS:
-            print("Loading ICD data from cache.")
+            _count("hits")
             return _icd_data_cache
 
     # Cache is invalid or not present, load from file
-    print(f"Loading ICD data from file: {file_path}")
+    _count("misses")
+    started = time.perf_counter()
     try:
         with open(file_path, 'r') as f:
             data = json.load(f)
+        _icd_index = _build_index(data)
         _icd_data_cache = data
         _cache_load_time = time.time()
+        logger.info("ICD data loaded", extra={"path": file_path, "chapters": len(data),
+                                              "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
         return data
     except FileNotFoundError:
-        print(f"Error: ICD data file not found at {file_path}.")
+        logger.error("ICD data file not found", extra={"path": file_path})
         _icd_data_cache = None # Invalidate cache on error
         _cache_load_time = None
         return None
     except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {file_path}.")
+        logger.error("Could not decode ICD data JSON", extra={"path": file_path})
         _icd_data_cache = None # Invalidate cache on error
         _cache_load_time = None
         return None
-    except Exception as e:
-        print(f"An unexpected error occurred while loading ICD data: {e}")
+    except Exception:
+        logger.exception("Unexpected error while loading ICD data", extra={"path": file_path})
         _icd_data_cache = None # Invalidate cache on error
         _cache_load_time = None
         return None
@@ -82,12 +119,7 @@ def get_disease_details(disease_code):
     if not data:
         return None
 
-    for chapter in data:
-        if "diseases" in chapter:
-            for disease in chapter["diseases"]:
-                if disease.get("code") == disease_code:
-                    return disease
-    return None
+    return _icd_index["by_code"].get(disease_code)
 
 def search_diseases(query_term):
     """
@@ -98,22 +130,9 @@ def search_diseases(query_term):
     if not data:
         return []
 
-    results = []
     query_lower = query_term.lower()
-
-    for chapter in data:
-        if "diseases" in chapter:
-            for disease in chapter["diseases"]:
-                name_match = False
-                desc_match = False
-                if disease.get("name") and query_lower in disease.get("name", "").lower():
-                    name_match = True
-                if disease.get("description") and query_lower in disease.get("description", "").lower():
-                    desc_match = True
-
-                if name_match or desc_match:
-                    results.append(disease)
-    return results
+    return [disease for name, description, disease in _icd_index["search"]
+            if (name and query_lower in name) or (description and query_lower in description)]
 
 if __name__ == "__main__":
     # This script relies on `structured_icd_data.json` which is generated by `process_local_icd.py`.
@@ -0,0 +1,212 @@
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+
+from local_icd_service import get_icd_cache_stats
+from sql_timing import add_statement_listener
+from response_cache import get_response_cache_stats
+from user_cache import get_user_cache_stats
+
+# Request instrumentation exposed in the Prometheus text format on /metrics:
+# per-endpoint latency histograms, SQL statement counts and time (sql_timing.py
+# cursor hooks), in-flight requests and cache hit/miss counters.
+# Values are per process; with several workers, scrape each one.
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SKIPPED_ENDPOINTS = ('metrics', 'static')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Thread-safe in-process counters and histograms keyed by label tuples."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}         # (endpoint, method, status) -> count
+        self.latency = {}          # endpoint -> Histogram
+        self.sql_per_request = {}  # endpoint -> Histogram
+        self.sql_statements = {}   # endpoint -> count
+        self.sql_seconds = {}      # endpoint -> seconds
+        self.in_flight = 0
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, endpoint, method, status, duration, sql_count, sql_seconds):
+        with self.lock:
+            self.in_flight -= 1
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.sql_per_request.setdefault(endpoint, Histogram(SQL_COUNT_BUCKETS)).observe(sql_count)
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + sql_count
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + sql_seconds
+
+    def sql_outside_request(self, duration):
+        # Statements run outside a request (CLI, warm-up) are booked on a pseudo-endpoint
+        endpoint = '<background>'
+        with self.lock:
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + 1
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + duration
+
+
+registry = MetricsRegistry()
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else f'{value:.1f}'
+    return str(value)
+
+
+def _histogram_lines(name, label_name, histograms):
+    lines = []
+    for label, histogram in sorted(histograms.items()):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{_labels(**{label_name: label, "le": _format_number(float(bound))})} {count}')
+        lines.append(f'{name}_bucket{_labels(**{label_name: label, "le": "+Inf"})} {histogram.total}')
+        lines.append(f'{name}_sum{_labels(**{label_name: label})} {_format_number(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(**{label_name: label})} {histogram.total}')
+    return lines
+
+
+def _metric(name, kind, help_text, samples):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'] + samples
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with registry.lock:
+        requests = dict(registry.requests)
+        latency = {k: _copy_histogram(v) for k, v in registry.latency.items()}
+        sql_per_request = {k: _copy_histogram(v) for k, v in registry.sql_per_request.items()}
+        sql_statements = dict(registry.sql_statements)
+        sql_seconds = dict(registry.sql_seconds)
+        in_flight = registry.in_flight
+
+    lines = []
+    lines += _metric('app_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status.',
+                     [f'app_http_requests_total{_labels(endpoint=e, method=m, status=s)} {n}'
+                      for (e, m, s), n in sorted(requests.items())])
+    lines += _metric('app_http_request_duration_seconds', 'histogram', 'Request latency by endpoint.',
+                     _histogram_lines('app_http_request_duration_seconds', 'endpoint', latency))
+    lines += _metric('app_http_requests_in_flight', 'gauge', 'Requests being processed.',
+                     [f'app_http_requests_in_flight {in_flight}'])
+    lines += _metric('app_sql_statements_per_request', 'histogram', 'SQL statements executed per request.',
+                     _histogram_lines('app_sql_statements_per_request', 'endpoint', sql_per_request))
+    lines += _metric('app_sql_statements_total', 'counter', 'SQL statements executed, by endpoint.',
+                     [f'app_sql_statements_total{_labels(endpoint=e)} {n}' for e, n in sorted(sql_statements.items())])
+    lines += _metric('app_sql_duration_seconds_total', 'counter', 'Time spent executing SQL, by endpoint.',
+                     [f'app_sql_duration_seconds_total{_labels(endpoint=e)} {_format_number(s)}'
+                      for e, s in sorted(sql_seconds.items())])
+
+    for cache, stats in (('icd', get_icd_cache_stats()), ('user', get_user_cache_stats()),
+                         ('response', get_response_cache_stats())):
+        name = f'app_{cache}_cache_requests_total'
+        lines += _metric(name, 'counter', f'{cache.capitalize()} cache lookups by result.',
+                         [f'{name}{_labels(result="hit")} {stats.get("hits", 0)}',
+                          f'{name}{_labels(result="miss")} {stats.get("misses", 0)}'])
+    return '\n'.join(lines) + '\n'
+
+
+def _copy_histogram(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.total = histogram.total
+    copy.sum = histogram.sum
+    return copy
+
+
+# --- SQL statements (every engine, timed by sql_timing.py) ---
+
+def _record_statement(conn, cursor, statement, parameters, executemany, duration):
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += duration
+    else:
+        registry.sql_outside_request(duration)
+
+
+add_statement_listener(_record_statement)
+
+
+# --- Flask hooks ---
+
+def _before_request():
+    if request.endpoint in SKIPPED_ENDPOINTS:
+        return
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_sql_seconds = 0.0
+    registry.request_started()
+
+
+def _after_request(response):
+    if 'metrics_start' in g:
+        g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    if 'metrics_start' not in g:
+        return
+    duration = time.perf_counter() - g.pop('metrics_start')
+    endpoint = request.endpoint or '<unmatched>'
+    status = g.get('metrics_status', 500)
+    registry.request_finished(endpoint, request.method, status, duration,
+                              g.metrics_sql_count, g.metrics_sql_seconds)
+    logger.debug('request finished', extra={
+        'endpoint': endpoint, 'method': request.method, 'status': status,
+        'duration_ms': round(duration * 1000, 2), 'sql_count': g.metrics_sql_count,
+        'sql_ms': round(g.metrics_sql_seconds * 1000, 2),
+    })
+
+
+def metrics_view():
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied, f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    """Registers the request hooks and the /metrics endpoint (protected by METRICS_TOKEN if set)."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -1,10 +1,28 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import exists
+from sqlalchemy.orm import aliased, declared_attr, deferred
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 
 db = SQLAlchemy()
 
+class VersionedMixin:
+    # Row version (bumped by the ORM on every UPDATE) and last-modification time.
+    # Used for ETag / Last-Modified in the JSON API and for incremental sync (updated_since).
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.version}
+
+    @declared_attr
+    def __table_args__(cls):
+        # Keyset pagination for sync walks (updated_at, id)
+        return (db.Index(f'ix_{cls.__tablename__}_updated_at_id', 'updated_at', 'id'),)
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
@@ -16,7 +34,7 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
-class Paciente(db.Model):
+class Paciente(VersionedMixin, db.Model):
     __tablename__ = 'paciente'
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(120), nullable=False)
@@ -25,11 +43,24 @@ class Paciente(db.Model):
     telefono = db.Column(db.String(20))
     direccion = db.Column(db.String(200))
     correo = db.Column(db.String(120))
+    # Soft delete: set when the patient is hidden pending purge (patient_delete.py)
+    eliminado_en = db.Column(db.DateTime, nullable=True)
 
     historias = db.relationship('HistoriaClinica', backref='paciente', lazy=True, cascade="all, delete-orphan")
     citas = db.relationship('Cita', backref='paciente_cita', lazy=True, cascade="all, delete-orphan")
     facturas = db.relationship('Factura', backref='paciente', lazy='dynamic', cascade="all, delete-orphan")
 
+    @classmethod
+    def visible(cls):
+        # Every patient lookup filters on this: soft-deleted patients only wait for the purge
+        return cls.eliminado_en.is_(None)
+
+    @classmethod
+    def visible_owner(cls, paciente_id):
+        # Same, for rows that belong to a patient (histories, appointments, invoices), given their paciente_id column
+        owner = aliased(cls)
+        return exists().where(owner.id == paciente_id, owner.eliminado_en.is_(None))
+
 # Association table for HistoriaClinica and Diagnostico
 historia_diagnostico_association = db.Table('historia_diagnostico_association',
     db.Column('historia_clinica_id', db.Integer, db.ForeignKey('historia_clinica.id'), primary_key=True),
@@ -42,12 +73,13 @@ historia_tratamiento_association = db.Table('historia_tratamiento_association',
     db.Column('tratamiento_id', db.Integer, db.ForeignKey('tratamiento.id'), primary_key=True)
 )
 
-class HistoriaClinica(db.Model):
+class HistoriaClinica(VersionedMixin, db.Model):
     __tablename__ = 'historia_clinica'
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     motivo = db.Column(db.String(255), nullable=False)
-    observaciones = db.Column(db.Text, nullable=True)
+    # Free text: not loaded by list queries; detail views load it with undefer_group('texto')
+    observaciones = deferred(db.Column(db.Text, nullable=True), group='texto')
 
     # Clave foránea que relaciona con el paciente
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
@@ -67,17 +99,66 @@ class HistoriaClinica(db.Model):
     )
 
 
-class Cita(db.Model):
+# Per-patient scans ordered by date (patient timeline)
+db.Index('ix_historia_clinica_paciente_fecha', HistoriaClinica.paciente_id, HistoriaClinica.fecha)
+
+
+class Recurso(db.Model):
+    __tablename__ = 'recurso'
+    # Agenda resource an appointment is booked against: a professional or a room
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(120), unique=True, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False, default='profesional')  # profesional | consultorio
+    activo = db.Column(db.Boolean, nullable=False, default=True, server_default='1')
+
+    def __repr__(self):
+        return f'<Recurso {self.nombre} ({self.tipo})>'
+
+
+def _backfill_cita_fecha_fin(conn, table):
+    # Used by schema_upgrade when fecha_fin is added to an existing database
+    rows = conn.execute(db.select(table.c.id, table.c.fecha_hora, table.c.duracion_minutos)
+                        .where(table.c.fecha_fin.is_(None))).all()
+    if rows:
+        conn.execute(table.update().where(table.c.id == db.bindparam('cita_id')).values(fecha_fin=db.bindparam('fin')),
+                     [{'cita_id': r.id, 'fin': r.fecha_hora + timedelta(minutes=r.duracion_minutos or DURACION_CITA_DEFECTO)}
+                      for r in rows])
+
+
+DURACION_CITA_DEFECTO = 30  # minutes
+
+
+class Cita(VersionedMixin, db.Model):
     __tablename__ = 'cita'
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
-    fecha_hora = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) 
+    fecha_hora = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True) 
     motivo = db.Column(db.String(255), nullable=False)
-    notas = db.Column(db.Text, nullable=True)
+    notas = deferred(db.Column(db.Text, nullable=True), group='texto')
+    duracion_minutos = db.Column(db.Integer, nullable=False, default=DURACION_CITA_DEFECTO,
+                                 server_default=str(DURACION_CITA_DEFECTO))
+    # Denormalized end time (fecha_hora + duracion_minutos) so overlap checks are pure range predicates
+    fecha_fin = db.Column(db.DateTime, nullable=True, info={'backfill': _backfill_cita_fecha_fin})
+    recurso_id = db.Column(db.Integer, db.ForeignKey('recurso.id'), nullable=True)
+
+    recurso = db.relationship('Recurso')
 
     # The backref on Paciente model will handle the other side.
 
 
+# Range scans per agenda resource and per patient (calendar views, overlap checks)
+db.Index('ix_cita_recurso_fecha_hora', Cita.recurso_id, Cita.fecha_hora)
+db.Index('ix_cita_paciente_fecha_hora', Cita.paciente_id, Cita.fecha_hora)
+
+
+@db.event.listens_for(Cita, 'before_insert')
+@db.event.listens_for(Cita, 'before_update')
+def _set_cita_fecha_fin(mapper, connection, target):
+    if target.duracion_minutos is None:
+        target.duracion_minutos = DURACION_CITA_DEFECTO
+    target.fecha_fin = target.fecha_hora + timedelta(minutes=target.duracion_minutos)
+
+
 class Diagnostico(db.Model):
     __tablename__ = 'diagnostico'
     id = db.Column(db.Integer, primary_key=True)
@@ -99,12 +180,12 @@ class Tratamiento(db.Model):
         return f'<Tratamiento {self.codigo} - {self.descripcion[:30]}>'
 
 
-class Factura(db.Model):
+class Factura(VersionedMixin, db.Model):
     __tablename__ = 'factura'
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
     numero_factura = db.Column(db.String(50), unique=True, nullable=False)
-    fecha_emision = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    fecha_emision = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     fecha_vencimiento = db.Column(db.Date, nullable=True)
     total = db.Column(db.Numeric(10, 2), nullable=False, default=0.0)
     estado = db.Column(db.String(20), nullable=False, default='Pendiente')  # E.g., Pendiente, Pagada, Anulada
@@ -116,6 +197,62 @@ class Factura(db.Model):
         return f'<Factura {self.numero_factura} - {self.estado}>'
 
 
+db.Index('ix_factura_paciente_fecha_emision', Factura.paciente_id, Factura.fecha_emision)
+
+
+class Trabajo(db.Model):
+    __tablename__ = 'trabajo'
+    # Background job (jobs.py): queued by the web app, run by scriptss/job_worker.py
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, en_curso, completado, fallido
+    parametros = db.Column(db.Text, nullable=True)  # JSON
+    resultado = db.Column(db.Text, nullable=True)  # JSON
+    error = db.Column(db.Text, nullable=True)
+    progreso = db.Column(db.Integer, nullable=False, default=0)  # percent
+    mensaje = db.Column(db.String(255), nullable=True)
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    max_intentos = db.Column(db.Integer, nullable=False, default=3)
+    worker = db.Column(db.String(100), nullable=True)
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ejecutar_despues = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # retry backoff
+    iniciado_en = db.Column(db.DateTime, nullable=True)
+    actualizado_en = db.Column(db.DateTime, nullable=True)  # heartbeat while running
+    terminado_en = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Trabajo {self.id} {self.tipo} - {self.estado}>'
+
+
+# The worker claims the oldest due pending job
+db.Index('ix_trabajo_estado_ejecutar_despues', Trabajo.estado, Trabajo.ejecutar_despues)
+
+
+class Eliminacion(db.Model):
+    __tablename__ = 'eliminacion'
+    # Tombstone of a deleted row (tombstones.py), so API sync (updated_since) can report deletions
+    id = db.Column(db.Integer, primary_key=True)
+    recurso = db.Column(db.String(20), nullable=False)  # pacientes, historias, citas, facturas or items
+    recurso_id = db.Column(db.Integer, nullable=False)
+    eliminado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Eliminacion {self.recurso} {self.recurso_id}>'
+
+
+db.Index('ix_eliminacion_recurso_eliminado_en', Eliminacion.recurso, Eliminacion.eliminado_en)
+
+
+class SecuenciaFactura(db.Model):
+    __tablename__ = 'secuencia_factura'
+    # One row per year; ultimo_numero is incremented atomically to allocate invoice numbers
+    anio = db.Column(db.Integer, primary_key=True)
+    ultimo_numero = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SecuenciaFactura {self.anio} - {self.ultimo_numero}>'
+
+
 class ItemFactura(db.Model):
     __tablename__ = 'item_factura'
     id = db.Column(db.Integer, primary_key=True)
@@ -134,4 +271,33 @@ class ItemFactura(db.Model):
 
     def calculate_subtotal(self):
         self.subtotal = self.cantidad * self.precio_unitario
-        return self.subtotal
\ No newline at end of file
+        return self.subtotal
+
+# --- Billing summary tables ---
+# Pre-aggregated revenue, maintained incrementally by billing_summary.py in the same
+# transactions that add/remove invoice items or change an invoice's estado.
+# periodo is the 'YYYY-MM' of factura.fecha_emision.
+
+class ResumenFacturacionMensual(db.Model):
+    __tablename__ = 'resumen_facturacion_mensual'
+    periodo = db.Column(db.String(7), primary_key=True)
+    estado = db.Column(db.String(20), primary_key=True)
+    num_items = db.Column(db.Integer, nullable=False, default=0)
+    importe = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+class ResumenFacturacionTratamiento(db.Model):
+    __tablename__ = 'resumen_facturacion_tratamiento'
+    periodo = db.Column(db.String(7), primary_key=True)
+    estado = db.Column(db.String(20), primary_key=True)
+    tratamiento_id = db.Column(db.Integer, primary_key=True)  # 0 = items without tratamiento
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    importe = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+class ResumenFacturacionPaciente(db.Model):
+    __tablename__ = 'resumen_facturacion_paciente'
+    paciente_id = db.Column(db.Integer, primary_key=True)
+    estado = db.Column(db.String(20), primary_key=True)
+    num_items = db.Column(db.Integer, nullable=False, default=0)
+    importe = db.Column(db.Numeric(14, 2), nullable=False, default=0)
@@ -0,0 +1,104 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+
+from models import (db, Paciente, HistoriaClinica, Cita, Factura, ItemFactura,
+                    historia_diagnostico_association, historia_tratamiento_association)
+from billing_summary import remove_pacientes_billing
+from tombstones import record_deleted_select, prune_tombstones
+
+# Set-based patient deletion. Instead of letting the ORM cascade load every history,
+# appointment, invoice and item of the patient and delete them row by row, each
+# table is emptied with one DELETE ... WHERE ... IN (...) in dependency order
+# (association rows and items first, the patient last). Billing summaries are
+# adjusted first and deletion tombstones are recorded for API sync (tombstones.py);
+# the full-text index follows through its delete trigger.
+# Deferred mode: the patient is only marked (eliminado_en) and hidden; the
+# 'purgar_pacientes' background job (jobs.py), or scriptss/purgar_pacientes.py, deletes it later.
+
+DELETE_BATCH_SIZE = 500  # patients per batch (keeps IN lists under SQLite's parameter limit)
+
+DELETE_MODES = ('immediate', 'deferred')
+
+
+def _delete_statements(paciente_ids):
+    historias = select(HistoriaClinica.id).where(HistoriaClinica.paciente_id.in_(paciente_ids))
+    facturas = select(Factura.id).where(Factura.paciente_id.in_(paciente_ids))
+    return (
+        delete(historia_diagnostico_association)
+        .where(historia_diagnostico_association.c.historia_clinica_id.in_(historias)),
+        delete(historia_tratamiento_association)
+        .where(historia_tratamiento_association.c.historia_clinica_id.in_(historias)),
+        delete(ItemFactura.__table__).where(ItemFactura.factura_id.in_(facturas)),
+        delete(Factura.__table__).where(Factura.paciente_id.in_(paciente_ids)),
+        delete(HistoriaClinica.__table__).where(HistoriaClinica.paciente_id.in_(paciente_ids)),
+        delete(Cita.__table__).where(Cita.paciente_id.in_(paciente_ids)),
+        delete(Paciente.__table__).where(Paciente.id.in_(paciente_ids)),
+    )
+
+
+def _record_tombstones(paciente_ids):
+    facturas = select(Factura.id).where(Factura.paciente_id.in_(paciente_ids))
+    record_deleted_select('items', select(ItemFactura.id).where(ItemFactura.factura_id.in_(facturas)))
+    record_deleted_select('facturas', facturas)
+    record_deleted_select('historias', select(HistoriaClinica.id).where(HistoriaClinica.paciente_id.in_(paciente_ids)))
+    record_deleted_select('citas', select(Cita.id).where(Cita.paciente_id.in_(paciente_ids)))
+    record_deleted_select('pacientes', select(Paciente.id).where(Paciente.id.in_(paciente_ids)))
+
+
+def delete_pacientes(paciente_ids):
+    """
+    Deletes the patients and all their rows, in batches of DELETE_BATCH_SIZE.
+    Runs in the caller's transaction (nothing is committed). Returns the number of
+    deleted rows per table.
+    """
+    ids = list(dict.fromkeys(paciente_ids))
+    counts = defaultdict(int)
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[start:start + DELETE_BATCH_SIZE]
+        remove_pacientes_billing(batch)
+        _record_tombstones(batch)
+        for stmt in _delete_statements(batch):
+            counts[stmt.table.name] += db.session.execute(stmt).rowcount
+    return dict(counts)
+
+
+def mark_pacientes_deleted(paciente_ids):
+    """
+    Soft delete: sets eliminado_en (and bumps version/updated_at so API sync
+    clients see the change). Patient lists hide them from then on. Runs in the
+    caller's transaction. Returns the number of patients marked.
+    """
+    table = Paciente.__table__
+    return db.session.execute(
+        update(table)
+        .where(table.c.id.in_(list(paciente_ids)), table.c.eliminado_en.is_(None))
+        .values(eliminado_en=datetime.utcnow(), updated_at=datetime.utcnow(), version=table.c.version + 1)
+    ).rowcount
+
+
+def purge_deleted_pacientes(batch_size=DELETE_BATCH_SIZE, limit=None, progress=None):
+    """
+    Deletes soft-deleted patients, committing after every batch so the database
+    writer is released between batches; `progress(purged)` is called after each one.
+    Also drops expired deletion tombstones (TOMBSTONE_RETENTION_DAYS).
+    Returns the number of patients purged. Requires an application context.
+    """
+    purged = 0
+    while limit is None or purged < limit:
+        size = batch_size if limit is None else min(batch_size, limit - purged)
+        ids = db.session.execute(
+            select(Paciente.id).where(Paciente.eliminado_en.is_not(None)).order_by(Paciente.id).limit(size)
+        ).scalars().all()
+        if not ids:
+            break
+        delete_pacientes(ids)
+        db.session.commit()
+        purged += len(ids)
+        if progress:
+            progress(purged)
+    prune_tombstones()
+    db.session.commit()
+    return purged
+
@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from sqlalchemy import insert
+
+from models import db, Paciente
+
+# Streaming bulk import of Paciente records from CSV or NDJSON.
+# The file is read row by row and processed in chunks: each chunk is validated,
+# checked for existing documentos with one IN query, bulk-inserted and committed,
+# so memory is bounded by the chunk size rather than the file size.
+
+DEFAULT_CHUNK_SIZE = 1000
+PATIENT_FIELDS = ('nombre', 'edad', 'documento', 'telefono', 'direccion', 'correo')
+_MAX_LENGTHS = {'nombre': 120, 'documento': 50, 'telefono': 20, 'direccion': 200, 'correo': 120}
+
+
+class ImportReport:
+    """Counters for an import plus the first `max_rejections_kept` rejected rows."""
+
+    def __init__(self, max_rejections_kept=1000):
+        self.total_rows = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.rejections = []  # (line, documento, reason)
+        self.max_rejections_kept = max_rejections_kept
+
+    def reject(self, line, documento, reason, rejections_writer=None):
+        self.rejected += 1
+        if rejections_writer is not None:
+            rejections_writer.writerow([line, documento or '', reason])
+        if len(self.rejections) < self.max_rejections_kept:
+            self.rejections.append((line, documento, reason))
+
+    def as_dict(self):
+        return {
+            'total_rows': self.total_rows,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'rejections': [{'linea': line, 'documento': documento, 'motivo': reason}
+                           for line, documento, reason in self.rejections],
+        }
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_rows(text_stream, fmt):
+    """
+    Yields (line_number, row) from a text stream. row is a dict, or None for a
+    line that could not be parsed (reported as a rejection by the caller).
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Formato no soportado: {fmt!r} (use 'csv' o 'ndjson')")
+
+
+def validate_row(row):
+    """Returns (clean_row, None) or (None, reason)."""
+    clean = {}
+    for field in PATIENT_FIELDS:
+        value = row.get(field)
+        value = str(value).strip() if value is not None else ''
+        clean[field] = value or None
+
+    if not clean['nombre']:
+        return None, 'nombre es obligatorio'
+    if not clean['documento']:
+        return None, 'documento es obligatorio'
+    try:
+        clean['edad'] = int(clean['edad'])
+    except (TypeError, ValueError):
+        return None, 'edad debe ser un número entero'
+    if not 0 <= clean['edad'] <= 150:
+        return None, 'edad fuera de rango'
+    for field, max_length in _MAX_LENGTHS.items():
+        if clean[field] and len(clean[field]) > max_length:
+            return None, f'{field} supera {max_length} caracteres'
+    return clean, None
+
+
+def _import_chunk(chunk, report, rejections_writer):
+    valid = []
+    seen = set()
+    for line, row in chunk:
+        if row is None:
+            report.reject(line, None, 'fila con formato inválido', rejections_writer)
+            continue
+        clean, reason = validate_row(row)
+        if reason:
+            report.reject(line, row.get('documento'), reason, rejections_writer)
+        elif clean['documento'] in seen:
+            report.reject(line, clean['documento'], 'documento repetido en el archivo', rejections_writer)
+        else:
+            seen.add(clean['documento'])
+            valid.append((line, clean))
+
+    if not valid:
+        return
+
+    # One set-based lookup per chunk instead of one query per patient
+    existing = dict(db.session.query(Paciente.documento, Paciente.eliminado_en)
+                    .filter(Paciente.documento.in_([clean['documento'] for _, clean in valid])))
+
+    rows = []
+    for line, clean in valid:
+        if clean['documento'] not in existing:
+            rows.append(clean)
+        elif existing[clean['documento']] is not None:  # soft-deleted: the documento is taken until the purge
+            report.reject(line, clean['documento'], 'el documento pertenece a un paciente eliminado pendiente de purga',
+                          rejections_writer)
+        else:
+            report.reject(line, clean['documento'], 'ya existe un paciente con ese documento', rejections_writer)
+
+    if rows:
+        db.session.execute(insert(Paciente), rows)
+        db.session.commit()
+        report.inserted += len(rows)
+
+
+def import_patients(text_stream, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE, rejections_stream=None,
+                    max_rejections_kept=1000):
+    """
+    Imports patients from a CSV (header row with PATIENT_FIELDS) or NDJSON text
+    stream. Each chunk is committed on its own, so a failure keeps the chunks
+    already imported. If rejections_stream is given, every rejected row is
+    written to it as CSV (linea, documento, motivo). Requires an app context.
+    """
+    report = ImportReport(max_rejections_kept=max_rejections_kept)
+    rejections_writer = None
+    if rejections_stream is not None:
+        rejections_writer = csv.writer(rejections_stream)
+        rejections_writer.writerow(['linea', 'documento', 'motivo'])
+
+    rows = iter_rows(text_stream, fmt)
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            report.total_rows += len(chunk)
+            _import_chunk(chunk, report, rejections_writer)
+    except Exception:
+        db.session.rollback()
+        raise
+    return report
+
+
+def open_text_stream(binary_stream, encoding='utf-8-sig'):
+    """Wraps an uploaded (binary) file for streaming text reading; utf-8-sig strips Excel's BOM."""
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
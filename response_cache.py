@@ -0,0 +1,274 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request, session, Response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Response cache for read-heavy pages.
+#
+# Every cached view declares the tables it reads. Each table has a generation
+# counter that is bumped after a commit that wrote to it, and the current
+# generations are part of the cache key, so a write makes older entries
+# unreachable without having to enumerate them (they age out by LRU/TTL).
+
+DEFAULT_TTL_SECONDS = 300
+_PENDING_KEY = "response_cache_pending_tables"
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU store. Generations are also process-local, so with several
+    workers a write only invalidates the worker that performed it (others
+    converge within the TTL). Use SQLiteCacheBackend to share across workers.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, mimetype, body)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key, mimetype, body, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, mimetype, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_generations(self, tables):
+        with self._lock:
+            return tuple(self._generations.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    Store shared by all worker processes on the same host, kept in a local
+    SQLite file (independent of the application database). Generations live in
+    the same file, so a commit in any worker invalidates every worker.
+    """
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, "
+                     "mimetype TEXT NOT NULL, body BLOB NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_generation (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_expires_at ON cache_entry (expires_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # Losing cache entries on a crash is harmless
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT mimetype, body FROM cache_entry WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def set(self, key, mimetype, body, ttl):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO cache_entry (key, expires_at, mimetype, body) VALUES (?, ?, ?, ?)",
+                     (key, time.time() + ttl, mimetype, body))
+        self._sets += 1
+        if self._sets % 100 == 0:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        conn.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (time.time(),))
+        conn.execute("DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_entry "
+                     "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def get_generations(self, tables):
+        if not tables:
+            return ()
+        placeholders = ",".join("?" for _ in tables)
+        rows = dict(self._connection().execute(
+            f"SELECT name, value FROM cache_generation WHERE name IN ({placeholders})", tuple(tables)
+        ).fetchall())
+        return tuple(rows.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        conn = self._connection()
+        conn.executemany("INSERT INTO cache_generation (name, value) VALUES (?, 1) "
+                         "ON CONFLICT(name) DO UPDATE SET value = value + 1", [(table,) for table in tables])
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entry")
+        conn.execute("DELETE FROM cache_generation")
+
+
+def create_backend(app):
+    """
+    Builds the backend selected by RESPONSE_CACHE_BACKEND (config or env):
+    'memory' (default), 'sqlite' (shared file at RESPONSE_CACHE_PATH) or 'none'.
+    """
+    def setting(name, default):
+        return app.config.get(name) or os.environ.get(name) or default
+
+    kind = setting("RESPONSE_CACHE_BACKEND", "memory").lower()
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        path = setting("RESPONSE_CACHE_PATH", os.path.join(app.instance_path, "response_cache.db"))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteCacheBackend(path, max_entries=int(setting("RESPONSE_CACHE_MAX_ENTRIES", 5000)))
+    if kind == "memory":
+        return MemoryCacheBackend(max_entries=int(setting("RESPONSE_CACHE_MAX_ENTRIES", 512)))
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {kind!r}")
+
+
+def init_response_cache(app):
+    app.extensions["response_cache"] = {
+        "backend": create_backend(app),
+        "stats": {"hits": 0, "misses": 0},
+    }
+
+
+def _state():
+    return current_app.extensions.get("response_cache")
+
+
+def get_response_cache_stats():
+    state = _state()
+    return dict(state["stats"]) if state else {"hits": 0, "misses": 0}
+
+
+def _cache_key(tables, generations):
+    # Pages embed the logged-in username in the navbar; there are no roles,
+    # so the user id is the finest key that is still safe to share.
+    user_key = current_user.get_id() if current_user.is_authenticated else "anon"
+    view_args = sorted((request.view_args or {}).items())
+    query_args = sorted(request.args.items(multi=True))
+    return f"{request.endpoint}|{view_args}|{query_args}|{user_key}|{tables}|{generations}"
+
+
+def cached_response(*tables, ttl=DEFAULT_TTL_SECONDS):
+    """
+    Caches the full response of a GET view, keyed by endpoint, view arguments,
+    query string, user and the generations of `tables` (the tables the page
+    reads). Requests with pending flash messages bypass the cache, and responses
+    that flashed or were not 200 are not stored.
+    """
+    tables = tuple(sorted(tables))
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            state = _state()
+            if not state or state["backend"] is None or request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            backend = state["backend"]
+            key = _cache_key(tables, backend.get_generations(tables))
+            cached = backend.get(key)
+            if cached is not None:
+                state["stats"]["hits"] += 1
+                response = Response(cached[1], mimetype=cached[0])
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            state["stats"]["misses"] += 1
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough and not session.modified:
+                if response.is_streamed:
+                    response.response = _store_when_complete(response.response, backend, key, response.mimetype, ttl)
+                else:
+                    backend.set(key, response.mimetype, response.get_data(), ttl)
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+def _store_when_complete(chunks, backend, key, mimetype, ttl):
+    """Passes a streamed body through and caches it once fully sent (not when the client disconnects)."""
+    body = []
+    try:
+        for chunk in chunks:
+            body.append(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    backend.set(key, mimetype, b"".join(body), ttl)
+
+
+def invalidate_tables(*tables):
+    state = _state()
+    if state and state["backend"] is not None and tables:
+        state["backend"].bump(tuple(tables))
+
+
+# --- Generation bumping from SQLAlchemy session events ---
+
+def _pending(session):
+    return session.info.setdefault(_PENDING_KEY, set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            pending.add(table.name)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_statement_tables(orm_execute_state):
+    # Bulk insert/update/delete statements bypass the unit of work
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and getattr(table, "name", None):
+            _pending(orm_execute_state.session).add(table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session):
+    tables = session.info.pop(_PENDING_KEY, None)
+    if tables:
+        try:
+            invalidate_tables(*sorted(tables))
+        except RuntimeError:
+            pass  # No application context (e.g. a script using its own session): nothing to invalidate
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_tables(session):
+    session.info.pop(_PENDING_KEY, None)
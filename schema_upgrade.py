@@ -0,0 +1,85 @@
+from sqlalchemy import inspect, text
+
+from models import db, ResumenFacturacionMensual, ResumenFacturacionTratamiento, ResumenFacturacionPaciente
+from history_search import ensure_search_index
+from billing_summary import rebuild_billing_summaries
+
+SUMMARY_TABLES = {model.__tablename__ for model in
+                  (ResumenFacturacionMensual, ResumenFacturacionTratamiento, ResumenFacturacionPaciente)}
+
+
+def _backfill_value(column):
+    """Scalar or zero-argument Python default of a column, or None."""
+    default = column.default
+    if default is None:
+        return None
+    if default.is_scalar:
+        return default.arg
+    if default.is_callable:
+        return default.arg(None)  # SQLAlchemy wraps zero-argument callables to accept a context
+    return None
+
+
+def upgrade_schema():
+    """
+    Brings an existing database up to the current models without a migration tool:
+    creates missing tables (db.create_all), then adds columns and indexes that were
+    introduced after the database was created. Added columns without a server
+    default are created nullable and backfilled from their Python default, or by
+    the callable in column.info['backfill'] (called with the connection and table).
+    Also creates the clinical history full-text index if it is missing, and fills
+    the billing summary tables from the existing invoices when it creates them.
+    Safe to run repeatedly. Requires an application context.
+    Returns a list of the changes made.
+    """
+    engine = db.engine
+    tables_before = set(inspect(engine).get_table_names())
+    db.create_all()
+    inspector = inspect(engine)
+    changes = []
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            backfills = []
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                if column.server_default is not None:
+                    arg = column.server_default.arg
+                    default_sql = "'" + arg.replace("'", "''") + "'" if isinstance(arg, str) else str(arg)
+                    ddl += f' DEFAULT {default_sql}'
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                conn.execute(text(ddl))
+
+                value = _backfill_value(column)
+                if column.server_default is None and value is not None:
+                    conn.execute(table.update().values({column.name: value}))
+                if 'backfill' in column.info:
+                    backfills.append(column.info['backfill'])
+                changes.append(f'{table.name}.{column.name}')
+
+            # Column-specific backfills (column.info['backfill']) run once all new columns exist
+            for backfill in backfills:
+                backfill(conn, table)
+
+            existing_indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    changes.append(f'index {index.name}')
+
+        if ensure_search_index(conn):
+            changes.append('full-text index historia_clinica')
+
+    # New summary tables start empty: without the rebuild, reports would miss earlier
+    # invoices and later deletions would leave negative rows
+    if tables_before and SUMMARY_TABLES - tables_before:
+        rebuild_billing_summaries()
+        db.session.commit()
+        changes.append('billing summaries rebuilt')
+
+    return changes
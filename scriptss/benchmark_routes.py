@@ -0,0 +1,86 @@
+import argparse
+import json
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app, db
+from schema_upgrade import upgrade_schema
+from seed_data import seed_dataset
+from billing_summary import rebuild_billing_summaries
+from benchmark import (ROUTES, DEFAULT_REQUESTS, DEFAULT_WARMUP, run_benchmark, check_budgets,
+                       budgets_from_results, dataset_size, load_budgets, save_budgets)
+
+DEFAULT_BUDGETS = os.path.join(project_root, "benchmark_budgets.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mide latencia (p50/p95/p99), rendimiento y consultas SQL de las rutas principales "
+                    "y los compara con los presupuestos guardados.")
+    parser.add_argument("--rutas", nargs="+", choices=list(ROUTES), help="Rutas a medir (por defecto todas)")
+    parser.add_argument("--solicitudes", type=int, default=DEFAULT_REQUESTS, help="Solicitudes medidas por ruta")
+    parser.add_argument("--concurrencia", type=int, default=1, help="Hilos que envían solicitudes en paralelo")
+    parser.add_argument("--calentamiento", type=int, default=DEFAULT_WARMUP,
+                        help="Solicitudes previas no medidas por ruta")
+    parser.add_argument("--sembrar", type=int, metavar="PACIENTES",
+                        help="Si la base de datos no tiene pacientes, genera este número de pacientes sintéticos")
+    parser.add_argument("--presupuestos", default=DEFAULT_BUDGETS, help="Archivo JSON de presupuestos")
+    parser.add_argument("--guardar-presupuestos", action="store_true",
+                        help="Guarda los resultados de esta ejecución como nuevos presupuestos (con margen de 1.5x)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+    if args.solicitudes <= 0 or args.concurrencia <= 0 or args.calentamiento < 0:
+        parser.error("--solicitudes y --concurrencia deben ser positivos y --calentamiento no negativo")
+
+    with app.app_context():
+        upgrade_schema()
+        if args.sembrar and not dataset_size():
+            print(f"Generando {args.sembrar} pacientes sintéticos...", file=sys.stderr)
+            seed_dataset(args.sembrar)
+            rebuild_billing_summaries()
+            db.session.commit()
+        pacientes = dataset_size()
+
+    results = run_benchmark(app, routes=args.rutas, requests=args.solicitudes,
+                            concurrency=args.concurrencia, warmup=args.calentamiento)
+
+    if args.guardar_presupuestos:
+        save_budgets(args.presupuestos, budgets_from_results(results, pacientes))
+        print(f"Presupuestos guardados en {args.presupuestos}.", file=sys.stderr)
+        violations = []
+    elif os.path.exists(args.presupuestos):
+        budgets = load_budgets(args.presupuestos)
+        if budgets.get("dataset_pacientes") not in (None, pacientes):
+            print(f"Aviso: los presupuestos se midieron con {budgets['dataset_pacientes']} pacientes "
+                  f"y la base de datos tiene {pacientes}.", file=sys.stderr)
+        violations = check_budgets(results, budgets)
+    else:
+        print(f"No se encontró {args.presupuestos}; no se comparan presupuestos.", file=sys.stderr)
+        violations = check_budgets(results, {})
+
+    if args.json:
+        json.dump({"pacientes": pacientes, "resultados": results, "violaciones": violations},
+                  sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(f"Pacientes en la base de datos: {pacientes}")
+        print(f"{'ruta':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'SQL prom':>9} {'SQL máx':>8} {'errores':>8}")
+        for name, result in results.items():
+            if "skipped" in result:
+                print(f"{name:<18} omitida ({result['skipped']})")
+                continue
+            print(f"{name:<18} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                  f"{result['throughput_rps']:>8.1f} {result['sql_avg']:>9.1f} {result['sql_max']:>8} "
+                  f"{result['errors']:>8}")
+        for violation in violations:
+            print(f"PRESUPUESTO EXCEDIDO: {violation}")
+
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+import static_assets
+from static_assets import build_assets, prune_assets, DIST_SUBDIR
+
+DEFAULT_STATIC_DIR = os.path.join(project_root, "static")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Genera en static/dist/ los archivos estáticos con hash de contenido en el nombre, "
+                    "sus variantes comprimidas (gzip/brotli) y copias WebP de las imágenes PNG.")
+    parser.add_argument("--static", default=DEFAULT_STATIC_DIR, help="Carpeta de archivos estáticos")
+    parser.add_argument("--sin-webp", action="store_true", help="No genera copias WebP de las imágenes PNG")
+    parser.add_argument("--limpiar", action="store_true",
+                        help="Elimina los archivos de compilaciones anteriores que ya no se usan")
+    args = parser.parse_args()
+
+    if static_assets.brotli is None:
+        print("Aviso: el paquete 'brotli' no está instalado; solo se generan variantes gzip.", file=sys.stderr)
+    if static_assets.Image is None and not args.sin_webp:
+        print("Aviso: el paquete 'Pillow' no está instalado; no se generan copias WebP.", file=sys.stderr)
+
+    manifest = build_assets(args.static, webp=not args.sin_webp)
+    print(f"Archivos: {len(manifest['assets'])}, WebP: {len(manifest['webp'])}, "
+          f"con variantes comprimidas: {len(manifest['encodings'])} -> {os.path.join(args.static, DIST_SUBDIR)}")
+    if args.limpiar:
+        print(f"Archivos antiguos eliminados: {prune_assets(args.static, manifest)}")
+    print("Reinicie la aplicación para que use el nuevo manifiesto.")
+
+
+if __name__ == "__main__":
+    main()
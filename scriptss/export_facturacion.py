@@ -0,0 +1,40 @@
+import argparse
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app
+from billing_export import iter_export_rows, parse_date, FORMATTERS, ESTADOS_FACTURA
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta las líneas de facturación (CSV o NDJSON).")
+    parser.add_argument("--desde", help="Fecha de emisión inicial, YYYY-MM-DD (inclusive)")
+    parser.add_argument("--hasta", help="Fecha de emisión final, YYYY-MM-DD (inclusive)")
+    parser.add_argument("--estado", choices=ESTADOS_FACTURA)
+    parser.add_argument("--formato", choices=sorted(FORMATTERS), default="csv")
+    parser.add_argument("--salida", help="Archivo de salida (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    try:
+        desde = parse_date(args.desde, "desde")
+        hasta = parse_date(args.hasta, "hasta")
+    except ValueError as e:
+        parser.error(str(e))
+
+    formatter, _mimetype = FORMATTERS[args.formato]
+    out = open(args.salida, "w", newline="", encoding="utf-8") if args.salida else sys.stdout
+    try:
+        with app.app_context():
+            for chunk in formatter(iter_export_rows(desde=desde, hasta=hasta, estado=args.estado)):
+                out.write(chunk)
+    finally:
+        if args.salida:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
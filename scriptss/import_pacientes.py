@@ -0,0 +1,41 @@
+import argparse
+import sys
+import os
+import time
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app
+from patient_import import import_patients, detect_format, DEFAULT_CHUNK_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa pacientes desde un archivo CSV o NDJSON.")
+    parser.add_argument("archivo", help="Ruta del archivo a importar")
+    parser.add_argument("--formato", choices=["csv", "ndjson"], help="Por defecto se detecta por la extensión")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_SIZE, help="Filas por lote (una transacción por lote)")
+    parser.add_argument("--rechazos", help="Archivo CSV donde escribir las filas rechazadas")
+    args = parser.parse_args()
+
+    fmt = args.formato or detect_format(args.archivo)
+    started = time.perf_counter()
+    rejections_stream = open(args.rechazos, "w", newline="", encoding="utf-8") if args.rechazos else None
+    try:
+        with open(args.archivo, "r", newline="", encoding="utf-8-sig") as f, app.app_context():
+            report = import_patients(f, fmt=fmt, chunk_size=args.chunk, rejections_stream=rejections_stream,
+                                     max_rejections_kept=0)
+    finally:
+        if rejections_stream:
+            rejections_stream.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Filas leídas: {report.total_rows}, creados: {report.inserted}, rechazados: {report.rejected} "
+          f"({elapsed:.1f} s)")
+    if report.rejected and args.rechazos:
+        print(f"Detalle de rechazos en {args.rechazos}")
+
+
+if __name__ == "__main__":
+    main()
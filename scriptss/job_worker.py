@@ -0,0 +1,43 @@
+import argparse
+import signal
+import sys
+import os
+import threading
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app
+from schema_upgrade import upgrade_schema
+from jobs import run_worker, DEFAULT_CONCURRENCY, DEFAULT_POLL_INTERVAL
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ejecuta los trabajos en segundo plano encolados por la aplicación.")
+    parser.add_argument("--concurrencia", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Trabajos ejecutados a la vez (hilos)")
+    parser.add_argument("--intervalo", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Segundos entre consultas a la cola cuando está vacía")
+    parser.add_argument("--una-vez", action="store_true",
+                        help="Ejecuta los trabajos pendientes y termina cuando la cola queda vacía")
+    args = parser.parse_args()
+    if args.concurrencia <= 0 or args.intervalo <= 0:
+        parser.error("--concurrencia e --intervalo deben ser positivos")
+
+    with app.app_context():
+        upgrade_schema()
+
+    # SIGTERM / Ctrl+C: stop claiming jobs and wait for the running ones
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    print(f"Worker iniciado (concurrencia {args.concurrencia}).", file=sys.stderr)
+    ejecutados = run_worker(app, concurrency=args.concurrencia, poll_interval=args.intervalo,
+                            once=args.una_vez, stop_event=stop)
+    print(f"Trabajos ejecutados: {ejecutados}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app, db
+from patient_delete import purge_deleted_pacientes, DELETE_BATCH_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Elimina definitivamente los pacientes marcados como eliminados (modo diferido).")
+    parser.add_argument("--lote", type=int, default=DELETE_BATCH_SIZE, help="Pacientes por transacción")
+    parser.add_argument("--limite", type=int, help="Máximo de pacientes a purgar en esta ejecución")
+    args = parser.parse_args()
+    if args.lote <= 0 or (args.limite is not None and args.limite <= 0):
+        parser.error("--lote y --limite deben ser positivos")
+
+    with app.app_context():
+        try:
+            purged = purge_deleted_pacientes(batch_size=args.lote, limit=args.limite)
+            print(f"Pacientes purgados: {purged}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al purgar pacientes: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
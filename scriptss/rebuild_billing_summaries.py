@@ -0,0 +1,20 @@
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app, db
+from billing_summary import rebuild_billing_summaries
+
+if __name__ == "__main__":
+    with app.app_context():
+        try:
+            rebuild_billing_summaries()
+            db.session.commit()
+            print("Tablas de resumen de facturación reconstruidas.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al reconstruir los resúmenes: {e}")
+            sys.exit(1)
@@ -0,0 +1,20 @@
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app, db
+from history_search import rebuild_search_index
+
+if __name__ == "__main__":
+    with app.app_context():
+        try:
+            rebuild_search_index()
+            db.session.commit()
+            print("Índice de búsqueda de historias clínicas reconstruido.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al reconstruir el índice de búsqueda: {e}")
+            sys.exit(1)
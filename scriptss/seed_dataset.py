@@ -0,0 +1,47 @@
+import argparse
+import sys
+import os
+import time
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app, db
+from schema_upgrade import upgrade_schema
+from seed_data import seed_dataset, DEFAULT_CHUNK_SIZE
+from billing_summary import rebuild_billing_summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Genera un conjunto de datos sintético y determinista para pruebas de carga.")
+    parser.add_argument("--pacientes", type=int, required=True,
+                        help="Cantidad de pacientes (≈10 ítems de factura por paciente)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla del generador (mismos datos con la misma semilla)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_SIZE, help="Pacientes por transacción")
+    args = parser.parse_args()
+    if args.pacientes <= 0 or args.chunk <= 0:
+        parser.error("--pacientes y --chunk deben ser positivos")
+
+    started = time.perf_counter()
+
+    def progress(done):
+        elapsed = time.perf_counter() - started
+        print(f"\r{done}/{args.pacientes} pacientes ({done / elapsed:.0f}/s)", end="", file=sys.stderr, flush=True)
+
+    with app.app_context():
+        upgrade_schema()
+        report = seed_dataset(args.pacientes, seed=args.semilla, chunk_size=args.chunk, progress=progress)
+        print(file=sys.stderr)
+        rebuild_billing_summaries()
+        db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    for name, count in report.as_dict().items():
+        print(f"{name}: {count}")
+    print(f"Tiempo total: {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import json
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from slow_query_log import read_entries, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resume el registro de consultas lentas (peores primero).")
+    parser.add_argument("--log", default=os.environ.get("SLOW_QUERY_LOG_PATH")
+                        or os.path.join(project_root, "instance", "slow_queries.log"),
+                        help="Archivo de registro (se leen también sus copias rotadas)")
+    parser.add_argument("--top", type=int, default=10, help="Cantidad de consultas a mostrar")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    summary = summarize(read_entries(args.log), top=args.top)
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    if not summary:
+        print(f"No hay consultas lentas registradas en {args.log}.")
+        return
+
+    for position, item in enumerate(summary, start=1):
+        scan = "  [RECORRIDO COMPLETO]" if item["full_scan"] else ""
+        print(f"{position}. total {item['total_ms']:.1f} ms | {item['count']} veces | "
+              f"prom. {item['avg_ms']:.1f} ms | máx. {item['max_ms']:.1f} ms{scan}")
+        print(f"   endpoints: {', '.join(item['endpoints']) or '-'}")
+        print(f"   {item['statement'][:300]}")
+        for step in item["plan"]:
+            print(f"     plan: {step}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import sys
+import os
+
+# Adjust Python path to include the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from index import app
+from schema_upgrade import upgrade_schema
+
+if __name__ == "__main__":
+    with app.app_context():
+        changes = upgrade_schema()
+    if changes:
+        print("Esquema actualizado:")
+        for change in changes:
+            print(f"  - {change}")
+    else:
+        print("El esquema ya está actualizado.")
@@ -0,0 +1,277 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, insert, select, text
+
+from models import (db, Paciente, HistoriaClinica, Cita, Recurso, Diagnostico, Tratamiento, Factura,
+                    ItemFactura, SecuenciaFactura, historia_diagnostico_association,
+                    historia_tratamiento_association)
+
+# Synthetic clinic dataset for load testing.
+# Rows are generated from a seeded random.Random, so the same seed and size give the
+# same data on an empty database, and written with Core executemany inserts in
+# chunks of patients (explicit primary keys, no ORM unit of work; on PostgreSQL the
+# id sequences are moved past them after each chunk). Columns the ORM normally
+# fills (version, updated_at, cita.fecha_fin, subtotals and totals) are computed
+# here. Appointments only get a resource that is free at that time, so resource
+# bookings never overlap. Billing summaries are rebuilt by the caller afterwards.
+
+FECHA_REFERENCIA = datetime(2025, 1, 1)  # fixed, so the data does not depend on today's date
+ANIOS_HISTORIA = 5
+DEFAULT_CHUNK_SIZE = 2000  # patients per transaction
+
+# Average rows per patient (each count is drawn uniformly from 0..2*average)
+PROFILE = {
+    'historias': 3,
+    'citas': 4,
+    'facturas': 2,
+    'items_por_factura': 5,
+    'diagnosticos_por_historia': 1,
+    'tratamientos_por_historia': 1,
+}
+
+NOMBRES = ('Ana', 'Luis', 'María', 'José', 'Carmen', 'Juan', 'Lucía', 'Pedro', 'Sofía', 'Diego',
+           'Valentina', 'Andrés', 'Camila', 'Jorge', 'Paula', 'Miguel', 'Daniela', 'Carlos', 'Laura', 'Santiago')
+APELLIDOS = ('García', 'Rodríguez', 'López', 'Martínez', 'González', 'Pérez', 'Sánchez', 'Ramírez', 'Torres',
+             'Flores', 'Rivera', 'Gómez', 'Díaz', 'Vargas', 'Castro', 'Romero', 'Herrera', 'Medina', 'Rojas', 'Morales')
+CALLES = ('Av. Principal', 'Calle 10', 'Carrera 7', 'Av. Libertador', 'Calle Sucre', 'Pasaje Bolívar')
+MOTIVOS = ('Control general', 'Dolor abdominal', 'Cefalea', 'Fiebre', 'Tos persistente', 'Dolor lumbar',
+           'Crisis de asma', 'Hipertensión arterial', 'Control de diabetes', 'Chequeo preventivo',
+           'Dolor torácico', 'Mareos', 'Erupción cutánea', 'Dolor articular', 'Insomnio')
+OBSERVACIONES = ('Paciente refiere mejoría parcial.', 'Se indica reposo relativo.', 'Se solicitan estudios de laboratorio.',
+                 'Se ajusta la dosis de la medicación.', 'Signos vitales dentro de parámetros normales.',
+                 'Se indica salbutamol a demanda.', 'Se deriva a especialista.', 'Control en dos semanas.',
+                 'Antecedentes familiares de hipertensión.', 'Sin alergias conocidas.')
+ESTADOS = ('Pendiente', 'Pagada', 'Pagada', 'Pagada', 'Anulada')
+DURACIONES = (15, 30, 30, 30, 45, 60)
+
+
+class SeedReport:
+    def __init__(self):
+        self.counts = dict.fromkeys(('pacientes', 'historias', 'diagnosticos_asociados', 'tratamientos_asociados',
+                                     'citas', 'facturas', 'items'), 0)
+
+    def as_dict(self):
+        return dict(self.counts)
+
+
+def _next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _ensure_catalog():
+    """Seed catalog (diagnósticos, tratamientos, recursos), created once and reused; it does not draw from the seeded RNG."""
+    if not db.session.query(Diagnostico.id).filter(Diagnostico.codigo.like('SEED-D%')).first():
+        db.session.execute(insert(Diagnostico), [
+            {'codigo': f'SEED-D{n:04d}', 'descripcion': f'{MOTIVOS[n % len(MOTIVOS)]} (diagnóstico sintético {n})'}
+            for n in range(1, 201)])
+    if not db.session.query(Tratamiento.id).filter(Tratamiento.codigo.like('SEED-T%')).first():
+        db.session.execute(insert(Tratamiento), [
+            {'codigo': f'SEED-T{n:03d}', 'descripcion': f'Tratamiento sintético {n}',
+             'costo': Decimal(1000 + (n * 7919) % 49000) / 100}
+            for n in range(1, 51)])
+    if not db.session.query(Recurso.id).filter(Recurso.nombre.like('SEED %')).first():
+        db.session.execute(insert(Recurso), [
+            {'nombre': f'SEED Consultorio {n}', 'tipo': 'consultorio', 'activo': True} for n in range(1, 11)])
+    db.session.commit()
+
+    diagnosticos = [row.id for row in db.session.query(Diagnostico.id).filter(Diagnostico.codigo.like('SEED-D%'))
+                    .order_by(Diagnostico.id)]
+    tratamientos = [(row.id, row.descripcion, row.costo) for row in
+                    db.session.query(Tratamiento.id, Tratamiento.descripcion, Tratamiento.costo)
+                    .filter(Tratamiento.codigo.like('SEED-T%')).order_by(Tratamiento.id)]
+    recursos = [row.id for row in db.session.query(Recurso.id).filter(Recurso.nombre.like('SEED %'))
+                .order_by(Recurso.id)]
+    return diagnosticos, tratamientos, recursos
+
+
+def _resource_bookings(recursos):
+    """Existing bookings of the seed resources, as {(recurso_id, day): [(inicio, fin), ...]}."""
+    bookings = defaultdict(list)
+    if recursos:
+        for recurso_id, inicio, fin in db.session.query(Cita.recurso_id, Cita.fecha_hora, Cita.fecha_fin) \
+                .filter(Cita.recurso_id.in_(recursos)):
+            bookings[(recurso_id, inicio.date())].append((inicio, fin))
+    return bookings
+
+
+def _free_resource(recursos, bookings, start, inicio, fin):
+    """First resource, trying them in order from index start, with no booking overlapping [inicio, fin); or None."""
+    for offset in range(len(recursos)):
+        recurso_id = recursos[(start + offset) % len(recursos)]
+        ocupado = bookings[(recurso_id, inicio.date())]
+        if all(fin <= otro_inicio or inicio >= otro_fin for otro_inicio, otro_fin in ocupado):
+            ocupado.append((inicio, fin))
+            return recurso_id
+    return None
+
+
+def _advance_sequences():
+    # Rows are inserted with explicit ids, which do not move PostgreSQL's SERIAL sequences
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in (Paciente, HistoriaClinica, Cita, Factura, ItemFactura):
+        table = model.__tablename__
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"))
+
+
+def _invoice_counters():
+    """Last invoice number per year, from secuencia_factura and existing INV-<year>- numbers."""
+    counters = {anio: ultimo for anio, ultimo in db.session.query(SecuenciaFactura.anio, SecuenciaFactura.ultimo_numero)}
+    for (numero,) in db.session.query(Factura.numero_factura).filter(Factura.numero_factura.like('INV-%')):
+        parts = numero.split('-')
+        try:
+            anio, ultimo = int(parts[1]), int(parts[-1])
+        except (ValueError, IndexError):
+            continue
+        counters[anio] = max(counters.get(anio, 0), ultimo)
+    return counters
+
+
+def _random_datetime(rng, inicio, fin):
+    return inicio + timedelta(seconds=rng.randrange(int((fin - inicio).total_seconds())))
+
+
+def _count(rng, average):
+    return rng.randint(0, 2 * average)
+
+
+def seed_dataset(num_pacientes, seed=42, chunk_size=DEFAULT_CHUNK_SIZE, profile=None, progress=None):
+    """
+    Inserts num_pacientes synthetic patients with their histories (and diagnosis /
+    treatment associations), appointments and invoices with items. Commits after
+    every chunk of patients; `progress(pacientes_done)` is called after each one.
+    Returns a SeedReport. Requires an application context.
+    """
+    profile = dict(PROFILE, **(profile or {}))
+    rng = random.Random(seed)
+    report = SeedReport()
+    diagnosticos, tratamientos, recursos = _ensure_catalog()
+    invoice_counters = _invoice_counters()
+    bookings = _resource_bookings(recursos)
+
+    ids = {model: _next_id(model) for model in (Paciente, HistoriaClinica, Cita, Factura, ItemFactura)}
+    desde = FECHA_REFERENCIA - timedelta(days=365 * ANIOS_HISTORIA)
+    actualizado = FECHA_REFERENCIA  # updated_at of every row, fixed like the rest of the data
+
+    done = 0
+    while done < num_pacientes:
+        n = min(chunk_size, num_pacientes - done)
+        rows = {key: [] for key in ('pacientes', 'historias', 'hist_diag', 'hist_trat', 'citas', 'facturas', 'items')}
+
+        for _ in range(n):
+            paciente_id = ids[Paciente]
+            ids[Paciente] += 1
+            rows['pacientes'].append({
+                'id': paciente_id,
+                'nombre': f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}',
+                'edad': rng.randint(0, 95),
+                'documento': f'SEED{seed}-{paciente_id:09d}',
+                'telefono': f'3{rng.randrange(10**9):09d}',
+                'direccion': f'{rng.choice(CALLES)} #{rng.randint(1, 999)}',
+                'correo': f'paciente{paciente_id}@ejemplo.test',
+                'version': 1, 'updated_at': actualizado,
+            })
+
+            for _ in range(_count(rng, profile['historias'])):
+                historia_id = ids[HistoriaClinica]
+                ids[HistoriaClinica] += 1
+                rows['historias'].append({
+                    'id': historia_id, 'paciente_id': paciente_id,
+                    'fecha': _random_datetime(rng, desde, FECHA_REFERENCIA),
+                    'motivo': rng.choice(MOTIVOS),
+                    'observaciones': ' '.join(rng.sample(OBSERVACIONES, rng.randint(1, 4))),
+                    'version': 1, 'updated_at': actualizado,
+                })
+                for diagnostico_id in rng.sample(diagnosticos, min(len(diagnosticos), _count(rng, profile['diagnosticos_por_historia']))):
+                    rows['hist_diag'].append({'historia_clinica_id': historia_id, 'diagnostico_id': diagnostico_id})
+                for tratamiento in rng.sample(tratamientos, min(len(tratamientos), _count(rng, profile['tratamientos_por_historia']))):
+                    rows['hist_trat'].append({'historia_clinica_id': historia_id, 'tratamiento_id': tratamiento[0]})
+
+            # One appointment per day at most, so a patient never overlaps with themselves
+            num_citas = _count(rng, profile['citas'])
+            for dia in rng.sample(range(365 * ANIOS_HISTORIA), num_citas):
+                fecha_hora = desde + timedelta(days=dia, hours=rng.randint(8, 17), minutes=rng.choice((0, 15, 30, 45)))
+                duracion = rng.choice(DURACIONES)
+                fecha_fin = fecha_hora + timedelta(minutes=duracion)
+                # Both draws are always made, so the data that follows does not depend on existing bookings
+                con_recurso, primer_recurso = rng.random() < 0.8, rng.randrange(len(recursos))
+                rows['citas'].append({
+                    'id': ids[Cita], 'paciente_id': paciente_id,
+                    'fecha_hora': fecha_hora, 'duracion_minutos': duracion,
+                    'fecha_fin': fecha_fin,
+                    'recurso_id': (_free_resource(recursos, bookings, primer_recurso, fecha_hora, fecha_fin)
+                                   if con_recurso else None),
+                    'motivo': rng.choice(MOTIVOS),
+                    'notas': rng.choice(OBSERVACIONES) if rng.random() < 0.3 else None,
+                    'version': 1, 'updated_at': actualizado,
+                })
+                ids[Cita] += 1
+
+            for _ in range(_count(rng, profile['facturas'])):
+                factura_id = ids[Factura]
+                ids[Factura] += 1
+                fecha_emision = _random_datetime(rng, desde, FECHA_REFERENCIA)
+                invoice_counters[fecha_emision.year] = invoice_counters.get(fecha_emision.year, 0) + 1
+                total = Decimal('0.00')
+                for _ in range(max(1, _count(rng, profile['items_por_factura']))):
+                    tratamiento_id, descripcion, costo = rng.choice(tratamientos)
+                    if rng.random() < 0.2:
+                        tratamiento_id, descripcion, costo = None, 'Insumos', Decimal(rng.randrange(500, 5000)) / 100
+                    cantidad = rng.randint(1, 3)
+                    precio = (costo or Decimal('10.00')).quantize(Decimal('0.01'))
+                    subtotal = precio * cantidad
+                    total += subtotal
+                    rows['items'].append({
+                        'id': ids[ItemFactura], 'factura_id': factura_id, 'tratamiento_id': tratamiento_id,
+                        'descripcion': descripcion[:255], 'cantidad': cantidad,
+                        'precio_unitario': precio, 'subtotal': subtotal,
+                    })
+                    ids[ItemFactura] += 1
+                rows['facturas'].append({
+                    'id': factura_id, 'paciente_id': paciente_id,
+                    'numero_factura': f'INV-{fecha_emision.year}-{invoice_counters[fecha_emision.year]:04d}',
+                    'fecha_emision': fecha_emision,
+                    'fecha_vencimiento': (fecha_emision + timedelta(days=30)).date(),
+                    'total': total, 'estado': rng.choice(ESTADOS),
+                    'version': 1, 'updated_at': actualizado,
+                })
+
+        # Parents first; each executemany is one round trip per table
+        for key, table in (('pacientes', Paciente.__table__), ('historias', HistoriaClinica.__table__),
+                           ('hist_diag', historia_diagnostico_association),
+                           ('hist_trat', historia_tratamiento_association), ('citas', Cita.__table__),
+                           ('facturas', Factura.__table__), ('items', ItemFactura.__table__)):
+            if rows[key]:
+                db.session.execute(insert(table), rows[key])
+        _advance_sequences()
+        db.session.commit()
+
+        report.counts['pacientes'] += len(rows['pacientes'])
+        report.counts['historias'] += len(rows['historias'])
+        report.counts['diagnosticos_asociados'] += len(rows['hist_diag'])
+        report.counts['tratamientos_asociados'] += len(rows['hist_trat'])
+        report.counts['citas'] += len(rows['citas'])
+        report.counts['facturas'] += len(rows['facturas'])
+        report.counts['items'] += len(rows['items'])
+        done += n
+        if progress:
+            progress(done)
+
+    _store_invoice_counters(invoice_counters)
+    return report
+
+
+def _store_invoice_counters(counters):
+    # Keep secuencia_factura ahead of the generated numbers so new invoices do not collide
+    secuencia = SecuenciaFactura.__table__
+    for anio, ultimo in counters.items():
+        fila = db.session.get(SecuenciaFactura, anio)
+        if fila is None:
+            db.session.execute(insert(secuencia).values(anio=anio, ultimo_numero=ultimo))
+        elif fila.ultimo_numero < ultimo:
+            fila.ultimo_numero = ultimo
+    db.session.commit()
@@ -0,0 +1,188 @@
+import glob
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+
+from sql_timing import add_statement_listener
+
+# Slow-query log: every statement slower than SLOW_QUERY_LOG_MS is written as one
+# JSON line to a rotating file, with the Flask endpoint that ran it, the shape of
+# its bound parameters (types only, never values: they may hold patient data) and
+# the query plan. summarize() groups the log by statement for scriptss/slow_queries.py.
+
+DEFAULT_THRESHOLD_MS = 200
+DEFAULT_LOG_PATH = os.path.join('instance', 'slow_queries.log')
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 5
+
+logger = logging.getLogger('slow_query')
+logger.propagate = False
+
+_settings = {'threshold_ms': None}  # None: disabled
+_EXPLAIN_SAVEPOINT = 'slow_query_explain'
+
+
+def configure_slow_query_log(threshold_ms=None, path=None):
+    """
+    Enables the log (threshold from SLOW_QUERY_LOG_MS, default 200 ms; a negative
+    value disables it) writing to path (SLOW_QUERY_LOG_PATH, default
+    instance/slow_queries.log). Can be called again to change either setting.
+    """
+    if threshold_ms is None:
+        value = os.environ.get('SLOW_QUERY_LOG_MS')
+        threshold_ms = float(value) if value not in (None, '') else DEFAULT_THRESHOLD_MS
+    path = path or os.environ.get('SLOW_QUERY_LOG_PATH') or DEFAULT_LOG_PATH
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    if threshold_ms < 0:
+        _settings['threshold_ms'] = None
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    _settings['threshold_ms'] = threshold_ms
+
+
+def init_slow_query_log(app):
+    """Configures the log for the app; the log file goes to the app's instance folder by default."""
+    configure_slow_query_log(path=os.environ.get('SLOW_QUERY_LOG_PATH')
+                             or os.path.join(app.instance_path, 'slow_queries.log'))
+
+
+def _type_name(value):
+    return 'null' if value is None else type(value).__name__
+
+
+def parameter_shape(parameters, executemany=False):
+    """Types of the bound parameters, e.g. ['int', 'str'] or {'id': 'int'}."""
+    if executemany:
+        rows = list(parameters)
+        return {'rows': len(rows), 'row': parameter_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: _type_name(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_type_name(value) for value in parameters]
+    return _type_name(parameters)
+
+
+def _query_plan(cursor, dialect_name, statement, parameters):
+    # Run on a fresh DBAPI cursor so the EXPLAIN bypasses SQLAlchemy (and the timing hooks).
+    # It runs in the application's transaction: on PostgreSQL a failed statement aborts
+    # the transaction, so the EXPLAIN goes in a savepoint that is rolled back on error.
+    prefix = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}.get(dialect_name)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    savepoint = dialect_name == 'postgresql' and not getattr(cursor.connection, 'autocommit', False)
+    try:
+        explain_cursor = cursor.connection.cursor()
+        try:
+            if savepoint:
+                explain_cursor.execute(f'SAVEPOINT {_EXPLAIN_SAVEPOINT}')
+            try:
+                explain_cursor.execute(prefix + statement, parameters)
+                rows = explain_cursor.fetchall()
+            except Exception:
+                if savepoint:
+                    explain_cursor.execute(f'ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}')
+                raise
+            if savepoint:
+                explain_cursor.execute(f'RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}')
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    if dialect_name == 'sqlite':
+        return [row[-1] for row in rows]  # (id, parent, notused, detail)
+    return [row[0] for row in rows]
+
+
+def _log_slow_statement(conn, cursor, statement, parameters, executemany, seconds):
+    duration_ms = seconds * 1000
+    threshold_ms = _settings['threshold_ms']
+    if threshold_ms is None or duration_ms < threshold_ms:
+        return
+    entry = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'duration_ms': round(duration_ms, 2),
+        'endpoint': (request.endpoint or '<unmatched>') if has_request_context() else None,
+        'statement': ' '.join(statement.split()),
+        'params': parameter_shape(parameters, executemany),
+        'plan': None if executemany else _query_plan(cursor, conn.dialect.name, statement, parameters),
+    }
+    logger.warning(json.dumps(entry, ensure_ascii=False))
+
+
+add_statement_listener(_log_slow_statement)
+
+
+# --- Summary ---
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%\(\w+\)s|:\w+|__\[POSTCOMPILE_\w+\])\s*,?)+\)', re.IGNORECASE)
+
+
+def fingerprint(statement):
+    """Statement with literals and IN-lists collapsed, so repeats group together."""
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    return _IN_LIST.sub('IN (?...)', statement)
+
+
+def read_entries(path):
+    """Entries from the log and its rotated backups (oldest first)."""
+    paths = sorted(glob.glob(glob.escape(path) + '.*'), reverse=True) + [path]
+    for file_path in paths:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def summarize(entries, top=10):
+    """
+    Groups entries by statement fingerprint, worst total time first. Each group has
+    count, total_ms, max_ms, avg_ms, endpoints, the latest plan and whether that
+    plan contains a full table scan.
+    """
+    groups = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoints': set(), 'plan': None})
+    for entry in entries:
+        group = groups[fingerprint(entry['statement'])]
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        if entry.get('endpoint'):
+            group['endpoints'].add(entry['endpoint'])
+        if entry.get('plan'):
+            group['plan'] = entry['plan']
+
+    summary = []
+    for statement, group in groups.items():
+        plan = group['plan'] or []
+        summary.append({
+            'statement': statement,
+            'count': group['count'],
+            'total_ms': round(group['total_ms'], 2),
+            'max_ms': round(group['max_ms'], 2),
+            'avg_ms': round(group['total_ms'] / group['count'], 2),
+            'endpoints': sorted(group['endpoints']),
+            'plan': plan,
+            'full_scan': any(re.match(r'(SCAN|Seq Scan)\b', step.strip().lstrip('->').strip()) for step in plan),
+        })
+    summary.sort(key=lambda item: item['total_ms'], reverse=True)
+    return summary[:top]
@@ -0,0 +1,44 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statement timing shared by the metrics (metrics.py) and the slow-query log
+# (slow_query_log.py): one pair of Engine hooks measures every statement and
+# passes the duration to the registered listeners, so each statement is timed once.
+
+_listeners = []
+
+
+def add_statement_listener(listener):
+    """Calls listener(conn, cursor, statement, parameters, executemany, seconds) after every statement."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_statement_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    for listener in _listeners:
+        listener(conn, cursor, statement, parameters, executemany, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # The statement failed: drop its start time so the stack stays balanced
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz variants are written
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional: PNG images get no WebP copy
+    Image = None
+
+# Fingerprinted static files. scriptss/build_assets.py copies every file under
+# static/ to static/dist/ with a content hash in its name (styles.css ->
+# dist/styles.<hash>.css), writes precompressed .gz/.br variants of text assets,
+# WebP copies of PNG images and dist/manifest.json. When the manifest exists,
+# url_for('static', filename=...) returns the fingerprinted name, which is served
+# with a one-year immutable Cache-Control (a changed file gets a new name) and
+# the precompressed variant the client accepts. Without a build, static files
+# are served as before.
+
+DIST_SUBDIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+MIN_COMPRESS_SIZE = 256  # bytes; smaller files are not worth a variant
+WEBP_QUALITY = 85
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # in order of preference
+
+
+def fingerprint(logical_name, content):
+    stem, ext = os.path.splitext(logical_name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def _compressed_variants(content):
+    """{encoding: bytes} for the variants that are smaller than the original."""
+    variants = {'gzip': gzip.compress(content, compresslevel=9, mtime=0)}  # mtime=0: same input, same bytes
+    if brotli is not None:
+        variants['br'] = brotli.compress(content, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(content)}
+
+
+def _webp(content):
+    with Image.open(io.BytesIO(content)) as image:
+        output = io.BytesIO()
+        image.save(output, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return output.getvalue()
+
+
+def _emit(static_dir, logical_name, content, manifest):
+    """Writes one fingerprinted file (and its compressed variants); returns its name relative to static_dir."""
+    name = f'{DIST_SUBDIR}/{fingerprint(logical_name, content)}'
+    path = os.path.join(static_dir, *name.split('/'))
+    if not os.path.exists(path):  # same name, same content
+        _write(path, content)
+    if logical_name.lower().endswith(COMPRESSIBLE_EXTENSIONS) and len(content) >= MIN_COMPRESS_SIZE:
+        variants = _compressed_variants(content)
+        for encoding, suffix in ENCODINGS:
+            if encoding in variants:
+                _write(path + suffix, variants[encoding])
+        if variants:
+            manifest['encodings'][name] = sorted(variants)
+    return name
+
+
+def build_assets(static_dir, webp=True):
+    """
+    Fingerprints every file under static_dir (except dist/ itself) and writes the
+    manifest. Files from earlier builds are kept, so pages cached with the old
+    names still load (see prune_assets). Returns the manifest.
+    """
+    dist_dir = os.path.join(static_dir, DIST_SUBDIR)
+    manifest = {'assets': {}, 'webp': {}, 'encodings': {}}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            logical_name = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                content = f.read()
+            manifest['assets'][logical_name] = _emit(static_dir, logical_name, content, manifest)
+            if webp and Image is not None and logical_name.lower().endswith('.png'):
+                webp_name = os.path.splitext(logical_name)[0] + '.webp'
+                manifest['webp'][logical_name] = _emit(static_dir, webp_name, _webp(content), manifest)
+    _write(os.path.join(dist_dir, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def prune_assets(static_dir, manifest):
+    """Removes files in dist/ that the manifest does not reference. Returns how many."""
+    dist_dir = os.path.join(static_dir, DIST_SUBDIR)
+    keep = {MANIFEST_NAME}
+    for name in list(manifest['assets'].values()) + list(manifest['webp'].values()):
+        relative = name[len(DIST_SUBDIR) + 1:]
+        keep.add(relative)
+        keep.update(relative + suffix for _, suffix in ENCODINGS)
+    removed = 0
+    for root, _, files in os.walk(dist_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if os.path.relpath(path, dist_dir).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def load_manifest(static_dir):
+    """The manifest written by build_assets, or None when the assets were not built."""
+    path = os.path.join(static_dir, DIST_SUBDIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _state():
+    return current_app.extensions['static_assets']
+
+
+def _fingerprint_static_url(endpoint, values):
+    if endpoint != 'static':
+        return
+    manifest = _state()['manifest']
+    if manifest and values.get('filename') in manifest['assets']:
+        values['filename'] = manifest['assets'][values['filename']]
+
+
+def static_webp(filename):
+    """URL of the WebP copy of a static PNG, or None when there is none (for <picture> sources)."""
+    manifest = _state()['manifest']
+    if not manifest or filename not in manifest['webp']:
+        return None
+    return url_for('static', filename=manifest['webp'][filename])
+
+
+def _serve_static(filename):
+    state = _state()
+    manifest = state['manifest']
+    # Everything in dist/ is fingerprinted, including files of earlier builds
+    if not manifest or not filename.startswith(f'{DIST_SUBDIR}/') or filename.endswith(MANIFEST_NAME):
+        return state['fallback'](filename=filename)
+
+    folder = state['folder']
+    available = manifest['encodings'].get(filename, ())
+    encoding = next((name for name, _ in ENCODINGS
+                     if name in available and request.accept_encodings[name]), None)
+    suffix = dict(ENCODINGS).get(encoding, '')
+    response = send_from_directory(folder, filename + suffix, max_age=IMMUTABLE_MAX_AGE,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_static_assets(app):
+    """
+    Loads static/dist/manifest.json (if the assets were built), rewrites static
+    URLs to the fingerprinted names and serves those with far-future caching.
+    """
+    app.extensions['static_assets'] = {
+        'folder': app.static_folder,
+        'manifest': load_manifest(app.static_folder),
+        'fallback': app.view_functions['static'],
+    }
+    app.url_defaults(_fingerprint_static_url)
+    app.view_functions['static'] = _serve_static
+    app.jinja_env.globals['static_webp'] = static_webp
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+import database_config
+
+
+class TestDatabaseConfig(unittest.TestCase):
+
+    def test_default_url_is_local_sqlite(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(database_config.get_database_url(), "sqlite:///site.db")
+
+    def test_postgres_scheme_is_normalized(self):
+        with patch.dict(os.environ, {"DATABASE_URL": "postgres://u:p@db/clinica"}):
+            self.assertEqual(database_config.get_database_url(), "postgresql://u:p@db/clinica")
+
+    def test_postgres_profile_pool_options(self):
+        with patch.dict(os.environ, {"DB_POOL_SIZE": "4", "DB_MAX_OVERFLOW": "2"}):
+            options = database_config.get_engine_options("postgresql://u:p@db/clinica")
+        self.assertEqual(options["pool_size"], 4)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_invalid_integer_setting_raises(self):
+        with patch.dict(os.environ, {"DB_POOL_SIZE": "many"}):
+            with self.assertRaises(ValueError):
+                database_config.get_engine_options("postgresql://u:p@db/clinica")
+
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            url = f"sqlite:///{os.path.join(tmpdir, 'pragmas.db')}"
+            with patch.dict(os.environ, {"SQLITE_BUSY_TIMEOUT_MS": "1234"}):
+                engine = create_engine(url, **database_config.get_engine_options(url))
+                with engine.connect() as conn:
+                    self.assertEqual(conn.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+                    self.assertEqual(conn.execute(text("PRAGMA synchronous")).scalar(), 1) # NORMAL
+                    self.assertEqual(conn.execute(text("PRAGMA busy_timeout")).scalar(), 1234)
+                engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, cast, literal, null, or_, select, union_all
+
+from models import db, HistoriaClinica, Cita, Factura
+
+# Unified patient timeline: clinical histories, appointments and invoices merged
+# by one UNION ALL query, newest first, with keyset pagination over (fecha, tipo, id).
+# Each branch projects only the few columns the timeline shows (no Text columns),
+# is bounded by the cursor and by LIMIT, and reads the (paciente_id, fecha) indexes.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+TIPOS = ('cita', 'factura', 'historia')
+
+
+def _branches():
+    """(tipo, model id column, date column, select) for each event source."""
+    return (
+        ('historia', HistoriaClinica.id, HistoriaClinica.fecha, select(
+            literal('historia').label('tipo'),
+            HistoriaClinica.id.label('id'),
+            HistoriaClinica.fecha.label('fecha'),
+            HistoriaClinica.motivo.label('titulo'),
+            cast(null(), db.String(20)).label('estado'),
+            cast(null(), db.Numeric(10, 2)).label('importe'),
+        ).where(HistoriaClinica.paciente_id == db.bindparam('paciente_id'))),
+        ('cita', Cita.id, Cita.fecha_hora, select(
+            literal('cita').label('tipo'),
+            Cita.id.label('id'),
+            Cita.fecha_hora.label('fecha'),
+            Cita.motivo.label('titulo'),
+            cast(null(), db.String(20)).label('estado'),
+            cast(null(), db.Numeric(10, 2)).label('importe'),
+        ).where(Cita.paciente_id == db.bindparam('paciente_id'))),
+        ('factura', Factura.id, Factura.fecha_emision, select(
+            literal('factura').label('tipo'),
+            Factura.id.label('id'),
+            Factura.fecha_emision.label('fecha'),
+            Factura.numero_factura.label('titulo'),
+            Factura.estado.label('estado'),
+            Factura.total.label('importe'),
+        ).where(Factura.paciente_id == db.bindparam('paciente_id'))),
+    )
+
+
+def _after_cursor(tipo, id_column, date_column, cursor):
+    """
+    Keyset predicate for one branch. The branch's tipo is a constant, so the
+    (fecha, tipo, id) < cursor comparison reduces to a range on the branch's own
+    date column (and id on ties), which its index can serve.
+    """
+    fecha, cursor_tipo, cursor_id = cursor
+    if tipo < cursor_tipo:
+        return date_column <= fecha
+    if tipo > cursor_tipo:
+        return date_column < fecha
+    return or_(date_column < fecha, and_(date_column == fecha, id_column < cursor_id))
+
+
+def build_timeline_query(limit, cursor=None):
+    """
+    UNION ALL of the per-source selects, each already ordered and limited to
+    `limit` rows, then merged and limited again. Bind :paciente_id when executing.
+    """
+    parts = []
+    for tipo, id_column, date_column, stmt in _branches():
+        if cursor is not None:
+            stmt = stmt.where(_after_cursor(tipo, id_column, date_column, cursor))
+        branch = stmt.order_by(date_column.desc(), id_column.desc()).limit(limit).subquery(f'{tipo}_eventos')
+        parts.append(select(branch))
+    eventos = union_all(*parts).subquery('eventos')
+    return select(eventos).order_by(eventos.c.fecha.desc(), eventos.c.tipo.desc(), eventos.c.id.desc()).limit(limit)
+
+
+def encode_cursor(event):
+    raw = json.dumps([event['fecha'].isoformat(), event['tipo'], event['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        fecha, tipo, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if tipo not in TIPOS:
+            raise ValueError(tipo)
+        return datetime.fromisoformat(fecha), tipo, int(event_id)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido.')
+
+
+def timeline_page(paciente_id, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    One page of the patient's timeline, newest first.
+    Returns (events, next_cursor); events are row mappings with
+    tipo, id, fecha, titulo, estado and importe. next_cursor is None on the last page.
+    """
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    decoded = decode_cursor(cursor) if cursor else None
+    stmt = build_timeline_query(limit + 1, decoded)
+    events = db.session.execute(stmt, {'paciente_id': paciente_id}).mappings().all()
+    has_more = len(events) > limit
+    events = events[:limit]
+    return events, encode_cursor(events[-1]) if has_more else None
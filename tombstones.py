@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, literal, select
+
+from models import db, Eliminacion
+
+# Deletion tombstones for API sync. Every path that deletes rows of a synced
+# resource (patient purge, history / appointment deletion, invoice item removal)
+# records (recurso, id, eliminado_en) in the same transaction, and list requests
+# with updated_since return the tombstones written since then. Tombstones are
+# kept for TOMBSTONE_RETENTION_DAYS; a client that has not synced for longer must
+# do a full resync.
+
+TOMBSTONE_RETENTION_DAYS = 90
+
+
+def record_deleted(recurso, ids):
+    """Records tombstones for the given ids. Runs in the caller's transaction."""
+    ids = list(ids)
+    if ids:
+        now = datetime.utcnow()
+        db.session.execute(insert(Eliminacion), [{'recurso': recurso, 'recurso_id': row_id, 'eliminado_en': now}
+                                                 for row_id in ids])
+
+
+def record_deleted_select(recurso, id_select):
+    """Records tombstones for the ids returned by a SELECT, with one INSERT ... SELECT (set-based deletes)."""
+    db.session.execute(insert(Eliminacion).from_select(
+        ['recurso', 'recurso_id', 'eliminado_en'],
+        select(literal(recurso), id_select.subquery().c[0], literal(datetime.utcnow()))))
+
+
+def deleted_since(recursos, since):
+    """Tombstones of the given resources written after `since`, oldest first."""
+    return db.session.execute(
+        select(Eliminacion.recurso, Eliminacion.recurso_id, Eliminacion.eliminado_en)
+        .where(Eliminacion.recurso.in_(recursos), Eliminacion.eliminado_en > since)
+        .order_by(Eliminacion.eliminado_en, Eliminacion.id)
+    ).all()
+
+
+def prune_tombstones(days=TOMBSTONE_RETENTION_DAYS):
+    """Deletes tombstones older than `days`. Runs in the caller's transaction; returns how many."""
+    limit = datetime.utcnow() - timedelta(days=days)
+    return db.session.execute(Eliminacion.__table__.delete().where(Eliminacion.eliminado_en < limit)).rowcount
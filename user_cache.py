@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from models import db, User
+
+# Process-local cache of the user fields needed on every authenticated request.
+# Entries expire after USER_CACHE_TTL_SECONDS; updates and deletes through the ORM
+# invalidate them immediately in this process, the TTL bounds staleness in other workers.
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "1024"))
+
+_cache = OrderedDict()  # user_id -> (UserIdentity, expires_at)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+class UserIdentity(UserMixin):
+    """
+    Detached snapshot of a User used as Flask-Login's current_user.
+    It is not bound to any session, so it can be shared across requests
+    and threads; load the User model explicitly when it must be modified.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'<UserIdentity {self.id} - {self.username}>'
+
+
+def get_user_identity(user_id):
+    """
+    Returns the cached UserIdentity for user_id, querying only id and username
+    on a miss. Returns None (and caches nothing) if the user does not exist.
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is not None and entry[1] > now:
+            _cache.move_to_end(user_id)
+            _stats["hits"] += 1
+            return entry[0]
+        _stats["misses"] += 1
+
+    row = db.session.query(User.id, User.username).filter(User.id == user_id).first()
+    if row is None:
+        invalidate_user(user_id)
+        return None
+
+    identity = UserIdentity(row.id, row.username)
+    with _lock:
+        _cache[user_id] = (identity, now + USER_CACHE_TTL_SECONDS)
+        _cache.move_to_end(user_id)
+        while len(_cache) > USER_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return identity
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def clear_user_cache():
+    with _lock:
+        _cache.clear()
+
+
+def get_user_cache_stats():
+    with _lock:
+        return dict(_stats, size=len(_cache))
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_on_user_change(mapper, connection, target):
+    # Covers password changes (set_password + commit), renames and deletions
+    invalidate_user(target.id)
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, jsonify
+from sqlalchemy import text
+
+from models import db
+from local_icd_service import load_icd_data
+from catalog_cache import CATALOGS, get_catalog
+
+# Warm-up: work that would otherwise be paid by the first requests of a new
+# worker (database connections, the ICD file and its indexes, the catalog lists,
+# template compilation) is done at startup. /ready answers 503 until it has
+# finished, so a load balancer that probes it only routes warm workers. A failed
+# warm-up (e.g. the database is not reachable yet) is retried every
+# WARMUP_RETRY_SECONDS; /ready reports the error meanwhile.
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODES = ('sync', 'background', 'off')
+
+
+def _open_pool(app):
+    # Check out as many connections as the pool keeps, so none is opened on a request
+    pool = db.engine.pool
+    # QueuePool.size() is a method; SingletonThreadPool keeps size as an int (per-thread pool), others have none
+    size = pool.size() if callable(getattr(pool, 'size', None)) else 1
+    connections = [db.engine.connect() for _ in range(size)]
+    try:
+        for connection in connections:
+            connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            connection.close()  # back to the pool, still open
+    return {'conexiones': size}
+
+
+def _load_icd(app):
+    data = load_icd_data()
+    if data is None:  # the ICD pages report a missing file themselves; not a reason to stay unready
+        logger.warning('ICD data not available during warm-up')
+        return {'capitulos': 0}
+    return {'capitulos': len(data)}
+
+
+def _prime_catalogs(app):
+    return {table: len(get_catalog(table)) for table in CATALOGS}
+
+
+def _compile_templates(app):
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return {'plantillas': len(names)}
+
+
+WARMUP_STEPS = (
+    ('base_de_datos', _open_pool),
+    ('cie', _load_icd),
+    ('catalogos', _prime_catalogs),
+    ('plantillas', _compile_templates),
+)
+
+
+def _state(app):
+    return app.extensions['warmup']
+
+
+def run_warmup(app):
+    """Runs every warm-up step in an app context. Returns True (and marks the app ready) if all succeeded."""
+    state = _state(app)
+    state['intentos'] += 1
+    steps = {}
+    try:
+        with app.app_context():
+            for name, step in WARMUP_STEPS:
+                started = time.perf_counter()
+                steps[name] = dict(step(app), duracion_ms=round((time.perf_counter() - started) * 1000, 1))
+    except Exception as e:
+        logger.exception('warm-up failed', extra={'intento': state['intentos']})
+        state.update(error=f'{type(e).__name__}: {e}', pasos=steps)
+        return False
+    state.update(listo=True, error=None, pasos=steps, terminado_en=datetime.utcnow())
+    logger.info('warm-up finished', extra={'steps': steps})
+    return True
+
+
+def _warm_up_until_ready(app, retry_seconds):
+    while not run_warmup(app):
+        time.sleep(retry_seconds)
+
+
+def ready_view():
+    state = _state(current_app)
+    body = {
+        'estado': 'listo' if state['listo'] else ('error' if state['error'] else 'calentando'),
+        'pasos': state['pasos'],
+        'error': state['error'],
+        'intentos': state['intentos'],
+    }
+    return jsonify(body), 200 if state['listo'] else 503
+
+
+def init_warmup(app):
+    """
+    Registers /ready and starts the warm-up selected by WARMUP: 'sync' runs it
+    now (retrying in a thread if it fails), 'background' in a thread, 'off'
+    marks the app ready without warming up.
+    """
+    mode = app.config.get('WARMUP', 'sync')
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"WARMUP must be one of {', '.join(WARMUP_MODES)}, got {mode!r}")
+    app.extensions['warmup'] = {'listo': mode == 'off', 'error': None, 'pasos': {}, 'intentos': 0,
+                                'terminado_en': None}
+    app.add_url_rule('/ready', 'ready', ready_view)
+    if mode == 'off' or (mode == 'sync' and run_warmup(app)):
+        return
+    threading.Thread(target=_warm_up_until_ready, args=(app, app.config.get('WARMUP_RETRY_SECONDS', 5)),
+                     name='warmup', daemon=True).start()